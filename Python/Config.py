@@ -1,3 +1,4 @@
+import hashlib
 import numpy as np
 from math import sin, cos, pi
 #import tensorflow as tf
@@ -40,3 +41,36 @@ class Config(object):
 
     SAVE_FREQUENCY = 100            # Frequency of saving model checkpoints
     PRINTING_FREQUENCY = 50         # Frequency of printing out information during training
+
+
+# hash of every public attribute of Config, identifying the results computed with it
+def config_hash(overrides=None):
+    """
+    Hash of every public attribute of Config.
+
+    Parameters:
+    overrides (dict): Attributes to replace before hashing, e.g. {'VI': 1.3}. Default is None.
+
+    Returns:
+    str: Hex digest.
+    """
+    attrs = {k: v for k, v in vars(Config).items() if not k.startswith('_')}
+    attrs.update(overrides or {})
+    items = sorted((k, repr(v)) for k, v in attrs.items())
+    return hashlib.sha1(repr(items).encode()).hexdigest()
+
+def source_hash(*modules):
+    """
+    Hash of the source files of the given modules, for the keys of caches of computed results.
+
+    Parameters:
+    modules (module): Imported modules of the repository, e.g. vecgram.
+
+    Returns:
+    str: Hex digest.
+    """
+    h = hashlib.sha1()
+    for m in modules:
+        with open(m.__file__.replace('.pyc', '.py'), 'rb') as f:
+            h.update(f.read())
+    return h.hexdigest()
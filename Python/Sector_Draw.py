@@ -1,68 +1,82 @@
 import matplotlib.pyplot as plt
 from matplotlib.patches import Wedge
 from envelope import *
+from bulk_plot import add_segments, add_points, add_wedges, marker_steps
 from math import pi, atan2, degrees
 from Config import Config
 
 sector_angle = Config.SECTOR_ANGLE # sector angle of the defender
 
-# Set your initial conditions and parameters here
-# r1, r2 = 6.5, 6.54 # barrier
-
-# r1, r2 = 6.5, 6.1 # Intruder winning scenario
-
-r1, r2 = 6.1, 6.6 # Defender winning scenario
-
-# Generate the trajectories
-traj, ss, phis, rrs, ts = envelope_barrier(r1, r2)
-
-# Create the plot
-fig, ax = plt.subplots()
-
-# Plot the trajectories
-ax.plot(traj[:, 0], traj[:, 1], 'b-', alpha=0.8, label='Defender')
-ax.plot(traj[:, 2], traj[:, 3], color='xkcd:crimson', alpha=0.8, label='Intruder')
-
-# Draw the initial sector representing the capture range and mark initial positions
-xd_init, yd_init = traj[0, 0], traj[0, 1]
-theta_init = atan2(yd_init, xd_init)
-sector = Wedge((xd_init, yd_init), 2, degrees(theta_init - sector_angle / 2),
-               degrees(theta_init + sector_angle / 2), color='green', alpha=0.3)
-ax.add_patch(sector)
-
-# Loop through the trajectory data
-captured = False
-for i, (x_def, y_def, x_intr, y_intr) in enumerate(traj):
-    # Draw at every 50 steps and the last position
-    if i % 50 == 0 or i == len(traj) - 1:
-        # Draw the connecting lines
-        ax.plot([x_def, x_intr], [y_def, y_intr], 'k--', alpha=0.5)
-        
-        ax.plot(x_def, y_def, marker='o', color='b')  # Defender position
-        ax.plot(x_intr, y_intr, marker='o', color='xkcd:crimson')  # Intruder position
-
-        # Update the sector orientation
-        theta = atan2(y_intr - y_def, x_intr - x_def)  # Angle from defender to intruder
-        sector = Wedge((x_def, y_def), 2, degrees(theta - sector_angle / 2),
-                       degrees(theta + sector_angle / 2), color='gray', alpha=0.3)
-        ax.add_patch(sector)
-
-        # Check if intruder is captured
-        if is_within_sector(x_def, y_def, x_intr, y_intr, capture_radius=2, sector_angle=sector_angle):
-            captured = True
-            ax.plot(x_def, y_def, 'b^', markersize=10, label='Defender final')  # Final position marker for defender
-            ax.plot(x_intr, y_intr, color='xkcd:crimson', markersize=10, label='Intruder final')  # Final position marker for intruder
-            ax.text(x_def, y_def, 'Captured', fontsize=9, verticalalignment='bottom', horizontalalignment='right')
-            break
-
-# Add the legend after all items are plotted to ensure all labels are included
-ax.legend()
-
-# Set plot details
-ax.set_xlabel('x', fontsize=14)
-ax.set_ylabel('y', fontsize=14)
-ax.grid()
-ax.axis('equal')
-plt.savefig('traj_sector.png')
-plt.show()
+# the trajectories with the defender's capture sector every 50 steps, traj as returned by
+# envelope_barrier(..); the drawing stops at the first step the intruder is inside the sector
+def plot_traj_sector(traj, fname='traj_sector.png', rasterized=False):
+    """
+    Plots the trajectories of the defender and the intruder with the capture sectors of the defender.
 
+    Parameters:
+    traj (np.array): Trajectory in Cartesian coordinates, rows [x_D, y_D, x_I, y_I].
+    fname (str): File the figure is saved to. Default is 'traj_sector.png'.
+    rasterized (bool): Rasterize the sectors, markers and lines of sight. Default is False.
+
+    Returns:
+    matplotlib.figure.Figure: The figure.
+    """
+    # Create the plot
+    fig, ax = plt.subplots()
+
+    # Plot the trajectories
+    ax.plot(traj[:, 0], traj[:, 1], 'b-', alpha=0.8, label='Defender')
+    ax.plot(traj[:, 2], traj[:, 3], color='xkcd:crimson', alpha=0.8, label='Intruder')
+
+    # the steps drawn: every 50 steps and the last position, up to the first capture
+    idx = marker_steps(len(traj), 50)
+    x = traj[idx]
+    theta = np.arctan2(x[:, 3] - x[:, 1], x[:, 2] - x[:, 0])  # Angle from defender to intruder
+    distance = np.hypot(x[:, 2] - x[:, 0], x[:, 3] - x[:, 1])
+    inside = (distance <= 2) & (theta % (2 * pi) <= sector_angle)  # same test as is_within_sector
+    captured = inside.any()
+    if captured:
+        x, theta = x[:np.argmax(inside) + 1], theta[:np.argmax(inside) + 1]
+
+    # Draw the initial sector representing the capture range, then the sectors pointing at the intruder
+    theta_init = atan2(traj[0, 1], traj[0, 0])
+    add_wedges(ax, traj[0, :2], 2, degrees(theta_init - sector_angle / 2),
+               degrees(theta_init + sector_angle / 2), rasterized, color='green', alpha=0.3)
+    add_wedges(ax, x[:, :2], 2, np.degrees(theta - sector_angle / 2),
+               np.degrees(theta + sector_angle / 2), rasterized, color='gray', alpha=0.3)
+
+    # Draw the connecting lines and the positions
+    add_segments(ax, x[:, :2], x[:, 2:], rasterized, colors='k', linestyles='--', alpha=0.5)
+    add_points(ax, x[:, :2], rasterized, marker='o', color='b')  # Defender position
+    add_points(ax, x[:, 2:], rasterized, marker='o', color='xkcd:crimson')  # Intruder position
+
+    if captured:
+        x_def, y_def, x_intr, y_intr = x[-1]
+        ax.plot(x_def, y_def, 'b^', markersize=10, label='Defender final')  # Final position marker for defender
+        ax.plot(x_intr, y_intr, color='xkcd:crimson', markersize=10, label='Intruder final')  # Final position marker for intruder
+        ax.text(x_def, y_def, 'Captured', fontsize=9, verticalalignment='bottom', horizontalalignment='right')
+
+    # Add the legend after all items are plotted to ensure all labels are included
+    ax.legend()
+
+    # Set plot details
+    ax.set_xlabel('x', fontsize=14)
+    ax.set_ylabel('y', fontsize=14)
+    ax.grid()
+    ax.axis('equal')
+    plt.savefig(fname)
+    return fig
+
+
+if __name__ == '__main__':
+    # Set your initial conditions and parameters here
+    # r1, r2 = 6.5, 6.54 # barrier
+
+    # r1, r2 = 6.5, 6.1 # Intruder winning scenario
+
+    r1, r2 = 6.1, 6.6 # Defender winning scenario
+
+    # Generate the trajectories
+    traj, ss, phis, rrs, ts = envelope_barrier(r1, r2)
+    plot_traj_sector(traj)
+    plt.show()
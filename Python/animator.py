@@ -6,31 +6,30 @@ from envelope import *
 from overall_plot import *
 import matplotlib.tri as tri
 
-if __name__ == '__main__':
-
-    # Define initial conditions for the scenario (barrier case)
-	r1, r2 = 6.5, 6.54 # barrier
-	# resfig = [0, 15, 65, 89]
-	# r1, r2 = 6.5, 6.1 # Intruder winning scenario
-	# resfig = [0, 20, 50, 56]
-	# resfig = [0, 50, 90, 105, 110, 195, 210, 230, 240, 1200]
-	# r1, r2 = 6.1, 6.6 # Defender winning scenario
-	# resfig = [0, 50, 90, 105, 110, 195, 210, 230, 240, 1200]
+# left: the trajectory with the current positions, right: the vectogram of the current state
+def animate_traj(traj, ss, fname='barrier.mp4'):
+	"""
+    Animates an optimal trajectory together with its vectogram, one frame per time step.
 
-    # Generate the trajectory, states, control angles, ratios, and time stamps for the given scenario
-	traj, ss, phis, rrs, ts = envelope_barrier(r1, r2)
+    Parameters:
+    traj (np.array): Trajectory in Cartesian coordinates, rows [x_D, y_D, x_I, y_I].
+    ss (np.array): States of the trajectory, rows [rho_D, theta_D, rho_I, theta_I].
+    fname (str): File the animation is saved to. Default is 'barrier.mp4'.
 
-    # Create a matplotlib figure with two subplots
+    Returns:
+    matplotlib.animation.ArtistAnimation: The animation.
+    """
+	# Create a matplotlib figure with two subplots
 	fig, (ax1, ax2) = plt.subplots(nrows=1, ncols=2, figsize=(9, 4))
 	camera = Camera(fig) # Initialize the camera for animation
 
-    # Set labels and grid for the first subplot
+	# Set labels and grid for the first subplot
 	ax1.set_xlabel('x', fontsize=14)
 	ax1.set_ylabel('y', fontsize=14)
 	ax1.grid()
 	ax1.axis('equal')
 
-    # Set labels and grid for the second subplot (vectogram)
+	# Set labels and grid for the second subplot (vectogram)
 	ax2.set_xlabel(r'$\dot{\rho}_D$', fontsize=16)
 	ax2.set_ylabel(r'$\dot{\rho}_I$', fontsize=16)
 	ax2.grid()
@@ -41,7 +40,7 @@ if __name__ == '__main__':
 
 	# plt.show()
 
-    # Iterate over each time step to create frames for the animation
+	# Iterate over each time step to create frames for the animation
 	for i, (s, x) in enumerate(zip(ss, traj)):
 		print(i)
 		ax1.plot(traj[:,0], traj[:,1], 'b', alpha=0.8, linestyle='--', marker='o', markevery=5000000)
@@ -52,6 +51,23 @@ if __name__ == '__main__':
 		ax1.legend(['D', 'I'], fontsize=11, loc="upper right")	
 		camera.snap()
 
-    # Create and save the animation
+	# Create and save the animation
 	animation = camera.animate(interval=100)  
-	animation.save('barrier.mp4')
\ No newline at end of file
+	animation.save(fname)
+	return animation
+
+
+if __name__ == '__main__':
+
+    # Define initial conditions for the scenario (barrier case)
+	r1, r2 = 6.5, 6.54 # barrier
+	# resfig = [0, 15, 65, 89]
+	# r1, r2 = 6.5, 6.1 # Intruder winning scenario
+	# resfig = [0, 20, 50, 56]
+	# resfig = [0, 50, 90, 105, 110, 195, 210, 230, 240, 1200]
+	# r1, r2 = 6.1, 6.6 # Defender winning scenario
+	# resfig = [0, 50, 90, 105, 110, 195, 210, 230, 240, 1200]
+
+    # Generate the trajectory, states, control angles, ratios, and time stamps for the given scenario
+	traj, ss, phis, rrs, ts = envelope_barrier(r1, r2)
+	animate_traj(traj, ss)
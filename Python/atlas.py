@@ -0,0 +1,179 @@
+'''
+Vectogram atlas of a trajectory.
+
+The commented loop at the end of one_plot.py calls draw_vecgram(..) for every
+state of a trajectory, each call solving get_phi and the vectogram again and
+building a new figure. Here the vectograms of all the selected states are
+computed in one vectorized pass (velocity_vec_batch, get_phi_batch), then drawn
+by worker processes, each reusing one figure for all of its states, either as
+
+    mode='files'    vecgram_<step>.png, one per state, as draw_vecgram(..)
+    mode='sheet'    vecgram_sheet_<page>.png, small multiples of nrows x ncols states
+
+The steps are picked like the resfig lists of one_plot.py: a list of indices,
+a stride, or None for every state.
+'''
+
+import os
+import time
+import numpy as np
+from math import pi
+from concurrent.futures import ProcessPoolExecutor
+import matplotlib.pyplot as plt
+from vecgram import velocity_vec_batch, get_phi_batch
+
+# the same sampling of phi as draw_vecgram: 30 points phi <= 0, 30 points phi > 0, and -pi
+PHIS = np.concatenate([np.linspace(-pi, 0, 30), np.linspace(0.0, pi, 30), np.array([-pi])])
+
+
+def select_steps(n, steps=None):
+	"""
+    Indices of the states to draw.
+
+    Parameters:
+    n (int): Number of states of the trajectory.
+    steps (list or int): Indices (like resfig in one_plot.py), a stride, or None for every state.
+
+    Returns:
+    np.array: Sorted indices within range(n).
+    """
+	if steps is None:
+		return np.arange(n)
+	if np.isscalar(steps):
+		return np.arange(0, n, int(steps))
+	steps = np.unique(np.asarray(steps, dtype=int))
+	return steps[(steps >= 0) & (steps < n)]
+
+def vecgram_curves(r1, r2):
+	"""
+    Computes the vectograms of many states at once.
+
+    Parameters:
+    r1 (np.array): Radial distances of the defender from the target center, shape (K,).
+    r2 (np.array): Radial distances of the intruder from the target center, shape (K,).
+
+    Returns:
+    dict: 'v1', 'v2' the vectogram curves (K, 61) sampled at PHIS, 'v0' the velocity at phi = 0
+          (K, 2), 'phi' the optimal control (K,) and 'vo' the optimal velocity (K, 2).
+    """
+	r1, r2 = np.asarray(r1, dtype=float), np.asarray(r2, dtype=float)
+	v1, v2, _, _ = velocity_vec_batch(r1[:, None], r2[:, None], PHIS[None, :])
+	v10, v20, _, _ = velocity_vec_batch(r1, r2, np.zeros(len(r1)))
+	phi = get_phi_batch(r1, r2)
+	vo1, vo2, _, _ = velocity_vec_batch(r1, r2, phi)
+	return {'v1': v1, 'v2': v2, 'v0': np.stack([v10, v20], axis=-1), 'phi': phi,
+			'vo': np.stack([vo1, vo2], axis=-1)}
+
+def draw_vecgram_ax(ax, v1, v2, v0, vo, caption=None, legend=True, fontsize=14):
+	"""
+    Draws one vectogram, as draw_vecgram(..), from precomputed curves.
+
+    Parameters:
+    ax (matplotlib.axes.Axes): Axes object on which to draw.
+    v1, v2 (np.array): Vectogram curve sampled at PHIS.
+    v0 (np.array): Velocity at phi = 0.
+    vo (np.array): Velocity under the optimal control.
+    caption (str): Title of the axes, e.g. '(a)'.
+    legend (bool): Draw the legend. Default is True.
+    fontsize (int): Size of the legend, title and labels.
+    """
+	ax.plot(v1[0:30], v2[0:30], 'k-', label=r'$\phi\leq0$')
+	ax.plot(v1[30:-1], v2[30:-1], 'k--', label=r'$\phi>0$')
+	ax.plot(v1[:1], v2[:1], 'b.', label=r'$\phi = -\pi$')
+	ax.plot(v0[0], v0[1], 'g.', label=r'$\phi = 0$')
+	ax.plot([1.01 * vo[0], 0], [1.01 * vo[1], 0], 'r')
+	if legend:
+		ax.legend(fontsize=fontsize)
+	ax.set_xlabel(r'$\dot{\rho}_D$', fontsize=fontsize + 2)
+	ax.set_ylabel(r'$\dot{\rho}_I$', fontsize=fontsize + 2)
+	ax.grid()
+	if caption is not None:
+		ax.set_title(caption, fontsize=fontsize + 2)
+	ax.axis('equal')
+
+
+def _caption(i, k):
+	# sub-captions (a), (b), .. as in draw_vecgram while there are enough letters
+	return '(%s)'%chr(ord('a') + k) if k < 26 else 'step %d'%i
+
+# worker: one figure, cleared between states
+def _render_files(job):
+	steps, captions, curves, out_dir = job
+	fig, ax = plt.subplots()
+	for k, (i, cap) in enumerate(zip(steps, captions)):
+		ax.clear()
+		draw_vecgram_ax(ax, curves['v1'][k], curves['v2'][k], curves['v0'][k], curves['vo'][k], cap)
+		fig.savefig(os.path.join(out_dir, 'vecgram_%d.png'%i))
+	plt.close(fig)
+	return len(steps)
+
+# worker: one page of small multiples
+def _render_sheet(job):
+	page, steps, captions, curves, out_dir, nrows, ncols = job
+	fig, axes = plt.subplots(nrows, ncols, figsize=(3*ncols, 3*nrows), squeeze=False)
+	for k, ax in enumerate(axes.flat):
+		if k >= len(steps):
+			ax.axis('off')
+			continue
+		draw_vecgram_ax(ax, curves['v1'][k], curves['v2'][k], curves['v0'][k], curves['vo'][k],
+						captions[k], legend=(k == 0), fontsize=8)
+	fig.tight_layout()
+	fig.savefig(os.path.join(out_dir, 'vecgram_sheet_%d.png'%page))
+	plt.close(fig)
+	return len(steps)
+
+def vecgram_atlas(ss, steps=None, mode='files', out_dir='.', n_workers=None, nrows=3, ncols=4):
+	"""
+    Draws the vectograms of the states of a trajectory in parallel.
+
+    Parameters:
+    ss (np.array): States of the trajectory, rows [rho_D, theta_D, rho_I, theta_I].
+    steps (list or int): States to draw, see select_steps(). Default is every state.
+    mode (str): 'files' for one png per state, 'sheet' for pages of small multiples.
+    out_dir (str): Directory the images are saved to. Default is the working directory.
+    n_workers (int): Number of worker processes. Default is the number of CPUs.
+    nrows (int): Rows of a sheet. Default is 3.
+    ncols (int): Columns of a sheet. Default is 4.
+
+    Returns:
+    np.array: The steps that were drawn.
+    """
+	if mode not in ('files', 'sheet'):
+		raise ValueError('mode must be \'files\' or \'sheet\'')
+	if not os.path.isdir(out_dir):
+		os.makedirs(out_dir)
+	ss = np.asarray(ss)
+	idx = select_steps(len(ss), steps)
+	curves = vecgram_curves(ss[idx, 0], ss[idx, 2])
+	caps = [_caption(i, k) for k, i in enumerate(idx)]
+
+	n_workers = os.cpu_count() if n_workers is None else n_workers
+	size = nrows*ncols if mode == 'sheet' else max(1, -(-len(idx)//n_workers))
+	jobs = []
+	for p, a in enumerate(range(0, len(idx), size)):
+		part = {k: v[a:a + size] for k, v in curves.items()}
+		if mode == 'sheet':
+			jobs.append((p, idx[a:a + size], caps[a:a + size], part, out_dir, nrows, ncols))
+		else:
+			jobs.append((idx[a:a + size], caps[a:a + size], part, out_dir))
+
+	with ProcessPoolExecutor(n_workers) as pool:
+		list(pool.map(_render_sheet if mode == 'sheet' else _render_files, jobs))
+	return idx
+
+
+if __name__ == '__main__':
+	from envelope import envelope_barrier_batch
+
+	r1, r2 = 6.1, 6.6 # Defender winning scenario
+	resfig = [0, 50, 90, 105, 110, 195, 210, 230, 240, 1200]
+
+	ss, lengths, ts, _ = envelope_barrier_batch(r1, r2)
+	ss = ss[:lengths[0], 0]
+
+	t0 = time.time()
+	vecgram_atlas(ss, resfig, mode='files', out_dir='atlas')
+	print('%d vectograms (files): %.1f s'%(len(select_steps(len(ss), resfig)), time.time() - t0))
+	t0 = time.time()
+	idx = vecgram_atlas(ss, 10, mode='sheet', out_dir='atlas')
+	print('%d vectograms (sheets): %.1f s'%(len(idx), time.time() - t0))
@@ -0,0 +1,357 @@
+'''
+Build pipeline of the figures and data of the repository.
+
+one_plot.py, opttraj.py, Sector_Draw.py, animator.py and overall_plot.py each run
+envelope_barrier(..) again for the same scenarios, and overall_plot.py expects
+res/ and switch.csv to be made by hand first. Here every artifact is a job of a
+dependency graph:
+
+    trajectories ---> res
+         |       \--> traj_D_win, traj_I_win, barrier, *_sector, opttraj
+         |       \--> overall <--- switch
+         \----------> animation (only on request, needs celluloid)
+
+The trajectories of all scenarios are integrated once, together, with
+envelope_barrier_batch, and the figure jobs read them from build/trajectories.npz.
+Jobs whose dependencies are done run in parallel worker processes. A job is
+skipped when its outputs exist and its key, a hash of Config, the source of the
+job and of the modules of the repository it imports (followed transitively),
+its parameters and the keys of its dependencies, is the one stored when it was
+last built.
+
+    python build.py                     build everything that is out of date
+    python build.py overall -j 2        build one artifact and what it needs
+    python build.py --force             rebuild everything
+'''
+
+import matplotlib
+matplotlib.use('Agg')
+
+import os
+import ast
+import json
+import time
+import shutil
+import hashlib
+import inspect
+import textwrap
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+from Config import config_hash
+
+BUILD_DIR = 'build'
+# the modules of the repository sit next to build.py, whatever the working directory
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+STAMP_DIR = os.path.join(BUILD_DIR, '.stamps')
+
+# the three scenarios of the thesis, (rho_D, rho_I) at t = 0
+CASES = {'D_win': (6.1, 6.6), 'barrier': (6.5, 6.54), 'I_win': (6.5, 6.1)}
+
+
+class Job(object):
+	"""
+    One artifact of the build.
+
+    Parameters:
+    name (str): Name of the job, used on the command line and for its stamp.
+    func (callable): Builds the outputs, called as func(outputs, inputs, **params), inputs being
+                     the outputs of every dependency keyed by its name.
+    outputs (list): Files (or directories) written by the job, relative to the build directory.
+    deps (list): Names of the jobs whose outputs are needed.
+    params (dict): Parameters passed to func, part of the key.
+    default (bool): Built when no target is given. Default is True.
+    """
+	def __init__(self, name, func, outputs, deps=(), params=None, default=True):
+		self.name = name
+		self.func = func
+		self.outputs = [os.path.join(BUILD_DIR, o) for o in outputs]
+		self.deps = list(deps)
+		self.params = params or {}
+		self.default = default
+
+JOBS = {}
+
+def job(name, outputs, deps=(), default=True, **params):
+	"""
+    Decorator registering a function as a Job.
+    """
+	def register(func):
+		JOBS[name] = Job(name, func, outputs, deps, params, default)
+		return func
+	return register
+
+
+def _source_file(name):
+	return os.path.join(SRC_DIR, name + '.py')
+
+# hash of the source files of modules given by name, without importing them (see
+# Config.source_hash(..) for imported modules)
+def _file_hash(names):
+	h = hashlib.sha1()
+	for m in sorted(names):
+		with open(_source_file(m), 'rb') as f:
+			h.update(f.read())
+	return h.hexdigest()
+
+# names of the modules imported anywhere in the tree, except under if __name__ == '__main__'
+def _imports(tree):
+	names = set()
+	def visit(node):
+		if (isinstance(node, ast.If) and isinstance(node.test, ast.Compare)
+				and isinstance(node.test.left, ast.Name) and node.test.left.id == '__name__'):
+			return
+		if isinstance(node, ast.Import):
+			names.update(a.name.split('.')[0] for a in node.names)
+		elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+			names.add(node.module.split('.')[0])
+		for child in ast.iter_child_nodes(node):
+			visit(child)
+	visit(tree)
+	return names
+
+def job_modules(func):
+	"""
+    Modules of the repository a job uses: the ones imported by the job function, and by the
+    functions of build.py it calls, followed through the imports of their source files.
+    """
+	roots, seen_funcs, todo = set(), set(), [func]
+	while todo:
+		f = todo.pop()
+		if f in seen_funcs:
+			continue
+		seen_funcs.add(f)
+		tree = ast.parse(textwrap.dedent(inspect.getsource(f)))
+		roots |= _imports(tree)
+		for node in ast.walk(tree):
+			g = globals().get(node.id) if isinstance(node, ast.Name) else None
+			if inspect.isfunction(g) and g.__module__ == func.__module__:
+				todo.append(g)
+
+	modules, todo = set(), list(roots)
+	while todo:
+		m = todo.pop()
+		if m in modules or not os.path.exists(_source_file(m)):
+			continue
+		modules.add(m)
+		with open(_source_file(m), 'rb') as f:
+			todo.extend(_imports(ast.parse(f.read())))
+	return sorted(modules)
+
+def job_key(j, dep_keys):
+	"""
+    Key of a job: changes whenever Config, the code, the parameters or a dependency change.
+    """
+	h = hashlib.sha1()
+	for part in [config_hash(), _file_hash(job_modules(j.func)), inspect.getsource(j.func),
+				 json.dumps(j.params, sort_keys=True), json.dumps(j.outputs)] + dep_keys:
+		h.update(part.encode())
+	return h.hexdigest()
+
+def _stamp(name):
+	return os.path.join(STAMP_DIR, name + '.json')
+
+def up_to_date(j, key):
+	"""
+    True if the outputs of the job exist and were built with the same key.
+    """
+	if not all(os.path.exists(o) for o in j.outputs) or not os.path.exists(_stamp(j.name)):
+		return False
+	with open(_stamp(j.name)) as f:
+		return json.load(f).get('key') == key
+
+
+def _run_job(name, key):
+	# runs in a worker process: build, then write the stamp
+	j = JOBS[name]
+	inputs = {d: JOBS[d].outputs for d in j.deps}
+	for o in j.outputs:
+		if os.path.dirname(o) and not os.path.isdir(os.path.dirname(o)):
+			os.makedirs(os.path.dirname(o))
+	t0 = time.time()
+	j.func(j.outputs, inputs, **j.params)
+	with open(_stamp(name), 'w') as f:
+		json.dump({'key': key, 'outputs': j.outputs, 'time': time.time() - t0}, f)
+	return time.time() - t0
+
+
+def closure(targets):
+	"""
+    The targets and everything they depend on, in dependency order.
+    """
+	order, seen = [], set()
+	def visit(n):
+		if n in seen:
+			return
+		if n not in JOBS:
+			raise KeyError('unknown artifact \'%s\''%n)
+		seen.add(n)
+		for d in JOBS[n].deps:
+			visit(d)
+		order.append(n)
+	for t in targets:
+		visit(t)
+	return order
+
+def build(targets=None, force=False, n_workers=None, verbose=True):
+	"""
+    Builds the targets and their dependencies, skipping the artifacts that are up to date.
+
+    Parameters:
+    targets (list): Names of the jobs to build. Default is every default job.
+    force (bool): Rebuild even the artifacts that are up to date. Default is False.
+    n_workers (int): Number of worker processes. Default is the number of CPUs.
+    verbose (bool): Print what is built and skipped.
+
+    Returns:
+    dict: For every job, 'skipped' or the time it took to build in seconds.
+    """
+	targets = [n for n, j in JOBS.items() if j.default] if not targets else targets
+	order = closure(targets)
+	if not os.path.isdir(STAMP_DIR):
+		os.makedirs(STAMP_DIR)
+
+	keys = {}
+	for n in order:
+		keys[n] = job_key(JOBS[n], [keys[d] for d in JOBS[n].deps])
+
+	done, report, running = set(), {}, {}
+	pending = list(order)
+	with ProcessPoolExecutor(n_workers) as pool:
+		while pending or running:
+			for n in [n for n in pending if all(d in done for d in JOBS[n].deps)]:
+				pending.remove(n)
+				# a rebuilt dependency changes the key, so checking the own stamp is enough
+				if not force and up_to_date(JOBS[n], keys[n]):
+					done.add(n)
+					report[n] = 'skipped'
+					if verbose:
+						print('%-20s up to date'%n)
+				else:
+					running[pool.submit(_run_job, n, keys[n])] = n
+			if not running:
+				continue
+			finished, _ = wait(running, return_when=FIRST_COMPLETED)
+			for fut in finished:
+				n = running.pop(fut)
+				report[n] = fut.result()
+				done.add(n)
+				if verbose:
+					print('%-20s built in %.1f s'%(n, report[n]))
+	return report
+
+
+###################################### jobs ########################################
+
+# initial states of traj_generator.py, plus the three scenarios
+def scenario_grid():
+	from vecgram import r
+	r1s, r2s = [], []
+	for r0 in np.linspace(r, 7*r, 13):
+		r1l, r1u = (r0 - r)/2, (r0 + r)/2
+		for r1 in np.linspace(r1l+0.1, r1u-0.1, 13):
+			r2 = r0 - r1
+			# See equation (19)
+			if abs((r1**2 + r2**2 - r**2)/(2*r1*r2)) < 1:
+				r1s.append(r1)
+				r2s.append(r2)
+	for r1, r2 in CASES.values():
+		r1s.append(r1)
+		r2s.append(r2)
+	return np.asarray(r1s), np.asarray(r2s)
+
+def load_case(fname, r1, r2):
+	"""
+    Reads one trajectory back from the output of the trajectories job.
+
+    Returns:
+    tuple: Same as envelope_barrier: the trajectory in Cartesian coordinates, the states,
+           the optimal control angles, the ratios of radii and the time stamps.
+    """
+	from vecgram import get_phi_batch
+	data = np.load(fname)
+	i = int(np.argmin(np.hypot(data['r1'] - r1, data['r2'] - r2)))
+	n = data['lengths'][i]
+	ss = data['ss'][:n, i]
+	traj = np.stack([ss[:, 0]*np.cos(ss[:, 1]), ss[:, 0]*np.sin(ss[:, 1]),
+					 ss[:, 2]*np.cos(ss[:, 3]), ss[:, 2]*np.sin(ss[:, 3])], axis=-1)
+	return traj, ss, get_phi_batch(ss[:, 0], ss[:, 2]), ss[:, 2]/ss[:, 0], data['ts'][:n]
+
+@job('trajectories', ['trajectories.npz'], dt=0.05, t_max=60.)
+def build_trajectories(outputs, inputs, dt, t_max):
+	from envelope import envelope_barrier_batch
+	r1s, r2s = scenario_grid()
+	ss, lengths, ts, winner = envelope_barrier_batch(r1s, r2s, dt=dt, t_max=t_max)
+	np.savez(outputs[0], r1=r1s, r2=r2s, ss=ss, lengths=lengths, ts=ts, winner=winner)
+
+@job('res', ['res'], deps=['trajectories'])
+def build_res(outputs, inputs):
+	from retrograde import save_family
+	data = np.load(inputs['trajectories'][0])
+	if os.path.isdir(outputs[0]):
+		shutil.rmtree(outputs[0])
+	save_family([data['ss'][:n, i] for i, n in enumerate(data['lengths'])], root=outputs[0])
+
+@job('switch', ['switch.csv'])
+def build_switch(outputs, inputs):
+	from overall_plot import get_switchline
+	# get_switchline appends to the file
+	if os.path.exists(outputs[0]):
+		os.remove(outputs[0])
+	get_switchline(outputs[0])
+
+def _traj_figure(outputs, inputs, case):
+	import matplotlib.pyplot as plt
+	from one_plot import plot_traj
+	traj = load_case(inputs['trajectories'][0], *CASES[case])[0]
+	plt.close(plot_traj(traj, outputs[0]))
+
+def _sector_figure(outputs, inputs, case):
+	import matplotlib.pyplot as plt
+	from Sector_Draw import plot_traj_sector
+	traj = load_case(inputs['trajectories'][0], *CASES[case])[0]
+	plt.close(plot_traj_sector(traj, outputs[0]))
+
+# file names as in Figure/
+for case, fname in [('D_win', 'traj_D_win'), ('I_win', 'traj_I_win'), ('barrier', 'barrier')]:
+	job(fname, ['Figure/%s.png'%fname], deps=['trajectories'], case=case)(_traj_figure)
+	job(fname + '_sector', ['Figure/%s_sector.png'%fname], deps=['trajectories'], case=case)(_sector_figure)
+
+@job('opttraj', ['Figure/opttraj.png'], deps=['trajectories'], case='D_win')
+def build_opttraj(outputs, inputs, case):
+	import matplotlib.pyplot as plt
+	from opttraj import plot_opttraj
+	traj, _, _, _, ts = load_case(inputs['trajectories'][0], *CASES[case])
+	plt.close(plot_opttraj(traj, ts, outputs[0]))
+
+@job('overall', ['Figure/Optimal trajectories.png'], deps=['trajectories', 'switch'])
+def build_overall(outputs, inputs):
+	import matplotlib.pyplot as plt
+	from overall_plot import plot_overall, read_switchline
+	fname = inputs['trajectories'][0]
+	data = np.load(fname)
+	ss = [data['ss'][:n, i] for i, n in enumerate(data['lengths'])]
+	ssd = load_case(fname, *CASES['D_win'])[1]
+	ssb = load_case(fname, *CASES['barrier'])[1]
+	plt.close(plot_overall(ss, ssd, ssb, read_switchline(inputs['switch'][0]), outputs[0]))
+
+@job('animation', ['barrier.mp4'], deps=['trajectories'], default=False, case='barrier')
+def build_animation(outputs, inputs, case):
+	import matplotlib.pyplot as plt
+	from animator import animate_traj
+	traj, ss, _, _, _ = load_case(inputs['trajectories'][0], *CASES[case])
+	animate_traj(traj, ss, outputs[0])
+	plt.close('all')
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='Builds the figures and data that are out of date.')
+	parser.add_argument('targets', nargs='*', help='artifacts to build: ' + ', '.join(JOBS))
+	parser.add_argument('-j', '--jobs', type=int, default=None, help='number of worker processes')
+	parser.add_argument('-f', '--force', action='store_true', help='rebuild everything')
+	args = parser.parse_args()
+
+	t0 = time.time()
+	build(args.targets, args.force, args.jobs)
+	print('done in %.1f s'%(time.time() - t0))
@@ -0,0 +1,134 @@
+'''
+Bulk plotting with collections.
+
+Drawing every trajectory, marker and line of sight with its own ax.plot(..)
+creates one artist per call, which is what makes figures with thousands of
+trajectories slow to draw, save and keep in memory. The helpers below turn a
+whole layer, given as stacked arrays, into a single artist:
+
+    add_lines       list of polylines          -> one LineCollection
+    add_segments    pairs of points            -> one LineCollection
+    add_points      points                     -> one scatter (PathCollection)
+    add_wedges      sectors                    -> one PatchCollection
+
+With rasterized=True a layer is stored as a bitmap in vector outputs (pdf, svg),
+which keeps the files small for the heavy layers; the axes, labels and the light
+layers stay vector graphics.
+'''
+
+import time
+import numpy as np
+import matplotlib.pyplot as plt
+from matplotlib.collections import LineCollection, PatchCollection
+from matplotlib.patches import Wedge
+
+
+def add_lines(ax, lines, rasterized=False, **kwargs):
+	"""
+    Draws many polylines as a single LineCollection.
+
+    Parameters:
+    ax (matplotlib.axes.Axes): The axes to draw on.
+    lines (list): Arrays of shape (n_i, 2), the vertices of each polyline (lengths may differ).
+    rasterized (bool): Rasterize the layer in vector outputs. Default is False.
+    kwargs: Passed to LineCollection, e.g. colors, linestyles, linewidths, alpha, label, zorder.
+
+    Returns:
+    matplotlib.collections.LineCollection: The collection.
+    """
+	lc = LineCollection([np.asarray(l)[np.isfinite(l).all(axis=1)] for l in lines], **kwargs)
+	lc.set_rasterized(rasterized)
+	ax.add_collection(lc)
+	ax.autoscale_view()
+	return lc
+
+def add_segments(ax, p0, p1, rasterized=False, **kwargs):
+	"""
+    Draws the segments p0[i] -> p1[i] as a single LineCollection.
+
+    Parameters:
+    ax (matplotlib.axes.Axes): The axes to draw on.
+    p0 (np.array): Start points of shape (n, 2).
+    p1 (np.array): End points of shape (n, 2).
+    rasterized (bool): Rasterize the layer in vector outputs. Default is False.
+    kwargs: Passed to LineCollection.
+
+    Returns:
+    matplotlib.collections.LineCollection: The collection.
+    """
+	return add_lines(ax, np.stack([p0, p1], axis=1), rasterized, **kwargs)
+
+def add_points(ax, xy, rasterized=False, **kwargs):
+	"""
+    Draws markers at the points xy as a single scatter.
+
+    Parameters:
+    ax (matplotlib.axes.Axes): The axes to draw on.
+    xy (np.array): Points of shape (n, 2).
+    rasterized (bool): Rasterize the layer in vector outputs. Default is False.
+    kwargs: Passed to ax.scatter, e.g. marker, s, color, label, zorder.
+
+    Returns:
+    matplotlib.collections.PathCollection: The collection.
+    """
+	xy = np.asarray(xy).reshape(-1, 2)
+	return ax.scatter(xy[:, 0], xy[:, 1], rasterized=rasterized, **kwargs)
+
+def add_wedges(ax, centers, radius, theta1, theta2, rasterized=False, **kwargs):
+	"""
+    Draws sectors as a single PatchCollection.
+
+    Parameters:
+    ax (matplotlib.axes.Axes): The axes to draw on.
+    centers (np.array): Centers of shape (n, 2).
+    radius (float or np.array): Radius of the sectors.
+    theta1 (np.array): Start angles in degrees.
+    theta2 (np.array): End angles in degrees.
+    rasterized (bool): Rasterize the layer in vector outputs. Default is False.
+    kwargs: Passed to PatchCollection, e.g. facecolor, edgecolor, alpha.
+
+    Returns:
+    matplotlib.collections.PatchCollection: The collection.
+    """
+	centers = np.asarray(centers).reshape(-1, 2)
+	radius, theta1, theta2 = [np.broadcast_to(np.asarray(a, dtype=float), len(centers)) for a in (radius, theta1, theta2)]
+	pc = PatchCollection([Wedge(c, rr, t1, t2) for c, rr, t1, t2 in zip(centers, radius, theta1, theta2)],
+						 match_original=False, **kwargs)
+	pc.set_rasterized(rasterized)
+	ax.add_collection(pc)
+	ax.autoscale_view()
+	return pc
+
+def marker_steps(n, every, last=True):
+	"""
+    Indices of the steps 0, every, 2*every, .. of a trajectory of n steps, plus the last one.
+    """
+	idx = np.arange(0, n, every)
+	if last and n > 0 and idx[-1] != n - 1:
+		idx = np.append(idx, n - 1)
+	return idx
+
+
+if __name__ == '__main__':
+
+	# thousands of trajectories of the reduced game: one ax.plot per trajectory
+	# against a single LineCollection
+	from envelope import *
+	from retrograde import terminal_seeds, retrograde_barrier, forward_family
+
+	ss, lengths, ts = retrograde_barrier(terminal_seeds(n=60), t_max=20.)
+	family = forward_family(ss, lengths)
+	lines = [s[:, [0, 2]] for s in family]*20
+	print('%d trajectories, %d vertices'%(len(lines), sum(len(l) for l in lines)))
+
+	for name in ['plot', 'collection', 'collection, rasterized']:
+		fig, ax = plt.subplots()
+		t0 = time.time()
+		if name == 'plot':
+			for l in lines:
+				ax.plot(l[:, 0], l[:, 1], 'c-', alpha=0.6)
+		else:
+			add_lines(ax, lines, rasterized=name.endswith('rasterized'), colors='c', alpha=0.6)
+		fig.savefig('bulk_plot.pdf')
+		plt.close(fig)
+		print('%-24s %.2f s, %d artists'%(name, time.time() - t0, len(ax.lines) + len(ax.collections)))
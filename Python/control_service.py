@@ -0,0 +1,370 @@
+'''
+Control service of the defenders for hardware-in-the-loop tests.
+
+A client sends the live (rho_D, rho_I) of a defender and gets phi_D* back. The
+service listens on a Unix socket or on the loopback, one JSON object per line:
+
+    {"id": 7, "defender": "D1", "rho_D": 6.5, "rho_I": 6.54}    request
+    {"id": 7, "phi": -0.52, "fallback": false}                  response
+    {"id": 8, "op": "stats"}                                    latency report, answered with the same id
+    {"id": 9, "error": "..."}                                   response to a request without numeric rho_D, rho_I
+    {"id": null, "op": "error", "error": "bad request"}         response to a line that is not a JSON object
+
+Requests arriving together, from any connection, are coalesced into a micro
+batch (up to max_batch requests, or max_wait after the first one) and solved in
+one call of the solver in a worker thread:
+
+    PhiTable        phi on the feasible nodes of a grid of (rho_D, rho_I), computed
+                    once with get_phi_batch and kept on disk per hash of Config and
+                    vecgram.py; bilinear lookup of (cos, sin), the nearest node where
+                    the nodes of a cell disagree (switches of the control);
+                    get_phi_batch outside the grid and in the cells with an
+                    infeasible node, along the edges of the strip
+    BatchSolver     get_phi_batch, with a cache of the answers on a fine lattice
+
+A request not answered within the deadline, or whose batch made the solver
+fail, gets the last valid control of its defender (or null for a defender never
+answered), flagged as a fallback. The service keeps the latencies of the last
+requests for the p50/p99 report.
+
+    python control_service.py serve --unix /tmp/phi.sock
+    python control_service.py serve --port 8765 --solver batch
+    python control_service.py demo      4 defenders at 100 Hz against a local service
+'''
+
+import os
+import json
+import time
+import hashlib
+import asyncio
+import argparse
+from collections import deque, OrderedDict
+import numpy as np
+import vecgram
+from vecgram import get_phi_batch, r
+from Config import config_hash, source_hash
+
+
+class PhiTable(object):
+	"""
+    phi_D* tabulated on the feasible nodes of a grid of (rho_D, rho_I), NaN on the others.
+
+    Parameters:
+    lo, hi (float): Range of rho_D and rho_I. Default is 0.5..12.
+    n (int): Nodes per axis. Default is 461, a step of 0.025.
+    cache_dir (str): Directory of the tables. Default is 'build', next to the other build outputs.
+    jump (float): Spread of the angles of a cell, in radians, above which the nearest node is used.
+    """
+	def __init__(self, lo=0.5, hi=12., n=461, cache_dir='build', jump=0.5):
+		self.lo, self.hi, self.n, self.jump = lo, hi, n, jump
+		self.h = (hi - lo)/(n - 1)
+		# a table of another Config or another solver is never read
+		key = hashlib.sha1((config_hash() + source_hash(vecgram)).encode()).hexdigest()
+		fname = os.path.join(cache_dir, 'phi_table_%s_%g_%g_%d.npy'%(key[:12], lo, hi, n))
+		if os.path.exists(fname):
+			self.phi = np.load(fname)
+		else:
+			g = np.linspace(lo, hi, n)
+			r1, r2 = np.meshgrid(g, g, indexing='ij')
+			# strictly inside the strip: the vectogram degenerates on its edges |r1 - r2| = r
+			ok = (np.abs(r1 - r2) < r*(1 - 1e-9)) & (r1 + r2 > r*(1 + 1e-9))
+			self.phi = np.full(r1.shape, np.nan)
+			self.phi[ok] = get_phi_batch(r1[ok], r2[ok])
+			if not os.path.isdir(cache_dir):
+				os.makedirs(cache_dir)
+			np.save(fname, self.phi)
+		self.c, self.s = np.cos(self.phi), np.sin(self.phi)
+
+	def __call__(self, r1, r2):
+		r1, r2 = np.asarray(r1, dtype=float), np.asarray(r2, dtype=float)
+		out = np.empty(r1.shape)
+		inside = (r1 >= self.lo) & (r1 <= self.hi) & (r2 >= self.lo) & (r2 <= self.hi)
+		u, v = (r1[inside] - self.lo)/self.h, (r2[inside] - self.lo)/self.h
+		i, j = np.minimum(u.astype(int), self.n - 2), np.minimum(v.astype(int), self.n - 2)
+		nodes = [(i, j), (i + 1, j), (i, j + 1), (i + 1, j + 1)]
+		# cells with an infeasible node are solved exactly, as the queries outside the grid
+		edge = np.isnan(np.stack([self.phi[a, b] for a, b in nodes])).any(axis=0)
+		inside[inside] = ~edge
+		if (~inside).any():
+			out[~inside] = get_phi_batch(r1[~inside], r2[~inside])
+		u, v, i, j = u[~edge], v[~edge], i[~edge], j[~edge]
+		fu, fv = u - i, v - j
+		w = [(1 - fu)*(1 - fv), fu*(1 - fv), (1 - fu)*fv, fu*fv]
+		nodes = [(i, j), (i + 1, j), (i, j + 1), (i + 1, j + 1)]
+		c = sum(wk*self.c[a, b] for wk, (a, b) in zip(w, nodes))
+		s = sum(wk*self.s[a, b] for wk, (a, b) in zip(w, nodes))
+		phi = np.arctan2(s, c)
+		# cells crossed by a switch of the control: the nearest node
+		p = np.stack([self.phi[a, b] for a, b in nodes])
+		spread = np.abs((p - p[0] + np.pi) % (2*np.pi) - np.pi).max(axis=0)
+		near = spread > self.jump
+		phi[near] = self.phi[np.rint(u[near]).astype(int), np.rint(v[near]).astype(int)]
+		out[inside] = phi
+		return out
+
+class BatchSolver(object):
+	"""
+    get_phi_batch with a cache of the answers, keyed on a lattice of step quantum.
+
+    Parameters:
+    quantum (float): Lattice step of the cache keys. Default is 1e-4.
+    size (int): Number of cached answers. Default is 100000.
+    """
+	def __init__(self, quantum=1e-4, size=100000):
+		self.quantum, self.size = quantum, size
+		self.cache = OrderedDict()
+
+	def __call__(self, r1, r2):
+		keys = list(zip(np.rint(np.asarray(r1)/self.quantum).astype(int).tolist(),
+						np.rint(np.asarray(r2)/self.quantum).astype(int).tolist()))
+		todo = [k for k in dict.fromkeys(keys) if k not in self.cache]
+		if todo:
+			q = np.array(todo, dtype=float)*self.quantum
+			for k, phi in zip(todo, get_phi_batch(q[:, 0], q[:, 1])):
+				self.cache[k] = float(phi)
+		for k in keys:
+			self.cache.move_to_end(k)
+		while len(self.cache) > self.size:
+			self.cache.popitem(last=False)
+		return np.array([self.cache[k] for k in keys])
+
+
+class ControlServer(object):
+	"""
+    asyncio service answering phi_D* requests in micro batches.
+
+    Parameters:
+    solver (callable): Maps arrays rho_D, rho_I to phi_D*.
+    max_batch (int): Largest micro batch. Default is 64.
+    max_wait (float): Longest wait for a batch to fill after its first request. Default is 1 ms.
+    deadline (float): Time to answer a request before the fallback is sent. Default is 10 ms.
+    history (int): Number of latencies kept for the report. Default is 10000.
+    """
+	def __init__(self, solver, max_batch=64, max_wait=0.001, deadline=0.01, history=10000):
+		self.solver = solver
+		self.max_batch, self.max_wait, self.deadline = max_batch, max_wait, deadline
+		self.latency = deque(maxlen=history)
+		self.batch_sizes = deque(maxlen=history)
+		self.last = {}
+		self.n_requests, self.n_fallbacks = 0, 0
+		self.queue = None
+
+	async def _batcher(self):
+		loop = asyncio.get_running_loop()
+		while True:
+			batch = [await self.queue.get()]
+			t_end = loop.time() + self.max_wait
+			while len(batch) < self.max_batch:
+				try:
+					batch.append(await asyncio.wait_for(self.queue.get(), max(0., t_end - loop.time())))
+				except asyncio.TimeoutError:
+					break
+			q = np.array([(b[0], b[1]) for b in batch])
+			try:
+				phi = await loop.run_in_executor(None, self.solver, q[:, 0], q[:, 1])
+			except Exception as e:
+				for b in batch:
+					if not b[2].done():
+						b[2].set_exception(e)
+				continue
+			self.batch_sizes.append(len(batch))
+			for b, p in zip(batch, phi):
+				if not b[2].done():
+					b[2].set_result(float(p))
+
+	async def solve(self, defender, rho_D, rho_I):
+		"""
+        phi_D* for one measurement, or the last valid control of the defender past the deadline.
+
+        Returns:
+        tuple: phi (None if the defender has no valid control yet) and whether it is a fallback.
+        """
+		t0 = time.perf_counter()
+		fut = asyncio.get_running_loop().create_future()
+		await self.queue.put((rho_D, rho_I, fut))
+		try:
+			phi = await asyncio.wait_for(asyncio.shield(fut), self.deadline)
+			if np.isfinite(phi):
+				self.last[defender] = phi
+				fallback = False
+			else:
+				phi, fallback = self.last.get(defender), True
+		except Exception:
+			# past the deadline, or the solver failed on the batch
+			phi, fallback = self.last.get(defender), True
+		self.n_requests += 1
+		self.n_fallbacks += fallback
+		self.latency.append(time.perf_counter() - t0)
+		return phi, fallback
+
+	def stats(self):
+		"""
+        Latency percentiles in milliseconds, fallback count and mean batch size.
+        """
+		lat = 1e3*np.asarray(self.latency) if self.latency else np.zeros(1)
+		return {'requests': self.n_requests, 'fallbacks': self.n_fallbacks,
+				'p50_ms': float(np.percentile(lat, 50)), 'p99_ms': float(np.percentile(lat, 99)),
+				'max_ms': float(lat.max()), 'mean_batch': float(np.mean(self.batch_sizes)) if self.batch_sizes else 0.}
+
+	async def _handle(self, reader, writer):
+		# every reply carries the id of its request, or 'op': 'error' when the line was not
+		# a request at all, so that it cannot be taken for the answer to another request
+		async def answer(msg):
+			if msg.get('op') == 'stats':
+				out = dict(self.stats(), id=msg.get('id'), op='stats')
+			else:
+				try:
+					rho_D, rho_I = float(msg['rho_D']), float(msg['rho_I'])
+				except (KeyError, TypeError, ValueError):
+					out = {'id': msg.get('id'), 'error': 'rho_D and rho_I must be numbers'}
+				else:
+					phi, fallback = await self.solve(msg.get('defender'), rho_D, rho_I)
+					out = {'id': msg.get('id'), 'phi': phi, 'fallback': fallback}
+			writer.write((json.dumps(out) + '\n').encode())
+
+		# requests of one connection are answered as they complete, matched by id
+		tasks = set()
+		while True:
+			line = await reader.readline()
+			if not line:
+				break
+			try:
+				msg = json.loads(line)
+			except ValueError:
+				msg = None
+			if not isinstance(msg, dict):
+				writer.write(b'{"id": null, "op": "error", "error": "bad request"}\n')
+				continue
+			t = asyncio.ensure_future(answer(msg))
+			tasks.add(t)
+			t.add_done_callback(tasks.discard)
+		if tasks:
+			await asyncio.wait(tasks)
+		writer.close()
+
+	async def start(self, path=None, host='127.0.0.1', port=8765):
+		"""
+        Starts listening on the Unix socket path, or on host:port if path is None.
+
+        Returns:
+        asyncio.Server: The server, already serving.
+        """
+		self.queue = asyncio.Queue()
+		self._task = asyncio.ensure_future(self._batcher())
+		if path is not None:
+			if os.path.exists(path):
+				os.remove(path)
+			return await asyncio.start_unix_server(self._handle, path)
+		return await asyncio.start_server(self._handle, host, port)
+
+
+class ControlClient(object):
+	"""
+    Client of a ControlServer, several requests may be in flight on the connection.
+    """
+	async def connect(self, path=None, host='127.0.0.1', port=8765):
+		if path is not None:
+			self.reader, self.writer = await asyncio.open_unix_connection(path)
+		else:
+			self.reader, self.writer = await asyncio.open_connection(host, port)
+		self.pending, self.next_id = {}, 0
+		self._task = asyncio.ensure_future(self._read())
+		return self
+
+	async def _read(self):
+		while True:
+			line = await self.reader.readline()
+			if not line:
+				break
+			msg = json.loads(line)
+			fut = self.pending.pop(msg.get('id'), None)
+			if fut is not None and not fut.done():
+				fut.set_result(msg)
+
+	async def query(self, defender, rho_D, rho_I):
+		"""
+        Sends one measurement and waits for the answer.
+
+        Returns:
+        dict: The response, {'id', 'phi', 'fallback'}, or {'id', 'error'} for a bad request.
+        """
+		self.next_id += 1
+		fut = asyncio.get_running_loop().create_future()
+		self.pending[self.next_id] = fut
+		self.writer.write((json.dumps({'id': self.next_id, 'defender': defender, 'rho_D': rho_D, 'rho_I': rho_I}) + '\n').encode())
+		return await fut
+
+	async def stats(self):
+		self.next_id += 1
+		fut = asyncio.get_running_loop().create_future()
+		self.pending[self.next_id] = fut
+		self.writer.write((json.dumps({'id': self.next_id, 'op': 'stats'}) + '\n').encode())
+		return await fut
+
+	def close(self):
+		self._task.cancel()
+		self.writer.close()
+
+
+def make_solver(name):
+	return PhiTable() if name == 'table' else BatchSolver()
+
+async def _demo(args):
+	from envelope import envelope_barrier_batch
+
+	t0 = time.time()
+	server = ControlServer(make_solver(args.solver), deadline=args.deadline)
+	srv = await server.start(args.unix, port=args.port)
+	print('%s solver ready in %.1f s'%(args.solver, time.time() - t0))
+
+	# every defender replays the barrier trajectory from its own start, at rate Hz
+	ss, lengths, _, _ = envelope_barrier_batch([6.5, 6.1, 6.3, 6.7], [6.54, 6.6, 6.0, 6.2], dt=0.05)
+	errors = []
+
+	async def defender(k):
+		client = await ControlClient().connect(args.unix, port=args.port)
+		n = lengths[k]
+		for i in range(int(args.seconds*args.rate)):
+			s = ss[i % n, k]
+			t_next = time.perf_counter() + 1./args.rate
+			res = await client.query('D%d'%k, float(s[0]), float(s[2]))
+			if res['phi'] is not None and not res['fallback']:
+				errors.append((res['phi'], s[0], s[2]))
+			await asyncio.sleep(max(0., t_next - time.perf_counter()))
+		st = await client.stats() if k == 0 else None
+		client.close()
+		return st
+
+	res = await asyncio.gather(*[defender(k) for k in range(args.defenders)])
+	srv.close()
+	st = server.stats()
+	print('%d requests from %d defenders at %g Hz: p50 %.2f ms, p99 %.2f ms, max %.2f ms, %d fallbacks, mean batch %.1f'
+		  %(st['requests'], args.defenders, args.rate, st['p50_ms'], st['p99_ms'], st['max_ms'], st['fallbacks'], st['mean_batch']))
+	e = np.array(errors)
+	ref = get_phi_batch(e[:, 1], e[:, 2])
+	err = np.abs((e[:, 0] - ref + np.pi) % (2*np.pi) - np.pi)
+	print('difference to get_phi_batch: median %.1e, p99 %.1e rad'%(np.median(err), np.percentile(err, 99)))
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='phi_D* service for hardware-in-the-loop tests.')
+	parser.add_argument('command', choices=['serve', 'demo'])
+	parser.add_argument('--unix', default=None, help='Unix socket path (default: loopback TCP)')
+	parser.add_argument('--port', type=int, default=8765)
+	parser.add_argument('--solver', choices=['table', 'batch'], default='table')
+	parser.add_argument('--deadline', type=float, default=0.01, help='seconds')
+	parser.add_argument('--defenders', type=int, default=4)
+	parser.add_argument('--rate', type=float, default=100., help='Hz per defender (demo)')
+	parser.add_argument('--seconds', type=float, default=5.)
+	args = parser.parse_args()
+
+	if args.command == 'demo':
+		asyncio.run(_demo(args))
+	else:
+		async def serve():
+			server = ControlServer(make_solver(args.solver), deadline=args.deadline)
+			srv = await server.start(args.unix, port=args.port)
+			print('serving on %s'%(args.unix or '127.0.0.1:%d'%args.port))
+			async with srv:
+				await srv.serve_forever()
+		asyncio.run(serve())
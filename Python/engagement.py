@@ -0,0 +1,297 @@
+'''
+Engagement engine for N defenders against M intruders.
+
+vecgram.py and envelope.py solve one defender-intruder pair in the reduced
+coordinates (rho_D, rho_I). Here the same controls are applied to every pair of
+a larger engagement, for a batch of B scenarios at once:
+
+    positions           XD (B, N, 2), XI (B, M, 2), target at the origin
+    pairwise geometry   rho_D (B, N), rho_I (B, M), d, los, s (B, N, M)
+    assignment          defender n of scenario b chases intruder assign[b, n]
+
+phi_D (get_phi) is the deviation of the defender's heading from the line of
+sight D -> I, and phi_I (psi) the deviation of the intruder's heading from the
+same line, both measured with the sign s of the pair (s = 1 when the intruder is
+clockwise of the defender as seen from the target, as in velocity_vec).
+A pair farther apart than the capture radius is in Phase I, where the defender
+uses pure pursuit (phi = 0); inside the capture radius both play the optimal
+controls of the reduced game.
+'''
+
+import numpy as np
+from math import pi
+from scipy.optimize import linear_sum_assignment
+from vecgram import get_phi_batch, r, R, vd, vi
+from Config import Config
+
+sector_angle = Config.SECTOR_ANGLE # sector angle of the defender
+
+# status of each intruder
+ACTIVE, CAPTURED, BREACHED = 0, 1, 2
+
+
+def pairwise_geometry(XD, XI):
+	"""
+    Computes the geometry of every defender-intruder pair.
+
+    Parameters:
+    XD (np.array): Defender positions of shape (B, N, 2).
+    XI (np.array): Intruder positions of shape (B, M, 2).
+
+    Returns:
+    tuple: rho_D (B, N), rho_I (B, M), and the pairwise distance d, line-of-sight
+           angle los of D -> I and orientation sign s, each of shape (B, N, M).
+    """
+	rho_D = np.hypot(XD[..., 0], XD[..., 1])
+	rho_I = np.hypot(XI[..., 0], XI[..., 1])
+	dx = XI[:, None, :, 0] - XD[:, :, None, 0]
+	dy = XI[:, None, :, 1] - XD[:, :, None, 1]
+	d = np.hypot(dx, dy)
+	los = np.arctan2(dy, dx)
+	cross = XD[:, :, None, 0]*XI[:, None, :, 1] - XD[:, :, None, 1]*XI[:, None, :, 0]
+	s = np.where(cross > 0, -1., 1.)
+	return rho_D, rho_I, d, los, s
+
+
+# cost of sending defender n after intruder m: the time the defender needs to bring
+# the intruder inside its capture radius, minus the time the intruder needs to reach
+# the target. Intruders that are captured or have breached cost inf.
+def engagement_cost(rho_I, d, active):
+	"""
+    Builds the defender-to-intruder assignment cost matrices.
+
+    Parameters:
+    rho_I (np.array): Intruder distances from the target center, shape (B, M).
+    d (np.array): Pairwise distances, shape (B, N, M).
+    active (np.array): Boolean mask of the intruders still in play, shape (B, M).
+
+    Returns:
+    np.array: Cost matrices of shape (B, N, M).
+    """
+	cost = np.maximum(d - r, 0)/vd - (np.maximum(rho_I - R, 0)/vi)[:, None, :]
+	return np.where(active[:, None, :], cost, np.inf)
+
+
+# Hungarian assignment, one scenario at a time, but only for the scenarios whose
+# cost matrix moved by more than tol (or whose set of active intruders changed)
+# since the last time they were solved. The last solved matrices and assignments
+# are kept in cache between calls. With a single intruder (every defender chases
+# it) or a single defender (it takes the cheapest intruder) the assignment is
+# written in closed form for all the changed scenarios at once.
+def assign_defenders(cost, cache, tol=0.5):
+	"""
+    Assigns defenders to intruders, reusing the cached assignment where the cost has not changed.
+
+    Parameters:
+    cost (np.array): Cost matrices of shape (B, N, M) from engagement_cost().
+    cache (dict): Holds the last solved cost matrices and assignments, updated in place.
+    tol (float): Change of any cost entry (in seconds) that triggers a new assignment. Default is 0.5.
+
+    Returns:
+    tuple: Assignment of shape (B, N) (index of the intruder, -1 if none) and the number of
+           scenarios that were re-solved.
+    """
+	B, N, M = cost.shape
+	if cache.get('cost') is None or cache['cost'].shape != cost.shape:
+		cache['cost'] = np.full(cost.shape, np.inf)
+		cache['assign'] = np.full((B, N), -1)
+	old, assign = cache['cost'], cache['assign']
+
+	finite = np.isfinite(cost)
+	both = finite & np.isfinite(old)
+	drift = np.abs(np.subtract(cost, old, out=np.zeros(cost.shape), where=both))
+	changed = (finite != np.isfinite(old)).any(axis=(1, 2)) | (drift > tol).any(axis=(1, 2))
+
+	if M == 1 or N == 1:
+		c = np.where(finite[changed], cost[changed], np.inf)
+		a = np.zeros((len(c), N), dtype=int) if M == 1 else np.argmin(c, axis=2)
+		assign[changed] = np.where(finite[changed].any(axis=(1, 2))[:, None], a, -1)
+		old[changed] = cost[changed]
+		return assign, int(changed.sum())
+
+	for b in np.flatnonzero(changed):
+		a = np.full(N, -1)
+		if finite[b].any():
+			rows, cols = linear_sum_assignment(np.where(finite[b], cost[b], 1e6))
+			a[rows] = cols
+			# defenders left over (N > M, or matched to an inactive intruder) back up
+			# the intruder that is cheapest for them
+			spare = (a < 0) | ~finite[b, np.arange(N), np.maximum(a, 0)]
+			a[spare] = np.argmin(cost[b, spare], axis=1)
+		assign[b] = a
+		old[b] = cost[b]
+
+	return assign, int(changed.sum())
+
+
+def engagement_guidance(XD, XI, hD, status, cache, tol=0.5):
+	"""
+    Assigns the defenders and computes the headings of every player, updating hD in place
+    for the defenders that are chasing.
+
+    Parameters:
+    XD (np.array): Defender positions of shape (B, N, 2).
+    XI (np.array): Intruder positions of shape (B, M, 2).
+    hD (np.array): Defender headings of shape (B, N).
+    status (np.array): Intruder status of shape (B, M), one of ACTIVE, CAPTURED, BREACHED.
+    cache (dict): Assignment cache passed to assign_defenders().
+    tol (float): Reassignment tolerance passed to assign_defenders(). Default is 0.5.
+
+    Returns:
+    tuple: Assignment (B, N), chasing defenders (B, N), intruder headings (B, M), and the
+           rho_I, d and los of pairwise_geometry().
+    """
+	B, N, M = XD.shape[0], XD.shape[1], XI.shape[1]
+	rho_D, rho_I, d, los, s = pairwise_geometry(XD, XI)
+	active = status == ACTIVE
+	assign, _ = assign_defenders(engagement_cost(rho_I, d, active), cache, tol)
+
+	# defenders: pure pursuit in Phase I, get_phi in Phase II
+	bi, ni = np.arange(B)[:, None], np.arange(N)[None, :]
+	m = np.maximum(assign, 0)
+	chasing = assign >= 0
+	d_a, los_a, s_a = d[bi, ni, m], los[bi, ni, m], s[bi, ni, m]
+	phi = np.zeros((B, N))
+	p2 = chasing & (d_a <= r)
+	if p2.any():
+		phi[p2] = get_phi_batch(np.broadcast_to(rho_D, (B, N))[p2], rho_I[bi, m][p2], np.maximum(d_a[p2], 1e-6))
+	hD[chasing] = (los_a + s_a*phi)[chasing]
+
+	# intruders: straight to the target, best response to the nearest defender once
+	# inside its capture radius, see (22)
+	n_near = np.argmin(d, axis=1)
+	bj, mj = np.arange(B)[:, None], np.arange(M)[None, :]
+	d_n, los_n, s_n = d[bj, n_near, mj], los[bj, n_near, mj], s[bj, n_near, mj]
+	hI = np.arctan2(-XI[..., 1], -XI[..., 0])
+	threat = active & (d_n <= r)
+	if threat.any():
+		# the pair is often the one the nearest defender is chasing, whose phi is known
+		shared = threat & (assign[bj, n_near] == mj)
+		phi_n = np.where(shared, phi[bj, n_near], 0.)
+		new = threat & ~shared
+		if new.any():
+			phi_n[new] = get_phi_batch(rho_D[bj, n_near][new], np.broadcast_to(rho_I, (B, M))[new],
+									   np.maximum(d_n[new], 1e-6))
+		psi = -np.arccos(vd/vi*np.cos(phi_n[threat]))
+		hI[threat] = los_n[threat] + s_n[threat]*psi
+	return assign, chasing, hI, rho_I, d, los
+
+def engagement_step(XD, XI, hD, status, cache, dt, tol=0.5, sector_angle=sector_angle):
+	"""
+    Advances a batch of engagements by one time step, updating XD, XI, hD and status in place.
+
+    Parameters:
+    XD (np.array): Defender positions of shape (B, N, 2).
+    XI (np.array): Intruder positions of shape (B, M, 2).
+    hD (np.array): Defender headings of shape (B, N).
+    status (np.array): Intruder status of shape (B, M), one of ACTIVE, CAPTURED, BREACHED.
+    cache (dict): Assignment cache passed to assign_defenders().
+    dt (float): Time step.
+    tol (float): Reassignment tolerance passed to assign_defenders(). Default is 0.5.
+    sector_angle (float): Angle of the defender's capture sector, 2*pi for a disk.
+
+    Returns:
+    np.array: The assignment used during the step, shape (B, N).
+    """
+	assign, chasing, hI, rho_I, d, los = engagement_guidance(XD, XI, hD, status, cache, tol)
+	active = status == ACTIVE
+
+	# capture: inside the capture radius and inside the sector around the heading
+	off = (los - hD[:, :, None] + pi) % (2*pi) - pi
+	in_sector = (d <= r) & (np.abs(off) <= sector_angle/2)
+	status[active & in_sector.any(axis=1)] = CAPTURED
+	status[(status == ACTIVE) & (rho_I <= R)] = BREACHED
+
+	# constant heading over the step, idle defenders and finished intruders stay put
+	active = status == ACTIVE
+	XD += (vd*dt*chasing)[..., None]*np.stack([np.cos(hD), np.sin(hD)], axis=-1)
+	XI += (vi*dt*active)[..., None]*np.stack([np.cos(hI), np.sin(hI)], axis=-1)
+	return assign
+
+
+def run_engagement(XD0, XI0, hD0=None, dt=Config.TIME_STEP, t_max=60., tol=0.5,
+				   sector_angle=sector_angle, record=False):
+	"""
+    Simulates a batch of N-defender / M-intruder engagements until every intruder is
+    captured or has reached the target area, or until t_max.
+
+    Parameters:
+    XD0 (np.array): Initial defender positions, shape (B, N, 2) or (N, 2) for a single scenario.
+    XI0 (np.array): Initial intruder positions, shape (B, M, 2) or (M, 2).
+    hD0 (np.array): Initial defender headings of shape (B, N). Default points at the target.
+    dt (float): Time step. Default is Config.TIME_STEP.
+    t_max (float): Time horizon. Default is 60 seconds.
+    tol (float): Reassignment tolerance passed to assign_defenders(). Default is 0.5.
+    sector_angle (float): Angle of the defender's capture sector, 2*pi for a disk.
+    record (bool): If True, also return the positions at every step.
+
+    Returns:
+    tuple: Intruder status (B, M), time each intruder was captured or breached (B, M, nan if
+           still active), and the recorded positions (XDs, XIs) of shape (T, B, N, 2),
+           (T, B, M, 2) or None.
+    """
+	XD = np.array(XD0, dtype=float, ndmin=3)
+	XI = np.array(XI0, dtype=float, ndmin=3)
+	B, N, M = XD.shape[0], XD.shape[1], XI.shape[1]
+	hD = np.arctan2(-XD[..., 1], -XD[..., 0]) if hD0 is None else np.array(hD0, dtype=float).reshape(B, N)
+	status = np.full((B, M), ACTIVE)
+	t_end = np.full((B, M), np.nan)
+	cache = {}
+	XDs, XIs = [XD.copy()], [XI.copy()]
+
+	# only the scenarios with an active intruder are stepped: the players of a finished
+	# scenario do not move any more. live indexes the full arrays, the working copies
+	# (and the assignment cache) are cut down to it whenever a scenario finishes
+	live = np.arange(B)
+	xd, xi, hd, st = XD.copy(), XI.copy(), hD.copy(), status.copy()
+	t = 0
+	while t < t_max and len(live):
+		before = st == ACTIVE
+		engagement_step(xd, xi, hd, st, cache, dt, tol, sector_angle)
+		t += dt
+		t_end[live] = np.where(before & (st != ACTIVE), t, t_end[live])
+		XD[live], XI[live], status[live] = xd, xi, st
+		if record:
+			XDs.append(XD.copy())
+			XIs.append(XI.copy())
+		keep = (st == ACTIVE).any(axis=1)
+		if not keep.all():
+			live, xd, xi, hd, st = live[keep], xd[keep], xi[keep], hd[keep], st[keep]
+			cache['cost'], cache['assign'] = cache['cost'][keep], cache['assign'][keep]
+
+	traj = (np.asarray(XDs), np.asarray(XIs)) if record else None
+	return status, t_end, traj
+
+
+# random initial positions: defenders in the ring R..R+2r around the target,
+# intruders in the ring R+4r..R+8r
+def random_scenarios(B, N, M, rng=None):
+	"""
+    Draws random initial positions for a batch of engagements.
+
+    Parameters:
+    B (int): Number of scenarios.
+    N (int): Number of defenders.
+    M (int): Number of intruders.
+    rng (np.random.Generator): Random generator. Default is a new unseeded generator.
+
+    Returns:
+    tuple: Defender positions (B, N, 2) and intruder positions (B, M, 2).
+    """
+	rng = np.random.default_rng() if rng is None else rng
+	def ring(shape, lo, hi):
+		rho, tht = rng.uniform(lo, hi, shape), rng.uniform(-pi, pi, shape)
+		return np.stack([rho*np.cos(tht), rho*np.sin(tht)], axis=-1)
+	return ring((B, N), R, R + 2*r), ring((B, M), R + 4*r, R + 8*r)
+
+
+if __name__ == '__main__':
+	import time
+
+	for B, N, M in [(10000, 1, 1), (10000, 2, 1), (1000, 6, 6), (200, 24, 24)]:
+		XD0, XI0 = random_scenarios(B, N, M, np.random.default_rng(0))
+		t0 = time.time()
+		status, t_end, _ = run_engagement(XD0, XI0)
+		el = time.time() - t0
+		print('%d scenarios of %dD vs %dI: %.2f s, %.0f scenarios/s, captured %.1f%%, breached %.1f%%'
+			  %(B, N, M, el, B/el, 100*(status == CAPTURED).mean(), 100*(status == BREACHED).mean()))
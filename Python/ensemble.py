@@ -0,0 +1,193 @@
+'''
+Propagation of uncertain initial conditions through the optimal play.
+
+envelope_barrier(..) starts from one (rho_D, rho_I, theta_D). When the initial
+positions are noisy, the whole ensemble of initial conditions is integrated
+together with envelope_barrier_batch (envelope_dx_batch dynamics), and the
+spread of the outcomes is summarized:
+
+    P(defender wins), P(intruder wins)     weighted count of the winners
+    terminal time                          weighted quantiles, mean and spread
+    percentile bands                       of every state component over time
+
+The ensemble is given either as samples (equal weights, or weights of an
+importance sampler) or as a mean and covariance of (rho_D, rho_I, theta_D),
+from which sample_gaussian(..) draws samples or sigma_points(..) builds the
+2n+1 points of the unscented transform. Sigma points cost only 7 trajectories,
+but an outcome probability from 7 points is coarse: use them for the bands and
+the terminal time of an ensemble that stays on one side of the barrier, and
+samples near the barrier.
+'''
+
+import os
+import time
+import numpy as np
+from envelope import *
+
+
+def sample_gaussian(mean, cov, n=1000, rng=None):
+	"""
+    Draws initial conditions from a normal distribution.
+
+    Parameters:
+    mean (np.array): Mean of (rho_D, rho_I, theta_D).
+    cov (np.array): Covariance of shape (3, 3).
+    n (int): Number of samples. Default is 1000.
+    rng (np.random.Generator): Random generator. Default is a new unseeded generator.
+
+    Returns:
+    tuple: Samples of shape (n, 3) and equal weights of shape (n,).
+    """
+	rng = np.random.default_rng() if rng is None else rng
+	X = rng.multivariate_normal(mean, cov, n)
+	return X, np.full(n, 1./n)
+
+def sigma_points(mean, cov, alpha=1., beta=2., kappa=0.):
+	"""
+    Sigma points of the unscented transform, 2n+1 points for n = len(mean).
+
+    Parameters:
+    mean (np.array): Mean of (rho_D, rho_I, theta_D).
+    cov (np.array): Covariance of shape (3, 3).
+    alpha, beta, kappa (float): Spread parameters. The defaults give non-negative weights.
+
+    Returns:
+    tuple: Points of shape (2n+1, n), weights of the mean and weights of the covariance.
+    """
+	mean = np.asarray(mean, dtype=float)
+	n = len(mean)
+	lam = alpha**2*(n + kappa) - n
+	L = np.linalg.cholesky((n + lam)*np.asarray(cov, dtype=float))
+	X = np.vstack([mean, mean + L.T, mean - L.T])
+	wm = np.full(2*n + 1, 1./(2*(n + lam)))
+	wc = wm.copy()
+	wm[0] = lam/(n + lam)
+	wc[0] = wm[0] + 1 - alpha**2 + beta
+	return X, wm, wc
+
+
+# quantiles of x (along axis 0) with weights w, ignoring nan
+def weighted_quantile(x, w, q):
+	"""
+    Weighted quantiles along the first axis, ignoring nan entries.
+
+    Parameters:
+    x (np.array): Values of shape (N, ...).
+    w (np.array): Non-negative weights of shape (N,).
+    q (list): Quantiles in percent.
+
+    Returns:
+    np.array: Quantiles of shape (len(q), ...), nan where every entry is nan.
+    """
+	x = np.asarray(x, dtype=float)
+	flat = x.reshape(len(x), -1)
+	out = np.full((len(q), flat.shape[1]), np.nan)
+	order = np.argsort(np.where(np.isnan(flat), np.inf, flat), axis=0)
+	xs = np.take_along_axis(flat, order, axis=0)
+	ws = np.where(np.isnan(xs), 0., np.asarray(w, dtype=float)[order])
+	cw = np.cumsum(ws, axis=0)
+	total = cw[-1]
+	ok = total > 0
+	for k, qq in enumerate(q):
+		i = np.argmax(cw >= qq/100.*total, axis=0)
+		out[k, ok] = xs[i, np.arange(flat.shape[1])][ok]
+	return out.reshape((len(q),) + x.shape[1:])
+
+
+def propagate_ensemble(r1, r2, tht1=0, weights=None, dt=0.05, t_max=60, attractor_tol=None, q=(5, 50, 95)):
+	"""
+    Integrates an ensemble of initial conditions under the optimal play and summarizes the outcomes.
+
+    Parameters:
+    r1 (np.array): Initial radial distances of the defender from the target center.
+    r2 (np.array): Initial radial distances of the intruder from the target center.
+    tht1 (float or np.array): Initial angular positions of the defender. Default is 0.
+    weights (np.array): Weights of the members (normalized here). Default is equal weights.
+    dt (float): Time step for integration. Default is 0.05 seconds.
+    t_max (float): Time horizon. Default is 60 seconds.
+    attractor_tol (float): Passed to envelope_barrier_batch. Default is None.
+    q (list): Percentiles of the bands and of the terminal time. Default is (5, 50, 95).
+
+    Returns:
+    dict: 'p_defender', 'p_intruder' the outcome probabilities; 't_end' the terminal time of every
+          member, 't_quantiles', 't_mean', 't_std' its distribution and 'censored' the weight of
+          the members still running at t_max; 'ts' the time stamps, 'bands' the percentiles of the
+          states (len(q), T, 4) among the members still running, 'alive' their weight over time;
+          and the raw 'ss', 'winner', 'weights'.
+    """
+	r1, r2, tht1 = np.broadcast_arrays(np.atleast_1d(np.asarray(r1, dtype=float)),
+									   np.atleast_1d(np.asarray(r2, dtype=float)),
+									   np.atleast_1d(np.asarray(tht1, dtype=float)))
+	w = np.full(len(r1), 1./len(r1)) if weights is None else np.asarray(weights, dtype=float)
+	w = w/w.sum()
+
+	ss, lengths, ts, winner = envelope_barrier_batch(r1, r2, tht1, dt=dt, t_max=t_max, attractor_tol=attractor_tol)
+	t_end = ts[lengths - 1]
+	# members whose terminal state is undecided were stopped by the horizon
+	S_end = ss[lengths - 1, np.arange(len(r1))]
+	censored = envelope_winner(S_end, dt) == NONE
+	if attractor_tol is not None:
+		censored &= np.hypot(S_end[:, 0] - attractor[0], S_end[:, 2] - attractor[1]) > attractor_tol
+
+	alive = np.isfinite(ss[..., 0])
+	return {'p_defender': w[winner == DEFENDER].sum(), 'p_intruder': w[winner == INTRUDER].sum(),
+			't_end': t_end, 't_quantiles': weighted_quantile(t_end, w, q),
+			't_mean': np.sum(w*t_end), 't_std': np.sqrt(np.sum(w*(t_end - np.sum(w*t_end))**2)),
+			'censored': w[censored].sum(), 'ts': ts, 'q': q,
+			'bands': weighted_quantile(np.moveaxis(ss, 1, 0), w, q), 'alive': alive @ w,
+			'ss': ss, 'winner': winner, 'weights': w}
+
+def propagate_gaussian(mean, cov, n=None, rng=None, **kwargs):
+	"""
+    propagate_ensemble(..) for a normal distribution of (rho_D, rho_I, theta_D), with n samples,
+    or with the sigma points of the unscented transform if n is None.
+    """
+	if n is None:
+		X, w, _ = sigma_points(mean, cov)
+	else:
+		X, w = sample_gaussian(mean, cov, n, rng)
+	return propagate_ensemble(X[:, 0], X[:, 1], X[:, 2], weights=w, **kwargs)
+
+def print_report(res):
+	"""
+    Prints the summary of propagate_ensemble(..).
+    """
+	print('P(defender wins) = %.3f, P(intruder wins) = %.3f'%(res['p_defender'], res['p_intruder']))
+	print('terminal time: mean %.2f s, std %.2f s, '%(res['t_mean'], res['t_std'])
+		  + ', '.join('p%g %.2f s'%(qq, t) for qq, t in zip(res['q'], res['t_quantiles']))
+		  + ', still running at the horizon: %.1f%%'%(100*res['censored']))
+
+
+if __name__ == '__main__':
+	import matplotlib.pyplot as plt
+	from timestep import recommended_dt
+
+	# noisy defender winning case: 0.1 standard deviation on the distances, 0.05 rad on the angle
+	mean = np.array([6.1, 6.6, 0.])
+	cov = np.diag([0.1, 0.1, 0.05])**2
+
+	dt = recommended_dt()
+	t0 = time.time()
+	res = propagate_gaussian(mean, cov, n=500, rng=np.random.default_rng(0), dt=dt, attractor_tol=0.25)
+	print('500 samples: %.1f s'%(time.time() - t0))
+	print_report(res)
+
+	t0 = time.time()
+	res_sp = propagate_gaussian(mean, cov, dt=dt, attractor_tol=0.25)
+	print('7 sigma points: %.1f s'%(time.time() - t0))
+	print_report(res_sp)
+
+	fig, ax = plt.subplots()
+	for k, (name, c) in enumerate([(r'$\rho_D$', 'b'), (r'$\rho_I$', 'xkcd:crimson')]):
+		lo, mid, hi = res['bands'][:, :, 2*k]
+		ax.fill_between(res['ts'], lo, hi, color=c, alpha=0.2)
+		ax.plot(res['ts'], mid, color=c, label=name)
+	ax.plot(res['ts'], res['alive'], 'k--', label='running')
+	ax.set_xlabel('time', fontsize=14)
+	ax.grid()
+	ax.legend(fontsize=12)
+	# a generated output, next to the others in build/
+	if not os.path.isdir('build'):
+		os.makedirs('build')
+	plt.savefig(os.path.join('build', 'ensemble.png'))
+	plt.show()
@@ -50,6 +50,31 @@ def envelope_dx(s):
 	return np.array([vr1, vtht1, vr2, vtht2])
 
 
+# same as envelope_dx, but for a batch of states stacked as the rows of S
+# so that many trajectories can be advanced together by rk4
+def envelope_dx_batch(S, backward=False, field=None):
+	"""
+    Computes the time derivatives of a batch of state vectors under the optimal control strategy.
+
+    Parameters:
+    S (np.array): States of shape (N, 4), each row being [rho_D, theta_D, rho_I, theta_I].
+    backward (bool): Flag to compute the derivative in reverse time. Default is False.
+    field (PhaseField): If given, the control of the states it knows to be constant is not solved
+                        for (see phase_field.py). Default is None.
+
+    Returns:
+    np.array: Time derivatives of shape (N, 4), rows [dot(rho_D), dot(theta_D), dot(rho_I), dot(theta_I)].
+    """
+	if field is None:
+		phi = get_phi_batch(S[:, 0], S[:, 2])
+	else:
+		phi = np.zeros(len(S))
+		solve = ~field.constant(S[:, 0], S[:, 2])
+		phi[solve] = get_phi_batch(S[solve, 0], S[solve, 2])
+	vr1, vr2, vtht1, vtht2 = velocity_vec_batch(S[:, 0], S[:, 2], phi, backward=backward)
+	return np.stack([vr1, vtht1, vr2, vtht2], axis=-1)
+
+
 # starting from given (r1, r2), integrate envelope_dx() to generate an optimal trajectory
 # the envelope barrier of the game is made of such trajectories
 def envelope_barrier(r1, r2, tht1=0, dt=0.05):
@@ -115,6 +140,86 @@ def envelope_barrier(r1, r2, tht1=0, dt=0.05):
 
 	return np.asarray(xs), np.asarray(ss), phis, rrs, np.asarray(ts)
 
+
+# winner of a trajectory of the reduced game
+NONE, DEFENDER, INTRUDER = 0, 1, 2
+
+# the attractor of the defender winning trajectories (red dot in Figure 16)
+attractor = np.array([r/tan(gmm), r/sin(gmm)])
+
+# who has won in each of the states S, given the test envelope_barrier uses to stop:
+# the intruder gets past the defender (rho_D - rho_I >= r) or reaches the target
+# (rho_D + rho_I <= r), the defender blocks the way (rho_I - rho_D >= r)
+def envelope_winner(S, dt=0.05):
+	"""
+    Classifies a batch of states as won by the defender, the intruder, or still undecided.
+
+    Parameters:
+    S (np.array): States of shape (N, 4), rows [rho_D, theta_D, rho_I, theta_I].
+    dt (float): Time step of the integration, sets the margin of the test. Default is 0.05 seconds.
+
+    Returns:
+    np.array: NONE, DEFENDER or INTRUDER for every state, shape (N,).
+    """
+	win_i = (S[:, 0] - S[:, 2] >= r - dt*vi) | (S[:, 0] + S[:, 2] <= r + dt*vi)
+	win_d = S[:, 2] - S[:, 0] >= r - dt*vi
+	return np.where(win_i, INTRUDER, np.where(win_d, DEFENDER, NONE))
+
+
+# batched version of envelope_barrier: all (r1, r2) are integrated together and
+# nothing is written to res/. A trajectory still running at t_max is won by the
+# defender, as the intruder has been held off for the whole horizon; with
+# attractor_tol set, trajectories that come that close to the attractor stop early.
+def envelope_barrier_batch(r1, r2, tht1=0, dt=0.05, t_max=60, attractor_tol=None, record=True, field=None):
+	"""
+    Integrates optimal trajectories from many initial conditions at once.
+
+    Parameters:
+    r1 (np.array): Initial radial distances of the defender from the target center.
+    r2 (np.array): Initial radial distances of the intruder from the target center.
+    tht1 (float or np.array): Initial angular positions of the defender. Default is 0.
+    dt (float): Time step for integration. Default is 0.05 seconds.
+    t_max (float): Time horizon. Default is 60 seconds.
+    attractor_tol (float): Stop (as a defender win) once within this distance of the attractor
+                           in the (rho_D, rho_I) plane. Default is None, never stop early.
+    record (bool): If True, return the states at every step, otherwise only the terminal states.
+    field (PhaseField): Passed to envelope_dx_batch(). Default is None.
+
+    Returns:
+    tuple: States of shape (T, N, 4) in forward time (nan once a trajectory has stopped), or the
+           terminal states (N, 4) if record is False; number of valid steps of each trajectory;
+           time stamps of shape (T,); winner of each trajectory.
+    """
+	r1, r2, tht1 = np.broadcast_arrays(np.atleast_1d(np.asarray(r1, dtype=float)),
+									   np.atleast_1d(np.asarray(r2, dtype=float)),
+									   np.atleast_1d(np.asarray(tht1, dtype=float)))
+	# See equation (19)
+	dtht = np.arccos(np.clip((r1**2 + r2**2 - r**2)/(2*r1*r2), -1., 1.))
+	S = np.stack([r1, tht1, r2, tht1 - dtht], axis=-1)
+
+	winner = envelope_winner(S, dt)
+	alive = winner == NONE
+	lengths = np.ones(len(S), dtype=int)
+	ss, ts = [S.copy()], [0]
+
+	t = 0
+	while t < t_max and alive.any():
+		S[alive] = rk4(lambda X: envelope_dx_batch(X, field=field), S[alive], dt)
+		t += dt
+		ts.append(t)
+		lengths += alive
+		if record:
+			ss.append(np.where(alive[:, None], S, np.nan))
+
+		winner[alive] = envelope_winner(S[alive], dt)
+		if attractor_tol is not None:
+			near = alive & (np.hypot(S[:, 0] - attractor[0], S[:, 2] - attractor[1]) <= attractor_tol)
+			winner[near] = DEFENDER
+		alive &= winner == NONE
+
+	winner[winner == NONE] = DEFENDER
+	return (np.asarray(ss) if record else S), lengths, np.asarray(ts), winner
+
 def is_within_sector(xd, yd, xi, yi, capture_radius=r, sector_angle=sector_angle):
     """
     Check if the intruder is within the sector-shaped capture range of the defender.
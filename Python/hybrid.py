@@ -0,0 +1,193 @@
+'''
+Hybrid integration of the optimal play: RK4 until a trajectory settles on the
+attractor, the rest of the horizon in closed form.
+
+A defender winning trajectory never ends by the rules of the game: it spirals
+into the attractor (r/tan(gmm), r/sin(gmm)) of Figure 16, where the intruder
+keeps the angle acos(vd/vi) to the line of sight and the defender the
+bearing perpendicular to its radius, both circling the target at the rate
+vd/rho_D* = vi/rho_I*. envelope_barrier_batch(..) integrates it with get_phi
+at every stage up to the horizon, 60 s at dt = 0.05, which is most of the
+cost of a defender win.
+
+Close to the attractor the control switches between the two tangents of the
+vectogram at every step (it is not smooth there), and the trajectory slides
+in along a fixed direction u, the distance decaying like 1/t instead of
+exponentially. This last phase is solved in closed form:
+
+    (rho_D, rho_I)(t) = attractor + u*delta(t),    delta(t) = delta0/(1 + c*delta0*t)
+    theta(t) = theta0 + w*t + k/c*log(1 + c*delta0*t)
+
+with w = +-vd/rho_D* and the constants c, k measured on the last `window`
+seconds of the integrated trajectory (the model is exact over the window). A
+trajectory switches once it is within switch_tol of the attractor, the
+distance decreasing and the direction of approach steady over the window, and
+the remaining steps are then written in one vectorized evaluation.
+
+The constants are fitted on a window that is still curving in, so the error at
+the horizon grows with the distance at the switch: on a batch of defender wins,
+theta is off by 0.17 rad at most with switch_tol = 0.5, 0.11 with 0.3 and 0.03
+with 0.2 (3.3x, 2.3x and 1.8x faster than the full integration).
+With the default 0.2 the states at the horizon stay within RHO_TOL and THETA_TOL
+of envelope_barrier_batch, which the script checks.
+
+    python hybrid.py        the thesis scenarios and a batch of defender wins, against envelope_barrier_batch
+'''
+
+import time
+import numpy as np
+from math import pi
+from RK4 import rk4
+from envelope import envelope_dx_batch, envelope_winner, attractor, NONE, DEFENDER, r, vd
+
+# bounds on the difference to envelope_barrier_batch at the horizon, rho and theta
+RHO_TOL, THETA_TOL = 0.02, 0.05
+
+
+# closed-form positions after the switch: tau (T,) from the switch, one column per trajectory
+def phase3(S0, u, delta0, c, k, w, tau):
+	"""
+    States of the attractor phase at the times tau after the switch.
+
+    Parameters:
+    S0 (np.array): States at the switch, shape (K, 4).
+    u (np.array): Directions of approach in the (rho_D, rho_I) plane, shape (K, 2).
+    delta0, c (np.array): Distances to the attractor at the switch and decay constants, shape (K,).
+    k, w (np.array): Rate constants of theta_D and theta_I, shape (K, 2).
+    tau (np.array): Times since the switch, shape (T,).
+
+    Returns:
+    np.array: States of shape (T, K, 4).
+    """
+	g = 1 + c*delta0*tau[:, None]
+	delta = delta0/g
+	log_g = np.log(g)/c
+	return np.stack([attractor[0] + u[:, 0]*delta, S0[:, 1] + w[:, 0]*tau[:, None] + k[:, 0]*log_g,
+					 attractor[1] + u[:, 1]*delta, S0[:, 3] + w[:, 1]*tau[:, None] + k[:, 1]*log_g], axis=-1)
+
+def envelope_hybrid_batch(r1, r2, tht1=0, dt=0.05, t_max=60, switch_tol=0.2, window=2., turn_tol=0.05, field=None):
+	"""
+    envelope_barrier_batch(.., record=True) with the attractor phase in closed form.
+
+    Parameters:
+    r1 (np.array): Initial radial distances of the defender from the target center.
+    r2 (np.array): Initial radial distances of the intruder from the target center.
+    tht1 (float or np.array): Initial angular positions of the defender. Default is 0.
+    dt (float): Time step for integration. Default is 0.05 seconds.
+    t_max (float): Time horizon. Default is 60 seconds.
+    switch_tol (float): Largest distance to the attractor at the switch. Default is 0.2, see RHO_TOL.
+    window (float): Time over which the approach is checked and the constants measured. Default is 2 seconds.
+    turn_tol (float): Largest turn of the direction of approach over the window, in radians. Default is 0.05.
+    field (PhaseField): Passed to envelope_dx_batch(). Default is None.
+
+    Returns:
+    tuple: States of shape (T, N, 4) (nan once a trajectory has stopped), number of valid steps of
+           each trajectory, time stamps (T,), winner of each trajectory, and the time of the switch
+           (nan if the trajectory was integrated to its end).
+    """
+	r1, r2, tht1 = np.broadcast_arrays(np.atleast_1d(np.asarray(r1, dtype=float)),
+									   np.atleast_1d(np.asarray(r2, dtype=float)),
+									   np.atleast_1d(np.asarray(tht1, dtype=float)))
+	# See equation (19)
+	dtht = np.arccos(np.clip((r1**2 + r2**2 - r**2)/(2*r1*r2), -1., 1.))
+	S = np.stack([r1, tht1, r2, tht1 - dtht], axis=-1)
+
+	# the time stamps of envelope_barrier_batch, accumulated the same way
+	ts, t = [0], 0
+	while t < t_max:
+		t += dt
+		ts.append(t)
+	ts = np.asarray(ts)
+	ss = np.full((len(ts), len(S), 4), np.nan)
+	ss[0] = S
+
+	winner = envelope_winner(S, dt)
+	alive = winner == NONE
+	lengths = np.ones(len(S), dtype=int)
+	t_switch = np.full(len(S), np.nan)
+	m = max(int(round(window/dt)), 1)
+	w_star = vd/attractor[0]
+
+	n = 0
+	while n + 1 < len(ts) and alive.any():
+		S[alive] = rk4(lambda X: envelope_dx_batch(X, field=field), S[alive], dt)
+		n += 1
+		lengths += alive
+		ss[n] = np.where(alive[:, None], S, np.nan)
+		winner[alive] = envelope_winner(S[alive], dt)
+		alive &= winner == NONE
+		if n < m:
+			continue
+
+		# settled on the attractor: close, getting closer, from a steady direction
+		e, e_prev = S[:, [0, 2]] - attractor, ss[n - m][:, [0, 2]] - attractor
+		delta, delta_prev = np.hypot(*e.T), np.hypot(*e_prev.T)
+		turn = np.abs(np.arctan2(e[:, 1], e[:, 0]) - np.arctan2(e_prev[:, 1], e_prev[:, 0]))
+		go = np.flatnonzero(alive & (delta <= switch_tol) & (delta < delta_prev) & (np.minimum(turn, 2*pi - turn) <= turn_tol))
+		if not len(go):
+			continue
+		# constants of the model, which reproduces delta and theta over the window exactly
+		c = (1/delta[go] - 1/delta_prev[go])/(ts[n] - ts[n - m])
+		rate = (S[go][:, [1, 3]] - ss[n - m][go][:, [1, 3]])/(ts[n] - ts[n - m])
+		w = np.sign(rate)*w_star
+		k = (rate - w)*(ts[n] - ts[n - m])/(np.log(delta_prev[go]/delta[go])/c)[:, None]
+		tau = ts[n + 1:] - ts[n]
+		ss[n + 1:, go] = phase3(S[go], e[go]/delta[go, None], delta[go], c, k, w, tau)
+		lengths[go] += len(tau)
+		winner[go] = DEFENDER
+		t_switch[go] = ts[n]
+		alive[go] = False
+
+	winner[winner == NONE] = DEFENDER
+	return ss[:max(lengths.max(), n + 1)], lengths, ts[:max(lengths.max(), n + 1)], winner, t_switch
+
+
+if __name__ == '__main__':
+	from envelope import envelope_barrier_batch
+	from timestep import SCENARIOS
+
+	# same winners and lengths, and the states at the horizon within RHO_TOL, THETA_TOL
+	def compare(ss_f, len_f, win_f, ss_h, len_h, win_h):
+		n, k = len_f - 1, np.arange(len(len_f))
+		d_rho = np.abs(ss_h[n, k][:, [0, 2]] - ss_f[n, k][:, [0, 2]]).max(axis=1)
+		d_tht = np.abs(ss_h[n, k][:, [1, 3]] - ss_f[n, k][:, [1, 3]]).max(axis=1)
+		ok = (np.array_equal(win_f, win_h) and np.array_equal(len_f, len_h)
+			  and d_rho.max() <= RHO_TOL and d_tht.max() <= THETA_TOL)
+		return d_rho, d_tht, ok
+
+	# the thesis scenarios: only the defender win switches
+	names = list(SCENARIOS)
+	r1s, r2s = np.array([SCENARIOS[k] for k in names]).T
+	t0 = time.time()
+	ss_f, len_f, ts_f, win_f = envelope_barrier_batch(r1s, r2s)
+	t_full = time.time() - t0
+	for tol in (0.5, 0.3, 0.2):
+		t0 = time.time()
+		ss_h, len_h, ts_h, win_h, t_sw = envelope_hybrid_batch(r1s, r2s, switch_tol=tol)
+		t_hyb = time.time() - t0
+		d_rho, d_tht, ok = compare(ss_f, len_f, win_f, ss_h, len_h, win_h)
+		print('switch_tol %.1f: %.2f s against %.2f s, same winners %s, same lengths %s, within the bounds %s'
+			  %(tol, t_hyb, t_full, np.array_equal(win_f, win_h), np.array_equal(len_f, len_h), ok))
+		for j, name in enumerate(names):
+			print('    %-8s switch at %5.2f s, at the horizon: rho off by %.1e, theta off by %.1e'
+				  %(name, t_sw[j], d_rho[j], d_tht[j]))
+	assert ok, 'the thesis scenarios disagree with envelope_barrier_batch'
+
+	# a batch of defender wins around (6.1, 6.6), with the default switch_tol
+	rng = np.random.default_rng(0)
+	r1s = rng.uniform(5.5, 6.5, 200)
+	r2s = r1s + rng.uniform(0.3, 0.8, 200)
+	t0 = time.time()
+	ss_f, len_f, _, win_f = envelope_barrier_batch(r1s, r2s)
+	t_full = time.time() - t0
+	t0 = time.time()
+	ss_h, len_h, _, win_h, t_sw = envelope_hybrid_batch(r1s, r2s)
+	t_hyb = time.time() - t0
+	sw = np.isfinite(t_sw)
+	d_rho, d_tht, ok = compare(ss_f, len_f, win_f, ss_h, len_h, win_h)
+	print('%d trajectories, %d defender wins, %d switched (median at %.1f s): %.1f s against %.1f s'
+		  %(len(r1s), (win_f == DEFENDER).sum(), sw.sum(), np.median(t_sw[sw]), t_hyb, t_full))
+	print('same winners %s, same lengths %s; at the horizon, rho off by %.1e (median %.1e), theta off by %.1e (median %.1e)'
+		  %(np.array_equal(win_f, win_h), np.array_equal(len_f, len_h), d_rho.max(), np.median(d_rho[sw]),
+			d_tht.max(), np.median(d_tht[sw])))
+	assert ok, 'the defender wins disagree with envelope_barrier_batch beyond RHO_TOL = %g, THETA_TOL = %g'%(RHO_TOL, THETA_TOL)
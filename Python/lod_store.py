@@ -0,0 +1,243 @@
+'''
+Compact, level-of-detail storage of trajectories.
+
+A trajectory saved by envelope_barrier(..) holds the states and phi of every
+step as text, at dt = 0.05 for up to 60 s, which is far more than a figure
+needs. Here a trajectory is saved as one lod.npz next to its data.csv, with
+
+    level 0         every state
+    level k > 0     the states kept by Douglas-Peucker with tolerance EPS_LEVELS[k]
+
+and every level encoded as float64, float32, or as differences of the states
+quantized to a quantum (compressed, the differences being small integers).
+
+The Douglas-Peucker distance of a state to a segment is the largest of the
+distances in the plane of the defender (x_D, y_D), of the intruder (x_I, y_I),
+and of the reduced game (rho_D, rho_I), so the polyline of a level is within
+its tolerance of the full trajectory in the figures of one_plot.py as well as
+in Figure 16. The error of the encoding, measured when the file is written, is
+added to the tolerance of every level. load_lod(.., tol) reads only the
+coarsest level whose error is within tol, and read_data(tol) in overall_plot.py
+uses it where a lod.npz exists.
+
+    python lod_store.py res             write res/*/lod.npz and compare the sizes
+'''
+
+import os
+import glob
+import time
+import numpy as np
+
+# tolerances of the levels, level 0 keeps every state
+EPS_LEVELS = (0., 1e-3, 4e-3, 1.6e-2, 6.4e-2)
+
+
+def cartesian(ss):
+	"""
+    Positions (n, 4) as (x_D, y_D, x_I, y_I) of the states (n, 4) [rho_D, theta_D, rho_I, theta_I].
+    """
+	return np.stack([ss[:, 0]*np.cos(ss[:, 1]), ss[:, 0]*np.sin(ss[:, 1]),
+					 ss[:, 2]*np.cos(ss[:, 3]), ss[:, 2]*np.sin(ss[:, 3])], axis=-1)
+
+def curves(ss):
+	"""
+    The three planar curves of a trajectory the error is measured in: defender, intruder, reduced game.
+    """
+	x = cartesian(ss)
+	return [x[:, :2], x[:, 2:], ss[:, [0, 2]]]
+
+# distance of the points P (k, 2) to the segment from a to b
+def _segment_distance(P, a, b):
+	ab = b - a
+	L2 = ab @ ab
+	t = np.clip((P - a) @ ab/L2, 0., 1.) if L2 > 0 else np.zeros(len(P))
+	return np.hypot(*(P - a - t[:, None]*ab).T)
+
+def douglas_peucker(cs, eps):
+	"""
+    Douglas-Peucker simplification of several curves sampled at the same steps.
+
+    Parameters:
+    cs (list): Curves of shape (n, 2).
+    eps (float): Largest distance of a dropped point to the simplified polyline of its curve.
+
+    Returns:
+    np.array: Sorted indices of the kept points, the first and the last always included.
+    """
+	n = len(cs[0])
+	keep = np.zeros(n, dtype=bool)
+	keep[[0, -1]] = True
+	stack = [(0, n - 1)]
+	while stack:
+		i, j = stack.pop()
+		if j - i < 2:
+			continue
+		d = np.max([_segment_distance(c[i + 1:j], c[i], c[j]) for c in cs], axis=0)
+		k = int(np.argmax(d))
+		if d[k] > eps:
+			m = i + 1 + k
+			keep[m] = True
+			stack += [(i, m), (m, j)]
+	return np.flatnonzero(keep)
+
+
+def _int_dtype(v):
+	for dt in (np.int8, np.int16, np.int32):
+		info = np.iinfo(dt)
+		if v.size == 0 or (v.min() >= info.min and v.max() <= info.max):
+			return dt
+	return np.int64
+
+def encode(A, encoding='delta', quantum=1e-6):
+	"""
+    Encodes the rows of A (n, c).
+
+    Parameters:
+    A (np.array): Values to encode.
+    encoding (str): 'float64', 'float32' or 'delta'. Default is 'delta'.
+    quantum (float): Quantization step of 'delta'. Default is 1e-6.
+
+    Returns:
+    dict: Arrays to store, read back by decode().
+    """
+	if encoding == 'float64':
+		return {'data': np.asarray(A, dtype=np.float64)}
+	if encoding == 'float32':
+		return {'data': np.asarray(A, dtype=np.float32)}
+	if encoding != 'delta':
+		raise ValueError('unknown encoding %r'%encoding)
+	Q = np.round(np.asarray(A)/quantum).astype(np.int64)
+	d = np.diff(Q, axis=0)
+	return {'first': Q[:1], 'delta': d.astype(_int_dtype(d))}
+
+def decode(arrays, quantum=1e-6):
+	"""
+    Values encoded by encode(), from a dict (or npz file) of its arrays.
+    """
+	if 'data' in arrays:
+		return np.asarray(arrays['data'], dtype=np.float64)
+	Q = np.concatenate([arrays['first'], arrays['first'] + np.cumsum(arrays['delta'], axis=0, dtype=np.int64)])
+	return Q*quantum
+
+
+def save_lod(fname, ss, phis, eps=EPS_LEVELS, encoding='delta', quantum=1e-6):
+	"""
+    Saves a trajectory with its level-of-detail pyramid.
+
+    Parameters:
+    fname (str): File to write (.npz).
+    ss (np.array): States of shape (n, 4), rows [rho_D, theta_D, rho_I, theta_I].
+    phis (np.array): Optimal control of every state.
+    eps (list): Tolerance of every level, the first being 0. Default is EPS_LEVELS.
+    encoding (str): 'float64', 'float32' or 'delta', see encode(). Default is 'delta'.
+    quantum (float): Quantization step of 'delta'. Default is 1e-6.
+
+    Returns:
+    np.array: Error bound of every level.
+    """
+	ss = np.asarray(ss, dtype=float)
+	A = np.column_stack([ss, phis])
+	cs = curves(ss)
+	out = {'encoding': np.array(encoding), 'quantum': np.array(quantum), 'eps': np.asarray(eps, dtype=float)}
+
+	enc_err = 0.
+	for k, e in enumerate(eps):
+		idx = np.arange(len(ss)) if e <= 0 else douglas_peucker(cs, e)
+		arrays = encode(A[idx], encoding, quantum)
+		# error of the encoding in the planes of the curves
+		back = curves(decode(arrays, quantum)[:, :4])
+		enc_err = max([enc_err] + [np.max(np.hypot(*(b - c[idx]).T)) for b, c in zip(back, cs)])
+		out['L%d_idx'%k] = idx.astype(_int_dtype(idx))
+		out.update({'L%d_%s'%(k, key): v for key, v in arrays.items()})
+
+	err = np.asarray(eps, dtype=float) + enc_err
+	out['err'] = err
+	np.savez_compressed(fname, **out)
+	return err
+
+def load_lod(fname, tol=0.):
+	"""
+    Reads the coarsest level of a trajectory whose error is within tol.
+
+    Parameters:
+    fname (str): File written by save_lod().
+    tol (float): Largest acceptable distance to the full trajectory. Default is 0, the finest level.
+
+    Returns:
+    tuple: States (m, 4), optimal control (m,), indices (m,) of the states in the full trajectory,
+           and the error bound of the level read.
+    """
+	with np.load(fname) as f:
+		err = f['err']
+		ok = np.flatnonzero(err <= tol)
+		k = ok[-1] if len(ok) else 0
+		arrays = {key[len('L%d_'%k):]: f[key] for key in f.files if key.startswith('L%d_'%k)}
+		A = decode(arrays, float(f['quantum']))
+	return A[:, :4], A[:, 4], arrays['idx'].astype(int), err[k]
+
+def display_tolerance(span, pixels=640, frac=0.5):
+	"""
+    Tolerance below which a drawing cannot be told apart: a fraction of the size of a pixel.
+
+    Parameters:
+    span (float): Extent of the axes in data units, e.g. 10 for Figure 16.
+    pixels (int): Extent of the axes in pixels. Default is 640, a default figure at 100 dpi.
+    frac (float): Fraction of a pixel. Default is 0.5.
+    """
+	return frac*span/pixels
+
+
+def convert_res(root='res', **kwargs):
+	"""
+    Writes root/*/lod.npz next to every data.csv saved by envelope_barrier(..).
+
+    Parameters:
+    root (str): Directory of the r1_*-r2_*/data.csv files. Default is 'res'.
+    kwargs: Passed to save_lod().
+
+    Returns:
+    tuple: Total size in bytes of the csv files, of the npz files, and of their coarsest levels.
+    """
+	size_csv, size_npz, n_full, n_coarse = 0, 0, 0, 0
+	for fname in sorted(glob.glob(os.path.join(root, '*', 'data.csv'))):
+		data = np.loadtxt(fname, delimiter=',', ndmin=2)
+		if not len(data):
+			continue
+		# envelope_barrier appends, a file may hold the same trajectory several times
+		starts = np.flatnonzero(np.all(data[:, :4] == data[0, :4], axis=1))
+		data = data[:starts[1]] if len(starts) > 1 else data
+		out = os.path.join(os.path.dirname(fname), 'lod.npz')
+		save_lod(out, data[:, :4], data[:, 4], **kwargs)
+		size_csv += os.path.getsize(fname)
+		size_npz += os.path.getsize(out)
+		n_full += len(data)
+		n_coarse += len(load_lod(out, np.inf)[0])
+	return size_csv, size_npz, n_full, n_coarse
+
+
+if __name__ == '__main__':
+	import sys
+	from envelope import envelope_barrier_batch
+
+	root = sys.argv[1] if len(sys.argv) > 1 else 'res'
+	for encoding in ('float32', 'delta'):
+		t0 = time.time()
+		size_csv, size_npz, n_full, n_coarse = convert_res(root, encoding=encoding)
+		print('%s: %d states, csv %.1f MB, npz %.2f MB (%.1f s); %d states at the coarsest level'
+			  %(encoding, n_full, size_csv/1e6, size_npz/1e6, time.time() - t0, n_coarse))
+
+	# check of the error bounds on the barrier trajectory
+	ss, lengths, ts, _ = envelope_barrier_batch(6.5, 6.54)
+	ss = ss[:lengths[0], 0]
+	err = save_lod('lod_check.npz', ss, np.zeros(len(ss)))
+	cs = curves(ss)
+	for tol in err:
+		s, _, idx, e = load_lod('lod_check.npz', tol)
+		# distance of every state to the polyline of the level
+		d = np.zeros(len(ss))
+		for c, cl in zip(cs, curves(s)):
+			for a in range(len(idx) - 1):
+				i, j = idx[a], idx[a + 1]
+				d[i:j + 1] = np.maximum(d[i:j + 1], _segment_distance(c[i:j + 1], cl[a], cl[a + 1]))
+		print('level error %.2e: %4d of %d states, largest distance %.2e'%(e, len(s), len(ss), d.max()))
+	os.remove('lod_check.npz')
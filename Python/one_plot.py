@@ -4,9 +4,40 @@ matplotlib.rc('ytick', labelsize=14)
 from matplotlib.patches import Wedge
 from envelope import *
 from overall_plot import *
+from bulk_plot import add_segments, add_points
 import matplotlib.tri as tri
 from math import pi
 
+# optimal trajectory like Figure 14, traj as returned by envelope_barrier(..)
+def plot_traj(traj, fname='traj.png', rasterized=False):
+	"""
+    Plots the trajectories of the defender and the intruder, with the line of sight every 50 steps.
+
+    Parameters:
+    traj (np.array): Trajectory in Cartesian coordinates, rows [x_D, y_D, x_I, y_I].
+    fname (str): File the figure is saved to. Default is 'traj.png'.
+    rasterized (bool): Rasterize the markers and lines of sight. Default is False.
+
+    Returns:
+    matplotlib.figure.Figure: The figure.
+    """
+	fig, ax = plt.subplots()
+	ax.plot(traj[:,0], traj[:,1], 'b', alpha=0.8, marker='o', markevery=50)
+	ax.plot(traj[:,2], traj[:,3], color='xkcd:crimson', marker='o', alpha=0.8, markevery=50)
+	x = traj[::50]
+	add_segments(ax, x[:, :2], x[:, 2:], rasterized, colors='k', linestyles='--')
+	add_points(ax, x[:, :2], rasterized, marker='o', color='b')
+	add_points(ax, x[:, 2:], rasterized, marker='o', color='xkcd:crimson')
+	# ax.plot(circ[:,0], circ[:,1], 'r-')
+	plt.xlabel('x', fontsize=14)
+	plt.ylabel('y', fontsize=14)
+	ax.grid()
+	ax.axis('equal')
+	ax.legend(['D', 'I'], fontsize=14)
+	plt.savefig(fname)
+	return fig
+
+
 if __name__ == '__main__':
     # Define initial conditions for rho_D and rho_I based on the scenario
 
@@ -21,23 +52,7 @@ if __name__ == '__main__':
 
 	########################## optimal trajectory like Figure 14 ###########################
 	traj, ss, phis, rrs, ts = envelope_barrier(r1, r2)
-
-    # Plot trajectories for defender and intruder
-	fig, ax = plt.subplots()
-	ax.plot(traj[:,0], traj[:,1], 'b', alpha=0.8, marker='o', markevery=50)
-	ax.plot(traj[:,2], traj[:,3], color='xkcd:crimson', marker='o', alpha=0.8, markevery=50)
-	for i, x in enumerate(traj):
-		if i%50 == 0:
-			ax.plot([x[0], x[2]], [x[1], x[3]], 'k--')
-			ax.plot(x[0], x[1], marker='o', color='b')
-			ax.plot(x[2], x[3], marker='o', color='xkcd:crimson')
-	# ax.plot(circ[:,0], circ[:,1], 'r-')
-	plt.xlabel('x', fontsize=14)
-	plt.ylabel('y', fontsize=14)
-	ax.grid()
-	ax.axis('equal')
-	ax.legend(['D', 'I'], fontsize=14)
-	plt.savefig('traj.png')
+	plot_traj(traj)
 	plt.show()
 
 	########################## phi_D^ast, like Figure 13###########################
@@ -67,6 +82,7 @@ if __name__ == '__main__':
 
 	########################## vecgram, like Figure 12 ###########################
 	# at each time step, there is a vectogram. we only pick some representative ones to show. 
+	# atlas.py draws them all at once (in parallel): vecgram_atlas(ss, resfig)
 	# k = 0
 	# for i, s in enumerate(ss):
 	# 	print(i)
@@ -1,30 +1,33 @@
 from envelope import *
 from overall_plot import *
+from bulk_plot import add_segments, add_points, marker_steps
 
 
+# the defender winning trajectory like Figure 15: the segment N..n_end of the trajectory
+# and the mirrored second defender, both extended by T seconds of straight line motion
+def plot_opttraj(traj, ts, fname='opttraj.png', N=70, n_end=105, T=1.1, rasterized=False):
+	"""
+    Plots a segment of an optimal trajectory with the two defenders and the target.
 
+    Parameters:
+    traj (np.array): Trajectory in Cartesian coordinates, rows [x_D, y_D, x_I, y_I].
+    ts (np.array): Time stamps of the trajectory.
+    fname (str): File the figure is saved to. Default is 'opttraj.png'.
+    N (int): First step of the plotted segment. Default is 70.
+    n_end (int): Last step of the plotted segment. Default is 105.
+    T (float): Time threshold of the extensions. Default is 1.1.
+    rasterized (bool): Rasterize the markers and lines of sight. Default is False.
 
-if __name__ == '__main__':
-    # Define initial radial distances for the defender and intruder
-	r1, r2 = 6.1, 6.6 # Defender winning scenario
-
-    # Generate the trajectory, states, control angles, ratios, and time stamps for the given scenario
-	traj, ss, phis, rrs, ts = envelope_barrier(r1, r2)
-
-    # Print a specific state from the generated states
-	print(ss[105])
-
-    # Define a range of time steps to analyze a segment of the trajectory
-	N = 70
-	dts = ts[N:105] - ts[N] # Calculate time differences
-	print(dts)
-	T = 1.1 # Time threshold
+    Returns:
+    matplotlib.figure.Figure: The figure.
+    """
+	dts = ts[N:n_end] - ts[N] # Calculate time differences
 
 	# Extract segments of the trajectory for the defender and intruder
-	x1 = np.asarray(traj[N:105, 0])
-	y1 = np.asarray(traj[N:105, 1])
-	xi = np.asarray(traj[N:105, 2])
-	yi = np.asarray(traj[N:105, 3])
+	x1 = np.asarray(traj[N:n_end, 0])
+	y1 = np.asarray(traj[N:n_end, 1])
+	xi = np.asarray(traj[N:n_end, 2])
+	yi = np.asarray(traj[N:n_end, 3])
     
 	# Calculate the target radius and generate points to represent the target area
 	R = np.sqrt(xi[-1]**2 + yi[-1]**2)
@@ -52,16 +55,13 @@ if __name__ == '__main__':
 	ax.plot(x1, y1, 'b', alpha=0.8, marker='o', markevery=20, label='D')
 	ax.plot(x2, y2, 'b', alpha=0.8, marker='o', markevery=20, label=None)
 	ax.plot(xi, yi, color='xkcd:crimson', marker='o', markevery=20, alpha=0.8, label='I')
-	for i, (x1_, y1_, x2_, y2_, xi_, yi_) in enumerate(zip(x1, y1, x2, y2, xi, yi)):
-		if i%20 == 0:
-			ax.plot([xi_, x1_], [yi_, y1_], 'k--')
-			ax.plot([xi_, x2_], [yi_, y2_], 'k--')
-		if i == len(xi)-1:
-			ax.plot([xi_, x1_], [yi_, y1_], 'k--')
-			ax.plot([xi_, x2_], [yi_, y2_], 'k--')
-			ax.plot(x1_, y1_, 'o', color='b')
-			ax.plot(x2_, y2_, 'o', color='b')
-			ax.plot(xi_, yi_, 'o', color='xkcd:crimson')
+	# lines of sight every 20 steps and at the end, markers at the end
+	n = min(len(x1), len(x2), len(xi))
+	idx = marker_steps(n, 20)
+	p1, p2, pi_ = np.stack([x1, y1], axis=-1)[idx], np.stack([x2, y2], axis=-1)[idx], np.stack([xi, yi], axis=-1)[idx]
+	add_segments(ax, np.concatenate([pi_, pi_]), np.concatenate([p1, p2]), rasterized, colors='k', linestyles='--')
+	add_points(ax, np.stack([p1[-1], p2[-1]]), rasterized, marker='o', color='b')
+	add_points(ax, pi_[-1], rasterized, marker='o', color='xkcd:crimson')
 	ax.plot(xt, yt, 'r', label='Target')
 
 	plt.xlabel('x', fontsize=14)
@@ -69,5 +69,21 @@ if __name__ == '__main__':
 	ax.grid()
 	ax.axis('equal')
 	ax.legend(fontsize=14)
-	plt.savefig('opttraj.png')
+	plt.savefig(fname)
+	return fig
+
+
+if __name__ == '__main__':
+    # Define initial radial distances for the defender and intruder
+	r1, r2 = 6.1, 6.6 # Defender winning scenario
+
+    # Generate the trajectory, states, control angles, ratios, and time stamps for the given scenario
+	traj, ss, phis, rrs, ts = envelope_barrier(r1, r2)
+
+    # Print a specific state from the generated states
+	print(ss[105])
+
+	# Define a range of time steps to analyze a segment of the trajectory
+	print(ts[70:105] - ts[70])
+	plot_opttraj(traj, ts)
 	plt.show()
@@ -0,0 +1,282 @@
+'''
+Nearest-neighbor index of the outcomes that have already been computed.
+
+Two sources of labelled initial conditions are indexed:
+
+    res/*/data.csv              optimal trajectories of the reduced game (envelope_barrier);
+                                under the optimal play every state of a trajectory has the
+                                outcome of the trajectory, so each file labels many states
+    successful_conditions_*.mat Monte Carlo runs of the Simulink model (Monte_Carlo.m): the
+                                position of D1 for every heading angle that led to a capture
+
+OutcomeIndex answers "does the defender win from (rho_D, rho_I)?" with the
+distance-weighted vote of the k nearest labelled states and a confidence score.
+predict_outcome(..) integrates the queries whose confidence is too low with
+envelope_barrier_batch and adds the new trajectories to the index, which grows
+incrementally: new points go to a small buffer searched by brute force, merged
+into the k-d tree once the buffer gets large.
+
+The Monte Carlo files only keep the successful runs (out of 100 uniform samples
+per region and heading), so MonteCarloOutcomes estimates the capture probability
+as the density of successful samples near the query over the density of all
+samples. The Simulink model cannot be run from here, so these queries have no
+exact fallback, only the confidence score: how sure the posterior of the capture
+probability, given the successes among the samples expected near the query, is
+of the side of 1/2 it is on.
+'''
+
+import os
+import re
+import glob
+import numpy as np
+from scipy.spatial import cKDTree
+from scipy.stats import beta
+from scipy.io import loadmat
+
+
+class OutcomeIndex(object):
+	"""
+    k-nearest-neighbor classifier over labelled states, with incremental updates.
+
+    Parameters:
+    X (np.array): Labelled states of shape (n, dim). Default is an empty index.
+    y (np.array): Labels in [0, 1] (1 for a defender win) of shape (n,).
+    k (int): Number of neighbors of a query. Default is 8.
+    radius (float): Distance beyond which the neighbors stop counting as close. Default is 0.25.
+    rebuild_frac (float): The tree is rebuilt when the buffer reaches this fraction of it. Default is 0.25.
+    dim (int): Dimension of the states of an empty index. Default is 2.
+    """
+	def __init__(self, X=None, y=None, k=8, radius=0.25, rebuild_frac=0.25, dim=2):
+		self.k = k
+		self.radius = radius
+		self.rebuild_frac = rebuild_frac
+		self.X = np.zeros((0, dim)) if X is None else np.asarray(X, dtype=float)
+		self.y = np.zeros(0) if y is None else np.asarray(y, dtype=float)
+		self.buf_X, self.buf_y = [], []
+		self._build()
+
+	def _build(self):
+		self.tree = cKDTree(self.X) if len(self.X) else None
+
+	def __len__(self):
+		return len(self.X) + sum(len(b) for b in self.buf_y)
+
+	def add(self, X, y):
+		"""
+        Adds labelled states; the tree is rebuilt only when the buffer has grown enough.
+        """
+		self.buf_X.append(np.asarray(X, dtype=float).reshape(-1, self.X.shape[1]))
+		self.buf_y.append(np.asarray(y, dtype=float).ravel())
+		if sum(len(b) for b in self.buf_y) > self.rebuild_frac*max(len(self.X), 1):
+			self.X = np.concatenate([self.X] + self.buf_X)
+			self.y = np.concatenate([self.y] + self.buf_y)
+			self.buf_X, self.buf_y = [], []
+			self._build()
+
+	def neighbors(self, Q, k=None):
+		"""
+        Distances and labels of the k nearest labelled states of every query, shape (m, k).
+        """
+		Q = np.asarray(Q, dtype=float).reshape(-1, self.X.shape[1])
+		k = self.k if k is None else k
+		d = np.full((len(Q), 0), np.inf)
+		lab = np.zeros((len(Q), 0))
+		if self.tree is not None:
+			dt, it = self.tree.query(Q, min(k, len(self.X)))
+			d, lab = dt.reshape(len(Q), -1), self.y[it].reshape(len(Q), -1)
+		if self.buf_y:
+			bX, by = np.concatenate(self.buf_X), np.concatenate(self.buf_y)
+			db = np.linalg.norm(Q[:, None, :] - bX[None, :, :], axis=-1)
+			d = np.concatenate([d, db], axis=1)
+			lab = np.concatenate([lab, np.broadcast_to(by, db.shape)], axis=1)
+		order = np.argsort(d, axis=1)[:, :k]
+		return np.take_along_axis(d, order, axis=1), np.take_along_axis(lab, order, axis=1)
+
+	def query(self, Q, k=None):
+		"""
+        Classifies the queries.
+
+        Parameters:
+        Q (np.array): Query states of shape (m, dim).
+        k (int): Number of neighbors. Default is self.k.
+
+        Returns:
+        tuple: Probability of a defender win (m,), confidence in [0, 1] (m,), distance to the nearest
+               labelled state (m,). The confidence is the agreement of the neighbors |2p - 1|, scaled
+               down by radius/distance when the neighbors are farther than radius on average.
+        """
+		d, lab = self.neighbors(Q, k)
+		if d.shape[1] == 0:
+			m = len(d)
+			return np.full(m, 0.5), np.zeros(m), np.full(m, np.inf)
+		w = 1/(d + 1e-3*self.radius)
+		p = np.sum(w*lab, axis=1)/np.sum(w, axis=1)
+		conf = np.abs(2*p - 1)*np.minimum(1, self.radius/np.maximum(d.mean(axis=1), 1e-12))
+		return p, conf, d[:, 0]
+
+	def save(self, fname):
+		self.add(np.zeros((0, self.X.shape[1])), np.zeros(0))
+		np.savez(fname, X=np.concatenate([self.X] + self.buf_X), y=np.concatenate([self.y] + self.buf_y),
+				 params=np.array([self.k, self.radius, self.rebuild_frac]))
+
+	@classmethod
+	def load(cls, fname):
+		data = np.load(fname)
+		k, radius, frac = data['params']
+		return cls(data['X'], data['y'], int(k), radius, frac, dim=data['X'].shape[1])
+
+
+######################## reduced game, (rho_D, rho_I) -> outcome ########################
+
+def load_res(root='res', dt=0.05):
+	"""
+    Labels every state of the trajectories saved by envelope_barrier(..).
+
+    Parameters:
+    root (str): Directory of the r1_*-r2_*/data.csv files. Default is 'res'.
+    dt (float): Time step the trajectories were integrated with. Default is 0.05 seconds.
+
+    Returns:
+    tuple: States (n, 2) as [rho_D, rho_I] and labels (n,), 1 where the defender wins.
+    """
+	from envelope import envelope_winner, INTRUDER
+	X, y = [], []
+	for fname in sorted(glob.glob(os.path.join(root, '*', 'data.csv'))):
+		ss = np.loadtxt(fname, delimiter=',', ndmin=2)[:, :4]
+		if not len(ss):
+			continue
+		# envelope_barrier appends, a file may hold the same trajectory several times
+		starts = np.flatnonzero(np.all(ss == ss[0], axis=1))
+		ss = ss[:starts[1]] if len(starts) > 1 else ss
+		# a trajectory not stopped by the intruder winning is a defender win, see envelope_barrier_batch
+		win = float(envelope_winner(ss[-1:], dt)[0] != INTRUDER)
+		X.append(ss[:, [0, 2]])
+		y.append(np.full(len(ss), win))
+	return (np.concatenate(X), np.concatenate(y)) if X else (np.zeros((0, 2)), np.zeros(0))
+
+def reduced_game_index(root='res', **kwargs):
+	"""
+    OutcomeIndex over the trajectories in root.
+    """
+	return OutcomeIndex(*load_res(root), **kwargs)
+
+def predict_outcome(index, r1, r2, min_confidence=0.8, dt=None, attractor_tol=0.25, learn=True):
+	"""
+    Probability that the defender wins from (r1, r2), from the index where it is confident enough
+    and from envelope_barrier_batch elsewhere.
+
+    Parameters:
+    index (OutcomeIndex): Index of the reduced game.
+    r1 (np.array): Radial distances of the defender from the target center.
+    r2 (np.array): Radial distances of the intruder from the target center.
+    min_confidence (float): Queries with a lower confidence are simulated. Default is 0.8.
+    dt (float): Time step of the simulation. Default is recommended_dt() of timestep.py.
+    attractor_tol (float): Passed to envelope_barrier_batch. Default is 0.25.
+    learn (bool): Add the simulated trajectories to the index. Default is True.
+
+    Returns:
+    tuple: Probability of a defender win, confidence (1 where simulated), and a mask of the
+           queries that were simulated.
+    """
+	from envelope import envelope_barrier_batch, DEFENDER
+	r1, r2 = np.broadcast_arrays(np.atleast_1d(np.asarray(r1, dtype=float)), np.atleast_1d(np.asarray(r2, dtype=float)))
+	p, conf, _ = index.query(np.stack([r1, r2], axis=-1))
+	exact = conf < min_confidence
+	if exact.any():
+		from timestep import recommended_dt
+		dt = recommended_dt() if dt is None else dt
+		ss, lengths, ts, winner = envelope_barrier_batch(r1[exact], r2[exact], dt=dt, attractor_tol=attractor_tol)
+		win = (winner == DEFENDER).astype(float)
+		p[exact], conf[exact] = win, 1.
+		if learn:
+			ok = np.isfinite(ss[..., 0])
+			index.add(ss[..., [0, 2]][ok], np.broadcast_to(win, ok.shape)[ok])
+	return p, conf, exact
+
+
+################### Monte Carlo runs, D1 (x, y, heading) -> capture #####################
+
+# the sampling boxes of Monte_Carlo.m, region: (x range, y range)
+MC_REGIONS = {1: ([0, 5], [0, 5]), 2: ([5, 10], [0, 5]), 3: ([0, 5], [5, 10])}
+MC_SAMPLES = 100    # numSimulations of Monte_Carlo.m
+
+class MonteCarloOutcomes(object):
+	"""
+    Capture probability of the Monte Carlo study from the successful conditions only.
+
+    Parameters:
+    directory (str): Directory of the successful_conditions_*.mat files.
+    k (int): Number of neighbors of the density estimate. Default is 5.
+    """
+	def __init__(self, directory=os.path.join('..', 'Matlab', 'Monte_Carlo_Data'), k=5):
+		self.k = k
+		self.sets = {}
+		for fname in sorted(glob.glob(os.path.join(directory, 'successful_conditions_region*_angle*rad.mat'))):
+			m = re.search(r'region(\d+)_angle(-?[\d.]+)rad', fname)
+			region, angle = int(m.group(1)), float(m.group(2))
+			D1 = np.atleast_2d(loadmat(fname)['successful_conditions'])    # [heading, speed, y, x]
+			xy = D1[:, [3, 2]] if D1.size else np.zeros((0, 2))
+			self.sets[(region, angle)] = (cKDTree(xy) if len(xy) else None, len(xy))
+
+	def add(self, region, angle, xy):
+		"""
+        Adds the successful positions of new runs of the same study (region, heading angle).
+        """
+		tree, n = self.sets.get((region, angle), (None, 0))
+		old = tree.data if tree is not None else np.zeros((0, 2))
+		xy = np.concatenate([old, np.asarray(xy, dtype=float).reshape(-1, 2)])
+		self.sets[(region, angle)] = (cKDTree(xy), len(xy))
+
+	def query(self, x, y, heading):
+		"""
+        Capture probability of D1 starting at (x, y) with the given heading.
+
+        Returns:
+        tuple: Probability, confidence in [0, 1] (0 if no run of the study covers the query). The k
+               nearest successes lie in a disk expected to hold n samples of the study; with a
+               Beta(k + 1, n - k + 1) posterior of the probability, the confidence is |2 P(p > 1/2) - 1|,
+               low when the vote k/n is split or the disk, hence the evidence, is small.
+        """
+		for region, (xr, yr) in MC_REGIONS.items():
+			if not (xr[0] <= x <= xr[1] and yr[0] <= y <= yr[1]):
+				continue
+			for (reg, angle), (tree, n) in self.sets.items():
+				if reg != region or abs((angle - heading + np.pi) % (2*np.pi) - np.pi) > 1e-2:
+					continue
+				area = (xr[1] - xr[0])*(yr[1] - yr[0])
+				if tree is None:
+					# no success among all the samples of the study
+					k, disk = 0, area
+				else:
+					k = min(self.k, n)
+					d, _ = tree.query([x, y], k)
+					# the disk of the k nearest successes, clipped to the sampling box
+					disk = min(np.pi*max(np.max(d), 1e-9)**2, area)
+				# successes among the samples expected in the disk
+				total = max(k, MC_SAMPLES*disk/area)
+				conf = abs(2*beta.sf(0.5, k + 1, total - k + 1) - 1)
+				return k/total, conf
+		return np.nan, 0.
+
+
+if __name__ == '__main__':
+	import time
+
+	t0 = time.time()
+	index = reduced_game_index()
+	print('%d labelled states from res/, %.1f s'%(len(index), time.time() - t0))
+
+	rng = np.random.default_rng(0)
+	r1 = rng.uniform(1, 9, 200)
+	r2 = r1 + rng.uniform(-1.9, 1.9, 200)
+	t0 = time.time()
+	p, conf, exact = predict_outcome(index, r1, r2)
+	print('200 queries: %.1f s, %d simulated, index now %d states'%(time.time() - t0, exact.sum(), len(index)))
+	t0 = time.time()
+	p2, conf2, exact2 = predict_outcome(index, r1 + 0.02, r2 - 0.02)
+	print('200 nearby queries: %.2f s, %d simulated, %.1f%% agree with the first answers'
+		  %(time.time() - t0, exact2.sum(), 100*np.mean((p2 > 0.5) == (p > 0.5))))
+
+	mc = MonteCarloOutcomes()
+	for q in [(2.5, 2.5, 0.), (7.5, 2.5, 0.), (2.5, 7.5, np.pi), (8., 8., 0.)]:
+		print('D1 at (%.1f, %.1f), heading %.2f: capture probability %.2f, confidence %.2f'%(q + mc.query(*q)))
@@ -0,0 +1,278 @@
+'''
+Map of the outcome of a defender-intruder engagement over its initial conditions.
+
+"Who wins from here, and when?" otherwise takes a new integration (and
+envelope_barrier(..) writes to res/ on the way). Here the engagements of
+engagement.py, one defender against one intruder, are run in batches from a
+grid of initial conditions
+
+    rho_D       distance of the defender to the target
+    rho_I       distance of the intruder to the target
+    dtheta      angle between the two as seen from the target, in [0, pi]
+                (the engagement from -dtheta is the mirror image)
+
+and the winner, the time of the capture or breach and the positions at that
+time are kept in memory-mapped .npy rasters, in a directory of build/ named
+after the hash of Config, of the source of engagement.py and vecgram.py, and
+the grid. The rasters are at the finest
+resolution, shape0 refined `levels` times; the nodes at stride 2^levels are
+run first, then every refinement runs the nodes of the next stride only in
+the cells whose corners do not all have the same winner. A map interrupted
+is resumed where it stopped, the nodes already run being marked in done.npy
+and the level reached in meta.json. meta.json is written once the rasters
+exist, and a directory without it is started over.
+
+query(..) finds for every point the finest cell around it whose corners were
+all run: the winner of the nearest corner, and the time interpolated
+trilinearly when the corners agree (of the nearest corner otherwise).
+
+    python outcome_map.py                   build (or resume) the map and check the queries
+    python outcome_map.py --levels 4        a map refined once more
+'''
+
+import os
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+from math import pi
+import engagement
+import vecgram
+from engagement import engagement_step, ACTIVE, CAPTURED, BREACHED, R
+from envelope import NONE, DEFENDER, INTRUDER
+from timestep import recommended_dt
+from Config import config_hash, source_hash
+
+
+def run_outcomes(rho_D, rho_I, dtheta, dt=None, t_max=60., chunk=4096):
+	"""
+    Runs one engagement per initial condition, the defender on the x axis heading to the target.
+
+    Parameters:
+    rho_D, rho_I, dtheta (np.array): Initial conditions, shape (K,).
+    dt (float): Time step. Default is recommended_dt() of timestep.py.
+    t_max (float): Time horizon. Default is 60 seconds.
+    chunk (int): Engagements run together. Default is 4096.
+
+    Returns:
+    tuple: Winner (K,) (NONE if undecided at t_max), time of the end (K,) (nan if undecided),
+           and positions (K, 4) as (x_D, y_D, x_I, y_I) at the end (at t_max if undecided).
+    """
+	dt = recommended_dt() if dt is None else dt
+	K = len(rho_D)
+	winner, t_end, x_end = np.full(K, NONE, dtype=np.int8), np.full(K, np.nan), np.zeros((K, 4))
+	for k in range(0, K, chunk):
+		sl = slice(k, k + chunk)
+		XD = np.stack([rho_D[sl], np.zeros(len(rho_D[sl]))], axis=-1)[:, None]
+		XI = np.stack([rho_I[sl]*np.cos(dtheta[sl]), rho_I[sl]*np.sin(dtheta[sl])], axis=-1)[:, None]
+		hD = np.arctan2(-XD[..., 1], -XD[..., 0])
+		status = np.full((len(XD), 1), ACTIVE)
+		t_k = np.full(len(XD), np.nan)
+		cache = {}
+		t = 0
+		# players stop when the game ends, the positions left are the terminal ones
+		while t < t_max and (status == ACTIVE).any():
+			before = status[:, 0] == ACTIVE
+			engagement_step(XD, XI, hD, status, cache, dt)
+			t += dt
+			t_k[before & (status[:, 0] != ACTIVE)] = t
+		winner[sl] = np.select([status[:, 0] == CAPTURED, status[:, 0] == BREACHED], [DEFENDER, INTRUDER], NONE)
+		t_end[sl] = t_k
+		x_end[sl] = np.concatenate([XD[:, 0], XI[:, 0]], axis=-1)
+	return winner, t_end, x_end
+
+
+class OutcomeMap(object):
+	"""
+    Memory-mapped outcome rasters over (rho_D, rho_I, dtheta), refined where the winner changes.
+
+    Parameters:
+    lo, hi (tuple): Range of rho_D, rho_I and dtheta. Default is (0, R, 0) to (15, R + 15, pi).
+    shape0 (tuple): Nodes per axis before any refinement. Default is (16, 16, 10).
+    levels (int): Number of refinements the rasters are sized for. Default is 3.
+    dt (float): Time step of the engagements. Default is recommended_dt() of timestep.py, when the map is opened.
+    t_max (float): Time horizon. Default is 60 seconds.
+    root (str): Directory of the maps. Default is 'build'.
+    """
+	def __init__(self, lo=(0., R, 0.), hi=(15., R + 15., pi), shape0=(16, 16, 10), levels=3,
+				 dt=None, t_max=60., root='build'):
+		self.lo, self.hi = np.asarray(lo, dtype=float), np.asarray(hi, dtype=float)
+		self.shape0, self.levels = tuple(shape0), levels
+		dt = recommended_dt() if dt is None else dt
+		self.dt, self.t_max = dt, t_max
+		self.shape = tuple((n - 1)*2**levels + 1 for n in shape0)
+		self.h = (self.hi - self.lo)/(np.asarray(self.shape) - 1)
+		code = hashlib.sha1((config_hash() + source_hash(engagement, vecgram)).encode()).hexdigest()
+		key = '%s_%s'%(code[:12], '_'.join('%g'%v for v in tuple(lo) + tuple(hi) + self.shape0 + (levels, dt, t_max)))
+		self.dir = os.path.join(root, 'outcome_map_' + key)
+		self.meta_file = os.path.join(self.dir, 'meta.json')
+
+		# a directory left without meta.json was interrupted before its rasters were complete
+		new = not os.path.exists(self.meta_file)
+		if not os.path.isdir(self.dir):
+			os.makedirs(self.dir)
+		mode = 'w+' if new else 'r+'
+		def raster(name, dtype, shape):
+			return np.lib.format.open_memmap(os.path.join(self.dir, name + '.npy'), mode, dtype, shape)
+		self.winner = raster('winner', np.int8, self.shape)
+		self.t_end = raster('t_end', np.float32, self.shape)
+		self.x_end = raster('x_end', np.float32, self.shape + (4,))
+		self.done = raster('done', np.bool_, self.shape)
+		if new:
+			for a in (self.winner, self.t_end, self.x_end, self.done):
+				a.flush()
+			self.meta = {'config': config_hash(), 'code': code, 'lo': list(lo), 'hi': list(hi), 'shape0': list(shape0),
+						 'levels': levels, 'dt': dt, 't_max': t_max, 'level': -1}
+			self._save_meta()
+		else:
+			with open(self.meta_file) as f:
+				self.meta = json.load(f)
+
+	def _save_meta(self):
+		tmp = self.meta_file + '.tmp'
+		with open(tmp, 'w') as f:
+			json.dump(self.meta, f, indent=1)
+		os.replace(tmp, self.meta_file)
+
+	def nodes(self, idx):
+		"""
+        Initial conditions (K, 3) of the raster indices idx (K, 3).
+        """
+		return self.lo + idx*self.h
+
+	def solve(self, idx, verbose=False):
+		"""
+        Runs the engagements of the nodes idx (K, 3) not run yet and writes them to the rasters.
+
+        Returns:
+        int: Number of engagements run.
+        """
+		idx = idx[~self.done[tuple(idx.T)]]
+		if not len(idx):
+			return 0
+		t0 = time.time()
+		x = self.nodes(idx)
+		w, t, xe = run_outcomes(x[:, 0], x[:, 1], x[:, 2], self.dt, self.t_max)
+		I = tuple(idx.T)
+		self.winner[I], self.t_end[I], self.x_end[I] = w, t, xe
+		self.done[I] = True
+		for a in (self.winner, self.t_end, self.x_end, self.done):
+			a.flush()
+		if verbose:
+			print('%d engagements: %.1f s'%(len(idx), time.time() - t0))
+		return len(idx)
+
+	def _cells(self, s):
+		# lower corners of the cells at stride s, and the 8 corner offsets
+		grids = [np.arange(0, n - 1, s) for n in self.shape]
+		lower = np.stack(np.meshgrid(*grids, indexing='ij'), axis=-1).reshape(-1, 3)
+		corners = np.array([[a, b, c] for a in (0, 1) for b in (0, 1) for c in (0, 1)])*s
+		return lower, corners
+
+	def refine(self, verbose=False):
+		"""
+        Runs the next level: the coarsest nodes first, then the nodes of the next stride in the
+        cells whose corners disagree.
+
+        Returns:
+        int: Number of engagements run, None if the finest level is reached.
+        """
+		level = self.meta['level'] + 1
+		if level > self.levels:
+			return None
+		if level == 0:
+			s = 2**self.levels
+			grids = [np.arange(0, n, s) for n in self.shape]
+			n_run = self.solve(np.stack(np.meshgrid(*grids, indexing='ij'), axis=-1).reshape(-1, 3), verbose)
+		else:
+			s = 2**(self.levels - level + 1)
+			lower, corners = self._cells(s)
+			I = tuple((lower[:, None, :] + corners).transpose(2, 0, 1))
+			w, ran = self.winner[I], self.done[I].all(axis=1)
+			# only the cells of the previous level, whose corners were all run
+			mixed = lower[ran & (w != w[:, :1]).any(axis=1)]
+			lower = lower[ran]
+			# every node of stride s/2 in the mixed cells
+			half = np.array([[a, b, c] for a in (0, 1, 2) for b in (0, 1, 2) for c in (0, 1, 2)])*(s//2)
+			idx = np.unique((mixed[:, None, :] + half).reshape(-1, 3), axis=0)
+			if verbose:
+				print('level %d: %d of %d cells with different winners'%(level, len(mixed), len(lower)))
+			n_run = self.solve(idx, verbose)
+		self.meta['level'] = level
+		self._save_meta()
+		return n_run
+
+	def build(self, verbose=False):
+		"""
+        Runs every level not run yet.
+        """
+		while self.refine(verbose) is not None:
+			pass
+		return self
+
+	def query(self, rho_D, rho_I, dtheta):
+		"""
+        Winner and time to the end of the engagements from arbitrary initial conditions.
+
+        Parameters:
+        rho_D, rho_I, dtheta (np.array): Initial conditions, dtheta in radians (folded to [0, pi]).
+
+        Returns:
+        tuple: Winner (NONE outside the map or where no cell was run) and time to the end (nan if
+               undecided or outside the map).
+        """
+		dtheta = np.abs((np.asarray(dtheta, dtype=float) + pi) % (2*pi) - pi)
+		x = np.stack(np.broadcast_arrays(np.asarray(rho_D, dtype=float), np.asarray(rho_I, dtype=float), dtheta), axis=-1)
+		shape = x.shape[:-1]
+		x = x.reshape(-1, 3)
+		u = (x - self.lo)/self.h
+		n = np.asarray(self.shape)
+		inside = ((u >= 0) & (u <= n - 1)).all(axis=1)
+		winner, t = np.full(len(x), NONE, dtype=np.int8), np.full(len(x), np.nan)
+		todo = inside.copy()
+		for k in range(self.levels + 1):
+			s = 2**k
+			# lower corner of the cell at stride s, the last cell for points on the upper faces
+			i0 = np.minimum(np.floor(u/s).astype(int)*s, (n - 1 - s)//s*s)
+			corners = np.array([[a, b, c] for a in (0, 1) for b in (0, 1) for c in (0, 1)])*s
+			ci = np.minimum(i0[:, None, :] + corners, n - 1)
+			I = tuple(ci.transpose(2, 0, 1))
+			ready = todo & self.done[I].all(axis=1)
+			if not ready.any():
+				continue
+			f = (u - i0)/s
+			wts = np.prod(np.where(corners > 0, f[:, None, :], 1 - f[:, None, :]), axis=-1)
+			w_c, t_c = self.winner[I][ready], self.t_end[I][ready].astype(float)
+			near = np.argmax(wts[ready], axis=1)
+			rows = np.arange(ready.sum())
+			winner[ready] = w_c[rows, near]
+			same = (w_c == w_c[:, :1]).all(axis=1) & np.isfinite(t_c).all(axis=1)
+			t[ready] = np.where(same, (wts[ready]*np.nan_to_num(t_c)).sum(axis=1), t_c[rows, near])
+			todo &= ~ready
+		return winner.reshape(shape), t.reshape(shape)
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Outcome map of the engagements over the initial conditions.')
+	parser.add_argument('--levels', type=int, default=3, help='number of refinements')
+	args = parser.parse_args()
+
+	t0 = time.time()
+	omap = OutcomeMap(levels=args.levels).build(verbose=True)
+	n_done, n_all = omap.done.sum(), omap.done.size
+	print('%s: %d of %d nodes run (%.1f%%), %.1f s'%(omap.dir, n_done, n_all, 100.*n_done/n_all, time.time() - t0))
+
+	# queries against new engagements
+	rng = np.random.default_rng(0)
+	K = 2000
+	q = rng.uniform(omap.lo, omap.hi, (K, 3))
+	t0 = time.time()
+	w_q, t_q = omap.query(q[:, 0], q[:, 1], q[:, 2])
+	t_query = time.time() - t0
+	t0 = time.time()
+	w_r, t_r, _ = run_outcomes(q[:, 0], q[:, 1], q[:, 2], omap.dt, omap.t_max)
+	print('%d queries: %.3f s, against %.1f s of engagements'%(K, t_query, time.time() - t0))
+	both = np.isfinite(t_q) & np.isfinite(t_r)
+	print('same winner %.1f%%; time to the end off by %.2f s (median), %.2f s (90th percentile)'
+		  %(100*(w_q == w_r).mean(), np.median(np.abs(t_q - t_r)[both]), np.percentile(np.abs(t_q - t_r)[both], 90)))
@@ -9,6 +9,8 @@ import numpy as np
 from math import cos, sin, acos, sqrt, tan
 # from vecgram import semipermeable_r, velocity_vec, get_phi, get_phi_max
 from vecgram import *
+from bulk_plot import add_lines
+from lod_store import load_lod, cartesian, display_tolerance
 
 from Config import Config
 r = Config.CAP_RANGE # Capture range of the defender
@@ -43,11 +45,21 @@ def save_traj_plot(traj, dirc):
 	plt.savefig(dirc)
 	plt.close()
 
+# the states of a lod.npz at the coarsest level within tol, as the readers below return them
+def _read_lod(fname, tol):
+	ss, phis, _, _ = load_lod(fname, tol)
+	return ss, cartesian(ss), phis, ss[:, 2]/ss[:, 0]
+
 # this function read the data created by envelope_barrier(..)
-def read_dwin_data():
+def read_dwin_data(tol=None):
 	"""
     Reads defender winning data from a CSV file and returns arrays of states, positions, phi angles, and ratios.
+
+    Parameters:
+    tol (float): Display tolerance, as in read_data(). Default is None, every state from data.csv.
     """
+	if tol is not None and os.path.exists('res/r1_6.100-r2_6.600/lod.npz'):
+		return _read_lod('res/r1_6.100-r2_6.600/lod.npz', tol)
 	with open('res/r1_6.100-r2_6.600/data.csv') as f:
 		# print('reading')
 		reader = csv.reader(f, delimiter=',')
@@ -67,10 +79,15 @@ def read_dwin_data():
 				# print(len(S))
 	return np.asarray(ss), xs, phis, ratios
 
-def read_barrier_data():
+def read_barrier_data(tol=None):
 	"""
     Reads barrier data from a CSV file and returns arrays of states, positions, phi angles, and ratios.
+
+    Parameters:
+    tol (float): Display tolerance, as in read_data(). Default is None, every state from data.csv.
     """
+	if tol is not None and os.path.exists('res/r1_6.500-r2_6.540/lod.npz'):
+		return _read_lod('res/r1_6.500-r2_6.540/lod.npz', tol)
 	with open('res/r1_6.500-r2_6.540/data.csv') as f:
 		# print('reading')
 		reader = csv.reader(f, delimiter=',')
@@ -92,15 +109,26 @@ def read_barrier_data():
 
 # this function read all the data saved by envelope_barrier(), so as to  
 # plot the cyan trajectories in Figure 16
-def read_data():
+def read_data(tol=None):
 	"""
     Reads all data saved by envelope_barrier() to plot trajectories in Figure 16.
+
+    Parameters:
+    tol (float): Display tolerance. If given, trajectories with a lod.npz (see lod_store.py) are read
+                 at the coarsest level within tol, and their traj.png is left as it is. Default is None,
+                 every state from data.csv.
     """
 	S, X, PHI, R = [], [], [], []
 	for root, dirs, files in os.walk('res'):
 		for dname in dirs:
 			# print(dname)
-			if os.path.exists('res/'+dname+'/data.csv'):
+			if tol is not None and os.path.exists('res/'+dname+'/lod.npz'):
+				ss, xs, phis, ratios = _read_lod('res/'+dname+'/lod.npz', tol)
+				S.append(ss)
+				X.append(xs)
+				PHI.append(phis)
+				R.append(ratios)
+			elif os.path.exists('res/'+dname+'/data.csv'):
 				# print('exists')
 				with open('res/'+dname+'/data.csv') as f:
 					# print('reading')
@@ -155,11 +183,11 @@ def plot_bds(ax, func, n=5, label=None):
 	ax.plot(r1s, r2s, 'k--', label=label)
 
 # dashed blue lines in Figure 16
-def read_switchline():
+def read_switchline(fname='switch.csv'):
 	"""
     Reads switch line data from a CSV file.
     """
-	with open('switch.csv', 'r') as f:
+	with open(fname, 'r') as f:
 		reader = csv.reader(f, delimiter=',')
 		r1, r2 = [], []
 		for row in reader:
@@ -169,9 +197,12 @@ def read_switchline():
 	return r1, r2
 
 # dashed blue lines in Figure 16
-def get_switchline():
+def get_switchline(fname='switch.csv'):
 	"""
     Computes the switch line based on the Phase II constraints and saves it to a CSV file.
+
+    Parameters:
+    fname (str): CSV file the points of the line are appended to. Default is 'switch.csv'.
     """
 	r1s, r2s, phis = [], [], []
 	r0s = np.linspace(0.2*r, 8*r, 66)
@@ -201,17 +232,50 @@ def get_switchline():
 	for p in cs.collections[1].get_paths()[0].vertices:
 		if p[0] > r1_min and p[1] > r2_min:
 			line.append(p)
-			with open('switch.csv', 'a') as f:
+			with open(fname, 'a') as f:
 				f.write(','.join(list(map(str, p)))+'\n')
 	plt.close()
 
 	return np.asarray(line)
 
-if __name__ == '__main__':
-    # This block includes reading data, plotting phase II constraints, plotting trajectories on boundaries,
-    # plotting switch lines, and setting up the overall plot with legends and labels.
+# regions of phase_field.py under Figure 16: the "set 0" region of get_phi
+# shaded, the Phase II bounds (rDcap, rIcap) dotted
+def plot_field(ax, field, alpha=0.25):
+	"""
+    Overlays the regions of a PhaseField on the (rho_D, rho_I) plane.
+
+    Parameters:
+    ax (matplotlib.axes.Axes): The axes on which to draw.
+    field (PhaseField): The field, see phase_field.py.
+    alpha (float): Opacity of the shading. Default is 0.25.
+    """
+	from phase_field import SET_ZERO
+	g = field.grid
+	ax.contourf(g, g, (field.region == SET_ZERO).T.astype(float), levels=[0.5, 1.5], colors='y', alpha=alpha, zorder=0)
+	ax.contour(g, g, field.phase2.T.astype(float), levels=[0.5], colors='g', linestyles=':', zorder=1)
+	# empty artists for the legend
+	ax.fill([], [], color='y', alpha=alpha, label=r'$\phi_D^*=0$')
+	ax.plot([], [], 'g:', label='Phase II bounds')
+
+# Figure 16: the optimal trajectories ss (every other one drawn in cyan), the defender
+# winning trajectory ssd, the barrier ssb and the switch lines in the (rho_D, rho_I) plane
+def plot_overall(ss, ssd, ssb, switch, fname='Optimal trajectories.png', rasterized=False, field=None):
+	"""
+    Plots all optimal trajectories together with the Phase II constraints and the switch lines.
+
+    Parameters:
+    ss (list): States of the optimal trajectories, arrays with rows [rho_D, theta_D, rho_I, theta_I].
+    ssd (np.array): States of the defender winning trajectory (6.1, 6.6).
+    ssb (np.array): States of the barrier trajectory (6.5, 6.54).
+    switch (tuple): rho_D and rho_I of the switch line, as returned by read_switchline().
+    fname (str): File the figure is saved to. Default is 'Optimal trajectories.png'.
+    rasterized (bool): Rasterize the layer of cyan trajectories. Default is False.
+    field (PhaseField): If given, its regions are drawn under the trajectories, see plot_field().
 
-	r1, r2 = read_switchline()
+    Returns:
+    matplotlib.figure.Figure: The figure.
+    """
+	r1, r2 = switch
 
 	line2x = [2.36, 2.5, 2.71, 2.85, 3.196, 4.605, 5.952, 7.518]
 	line2y = [0.47, 0.64, 0.88, 1.04, 1.42, 2.93, 4.317, 5.9015]
@@ -220,11 +284,8 @@ if __name__ == '__main__':
 	ax.plot(r1, r2, 'b--', alpha=0.6, label='switch line', zorder=1000, linewidth=2.)
 	ax.plot(line2x, line2y, 'b--', alpha=0.6, zorder=1000, linewidth=2.)
 
-	# print('reading trajectory')
-	ss, xs, phis, rs = read_data()
-	ssd, _, _, _ = read_dwin_data()
-	ssb, _, _, _ = read_barrier_data()
-
+	if field is not None:
+		plot_field(ax, field)
 	plot_bds(ax, triag_cnstr_3)
 	plot_bds(ax, triag_cnstr_2)
 	plot_bds(ax, triag_cnstr_1, label=r'Phase II constraint')
@@ -233,11 +294,8 @@ if __name__ == '__main__':
 
 	# # fig.colorbar(cntr, ax=ax)
 
-	for i, s in enumerate(ss):
-		if i%2 == 0:
-			# ax.plot(s[:,0], s[:,2], 'bo-')
-			# ax.plot(s[:,0], s[:,2], 'bo-', ms=3, markevery=10)
-			ax.plot(s[:,0], s[:,2], 'c-', label=None, alpha=0.6)
+	# every other trajectory, in a single collection
+	add_lines(ax, [s[:, [0, 2]] for s in ss[::2]], rasterized, colors='c', alpha=0.6)
 
 	ax.plot(ssd[:,0], ssd[:,2], 'm-o', ms=3, markevery=10, zorder=1001, label=r'$(\rho_D, \rho_I)=(6.1, 6.6)$')
 	ax.plot(ssb[:,0], ssb[:,2], 'b', zorder=1001, label='barrier')
@@ -250,5 +308,20 @@ if __name__ == '__main__':
 	plt.xlabel(r'$\dot{\rho_D}$', fontsize=14)
 	plt.ylabel(r'$\dot{\rho_I}$', fontsize=14)
 	ax.legend(fontsize=12)
-	plt.savefig('Optimal trajectories.png')
+	plt.savefig(fname)
+	return fig
+
+if __name__ == '__main__':
+    # This block includes reading data, plotting phase II constraints, plotting trajectories on boundaries,
+    # plotting switch lines, and setting up the overall plot with legends and labels.
+
+	# print('reading trajectory')
+	# Figure 16 spans 10 units
+	tol = display_tolerance(10.)
+	ss, xs, phis, rs = read_data(tol)
+	ssd, _, _, _ = read_dwin_data(tol)
+	ssb, _, _, _ = read_barrier_data(tol)
+
+	from phase_field import PhaseField
+	plot_overall(ss, ssd, ssb, read_switchline(), field=PhaseField())
 	plt.show()
@@ -0,0 +1,247 @@
+'''
+Replay of the flight paths recorded by the Simulink model, Matlab/Animation/*_pathsim.mat.
+
+Every file holds one struct pathsim_<name> (D1, D2, I) with the fields
+
+    time        (1, n)      time stamps of the variable-step solver, not uniform, with repeats
+    Xe          (n, 3)      position in the NED frame (z pointing down)
+    Rbe         (3, 3, n)   rotation of the body frame
+    attitude    (n, 3)      roll, pitch, yaw
+    TAS         (n, 1)      true airspeed
+    frame                   'NED'
+
+PathSim reads a file only when one of its fields is first used, and keeps it.
+replay(..) draws the paths in 3D like Animation.m (with its top-down mini map)
+and writes a video: the frame times span the window of all the paths, at the
+target frame rate but never more frames than the recording with the most
+samples in the window has (the video rate is lowered instead, keeping the
+speed), and every path shows its last recorded sample at or before every frame
+time, as the skipFrames of Animation.m; every artist is created once and only
+its data is changed from frame to frame, and every frame goes to the writer as
+soon as it is drawn. Without a display, the Agg backend is used.
+
+    python pathsim.py                       replay ../Matlab/Animation to pathsim.mp4 (pathsim.gif without ffmpeg)
+    python pathsim.py DIR -o out.mp4 --fps 30
+'''
+
+import os
+import sys
+import glob
+import time
+import numpy as np
+from scipy.io import loadmat, whosmat
+
+import matplotlib
+if not os.environ.get('DISPLAY') and sys.platform.startswith('linux'):
+	matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+from matplotlib import animation
+
+# colors of Animation.m
+COLORS = {'D1': 'red', 'D2': 'blue', 'I': 'green'}
+
+
+class PathSim(object):
+	"""
+    One recorded flight path, read from its .mat file on first use.
+
+    Parameters:
+    fname (str): Path of the <name>_pathsim.mat file.
+    """
+	FIELDS = ('time', 'Xe', 'Rbe', 'attitude', 'TAS', 'frame')
+
+	def __init__(self, fname):
+		self.fname = fname
+		self.name = os.path.basename(fname)[:-len('_pathsim.mat')]
+		self._data = None
+
+	def variable(self):
+		"""
+        Name of the struct in the file, read from the header only.
+        """
+		return [v[0] for v in whosmat(self.fname) if v[0].startswith('pathsim')][0]
+
+	def load(self):
+		"""
+        Reads the struct, once, into a dict of arrays: time (n,), Xe (n, 3), Rbe (n, 3, 3),
+        attitude (n, 3), TAS (n,) and frame.
+        """
+		if self._data is None:
+			var = self.variable()
+			s = loadmat(self.fname, variable_names=[var], squeeze_me=True, struct_as_record=False)[var]
+			self._data = {'time': np.atleast_1d(np.asarray(s.time, dtype=float)),
+						  'Xe': np.atleast_2d(np.asarray(s.Xe, dtype=float)),
+						  'Rbe': np.moveaxis(np.asarray(s.Rbe, dtype=float), -1, 0),
+						  'attitude': np.atleast_2d(np.asarray(s.attitude, dtype=float)),
+						  'TAS': np.atleast_1d(np.asarray(s.TAS, dtype=float)),
+						  'frame': str(s.frame)}
+		return self._data
+
+	def __getattr__(self, key):
+		if key in PathSim.FIELDS:
+			return self.load()[key]
+		raise AttributeError(key)
+
+	def __len__(self):
+		return len(self.time)
+
+def load_pathsims(directory='../Matlab/Animation'):
+	"""
+    Every *_pathsim.mat of a directory, none of them read yet.
+
+    Returns:
+    dict: PathSim keyed by the name of the player (D1, D2, I).
+    """
+	paths = [PathSim(f) for f in sorted(glob.glob(os.path.join(directory, '*_pathsim.mat')))]
+	return {p.name: p for p in paths}
+
+
+def frame_times(ts, fps, t0=None, t1=None):
+	"""
+    Times of the frames of several recordings, evenly spaced over their common window.
+
+    Parameters:
+    ts (list): Time stamps of every recording, non-decreasing.
+    fps (float): Largest number of frames per second (of simulated time).
+    t0, t1 (float): Time window. Default is from the first to the last sample of any recording.
+
+    Returns:
+    np.array: Frame times, at most as many as the distinct samples in the window of the
+              recording with the most, so that frames are never repeated to reach fps.
+    """
+	t0 = min(t[0] for t in ts) if t0 is None else t0
+	t1 = max(t[-1] for t in ts) if t1 is None else t1
+	n = int(round((t1 - t0)*fps)) + 1
+	samples = max(len(np.unique(t[(t >= t0) & (t <= t1)])) for t in ts)
+	return np.linspace(t0, t1, max(min(n, samples), 1))
+
+def frame_indices(t, frames):
+	"""
+    Index of the last recorded sample at or before every frame time, the first sample before
+    the recording starts and the last one after it ends.
+    """
+	return np.clip(np.searchsorted(t, frames, side='right') - 1, 0, len(t) - 1)
+
+# two crossed arms of a quadrotor at p, turned to the heading yaw, nan between the arms
+def _quad_arms(p, yaw, arm):
+	c, s = np.cos(yaw), np.sin(yaw)
+	a1, a2 = arm*np.array([c, s, 0.]), arm*np.array([-s, c, 0.])
+	return np.array([p - a1, p + a1, [np.nan]*3, p - a2, p + a2])
+
+def get_writer(fname, fps):
+	"""
+    Writer streaming frames to fname: ffmpeg for videos, Pillow for gifs or when ffmpeg is missing.
+
+    Returns:
+    tuple: The writer and the name of the file it writes (.gif if the format had to change).
+    """
+	if not fname.endswith('.gif') and animation.writers.is_available('ffmpeg'):
+		return animation.FFMpegWriter(fps=fps), fname
+	if not fname.endswith('.gif'):
+		fname = os.path.splitext(fname)[0] + '.gif'
+	# Pillow keeps the frames until the end, a gif has to be written at once
+	return animation.PillowWriter(fps=fps), fname
+
+def replay(paths, fname='pathsim.mp4', fps=14, speed=1., arm=0.7, target_radius=2., minimap=True,
+		   dpi=100, t0=None, t1=None):
+	"""
+    Renders recorded flight paths in 3D to a video.
+
+    Parameters:
+    paths (dict): PathSim (or anything with time and Xe) keyed by the name of the player.
+    fname (str): Output file, .mp4 (needs ffmpeg) or .gif. Default is 'pathsim.mp4'.
+    fps (float): Largest frame rate of the video. Default is 14, as Animation.m; lowered when the
+                 recordings have fewer samples than frames.
+    speed (float): Simulated seconds per second of video. Default is 1.
+    arm (float): Arm length of the quadrotors. Default is 0.7, as Animation.m.
+    target_radius (float): Radius of the target area. Default is 2, as Animation.m.
+    minimap (bool): Add the top-down view of Animation.m. Default is True.
+    dpi (int): Resolution of the frames. Default is 100.
+    t0, t1 (float): Time window. Default is the whole recording.
+
+    Returns:
+    tuple: Name of the file written and number of frames.
+    """
+	names = list(paths)
+	times = frame_times([np.ravel(paths[n].time) for n in names], fps/speed, t0, t1)
+	idx = {n: frame_indices(np.ravel(paths[n].time), times) for n in names}
+	X = {n: paths[n].Xe for n in names}
+	n_frames = len(times)
+	if n_frames > 1:
+		# fewer frames than fps gives: the same simulated time in a slower video
+		fps = min(fps, (n_frames - 1)*speed/(times[-1] - times[0]))
+
+	fig = plt.figure(figsize=(8, 6))
+	ax = fig.add_axes([0.02, 0.05, 0.7, 0.9], projection='3d')
+	allX = np.concatenate(list(X.values()))
+	lo, hi = allX.min(axis=0) - 2*arm, allX.max(axis=0) + 2*arm
+	span = max((hi - lo)[:2].max(), 1.)
+	mid = (lo + hi)/2
+	ax.set_xlim(mid[0] - span/2, mid[0] + span/2)
+	ax.set_ylim(mid[1] - span/2, mid[1] + span/2)
+	ax.set_zlim(mid[2] - span/4, mid[2] + span/4)
+	# NED: y to the right and z down, as the reversed axes of Animation.m
+	ax.invert_yaxis()
+	ax.invert_zaxis()
+	ax.set_xlabel('x axis, m')
+	ax.set_ylabel('y axis, m')
+	ax.set_zlabel('z axis, m')
+	th = np.linspace(0, 2*np.pi, 100)
+	ax.plot(target_radius*np.cos(th), target_radius*np.sin(th), 0*th, color='magenta')
+
+	# artists created once: full path, travelled path and body of every player
+	artists = {}
+	for n in names:
+		c = COLORS.get(n, None)
+		ax.plot(*X[n].T, color=c, lw=0.5, alpha=0.3)
+		trail, = ax.plot([], [], [], color=c, lw=1.5, label=n)
+		body, = ax.plot([], [], [], color=c, lw=2.5)
+		artists[n] = (trail, body)
+	ax.legend(loc='upper left')
+	title = ax.set_title('t = 0.0 s')
+
+	mini = {}
+	if minimap:
+		ax2 = fig.add_axes([0.78, 0.1, 0.2, 0.35])
+		ax2.add_patch(plt.Circle((0, 0), target_radius, color='magenta'))
+		for n in names:
+			ax2.plot(X[n][:, 0], X[n][:, 1], color=COLORS.get(n, None), lw=0.5)
+			mini[n], = ax2.plot([], [], 'o', color=COLORS.get(n, None), ms=4)
+		ax2.set_aspect('equal')
+		ax2.grid()
+		ax2.set_xlabel('x(m)')
+		ax2.set_ylabel('y(m)')
+
+	writer, fname = get_writer(fname, fps)
+	with writer.saving(fig, fname, dpi):
+		for f in range(n_frames):
+			for n in names:
+				k = idx[n][f]
+				trail, body = artists[n]
+				trail.set_data_3d(*X[n][:k + 1].T)
+				# heading along the path, the recorded attitude being empty
+				v = X[n][min(k + 1, len(X[n]) - 1)] - X[n][max(k - 1, 0)]
+				body.set_data_3d(*_quad_arms(X[n][k], np.arctan2(v[1], v[0]), arm).T)
+				if minimap:
+					mini[n].set_data([X[n][k, 0]], [X[n][k, 1]])
+			title.set_text('t = %.1f s'%times[f])
+			writer.grab_frame()
+	plt.close(fig)
+	return fname, n_frames
+
+
+if __name__ == '__main__':
+	import argparse
+	parser = argparse.ArgumentParser(description='Replay of the Simulink flight paths.')
+	parser.add_argument('directory', nargs='?', default='../Matlab/Animation')
+	parser.add_argument('-o', '--output', default='pathsim.mp4')
+	parser.add_argument('--fps', type=float, default=14)
+	parser.add_argument('--speed', type=float, default=1.)
+	args = parser.parse_args()
+
+	paths = load_pathsims(args.directory)
+	t_start = time.time()
+	for n, p in paths.items():
+		print('%s: %d samples over %.1f s'%(n, len(p), p.time[-1] - p.time[0]))
+	fname, n_frames = replay(paths, args.output, args.fps, args.speed)
+	print('%s: %d frames in %.1f s'%(fname, n_frames, time.time() - t_start))
@@ -0,0 +1,184 @@
+'''
+Semipermeability and phase regions of the reduced game over the (rho_D, rho_I) plane.
+
+semipermeable_r(..) and get_phi(..) solve the vectogram of one state at a time,
+and the Phase II bounds of Equations (23) (24) (27) and the constraints
+triag_cnstr_1..3 are only drawn as lines in Figure 16. Here a grid of the plane
+is solved in one pass of vectogram_batch(..), which gives for every node
+
+    phi         phi_D*, wrapped to [-pi, pi)
+    semi        the angle between the semipermeable directions (-pi where the
+                vectogram winds around the origin)
+    region      INFEASIBLE      outside the Phase II constraints, |rho_D - rho_I| > r
+                                or rho_D + rho_I < r (no state of the reduced game)
+                SET_ZERO        the "set 0" branch of get_phi, the control is 0
+                TANGENT         the control is one of the two tangents
+    phase2      within rDcap_min..rDcap_max and rIcap_min..rIcap_max
+
+and the field is saved in build/ under the hash of Config and of the source of
+vecgram.py: computing it takes about 2 s, reading it back 20 ms, in every
+process that plots Figure 16 or classifies states. A lookup is the
+node nearest to the state, O(1) for any number of states. constant(..) tells
+the states whose control is known without solving the vectogram: the nearest
+node and its 8 neighbours are all SET_ZERO, so the state is at least one grid
+step inside the region. envelope_dx_batch(.., field=) uses it to skip
+get_phi_batch there; few integrated states are that deep inside the set 0, and
+the script finds no measurable gain on the backward integration. plot_field(..)
+of overall_plot.py draws the regions under Figure 16.
+
+    python phase_field.py               compute (or read) the field, check it, time the integration
+'''
+
+import os
+import time
+import hashlib
+import numpy as np
+import vecgram
+from vecgram import vectogram_batch, r, rIcap_min, rIcap_max, rDcap_min, rDcap_max
+from Config import config_hash, source_hash
+
+# regions of the plane
+INFEASIBLE, SET_ZERO, TANGENT = 0, 1, 2
+
+
+def feasible(r1, r2):
+	"""
+    True for the states of the reduced game, within the Phase II constraints (triag_cnstr_1..3).
+    """
+	return (r1 > 0) & (r2 > 0) & (np.abs(r1 - r2) <= r) & (r1 + r2 >= r)
+
+def compute_field(lo=0., hi=10., n=501, **kwargs):
+	"""
+    Solves the vectogram on a grid of the (rho_D, rho_I) plane.
+
+    Parameters:
+    lo, hi (float): Range of rho_D and rho_I. Default is 0..10, as Figure 16.
+    n (int): Nodes per axis. Default is 501, a step of 0.02.
+    kwargs: Passed to vectogram_batch().
+
+    Returns:
+    dict: 'grid' (n,) and the rasters 'phi', 'semi', 'region', 'phase2' of shape (n, n),
+          indexed [rho_D, rho_I].
+    """
+	g = np.linspace(lo, hi, n)
+	r1, r2 = np.meshgrid(g, g, indexing='ij')
+	ok = feasible(r1, r2)
+	phi, semi = np.full(r1.shape, np.nan), np.full(r1.shape, np.nan)
+	region = np.full(r1.shape, INFEASIBLE, dtype=np.int8)
+	phi[ok], semi[ok], set0 = vectogram_batch(r1[ok], r2[ok], **kwargs)
+	region[ok] = np.where(set0, SET_ZERO, TANGENT)
+	phase2 = ok & (r1 >= rDcap_min) & (r1 <= rDcap_max) & (r2 >= rIcap_min) & (r2 <= rIcap_max)
+	return {'grid': g, 'phi': phi, 'semi': semi, 'region': region, 'phase2': phase2}
+
+# nodes whose 8 neighbours (and themselves) are all SET_ZERO
+def _interior(region):
+	z = np.pad(region == SET_ZERO, 1)
+	n1, n2 = region.shape
+	out = np.ones(region.shape, dtype=bool)
+	for a in range(3):
+		for b in range(3):
+			out &= z[a:a + n1, b:b + n2]
+	return out
+
+
+class PhaseField(object):
+	"""
+    The field of compute_field(), read from build/ when it was computed for this Config and vecgram.py.
+
+    Parameters:
+    lo, hi (float): Range of rho_D and rho_I. Default is 0..10.
+    n (int): Nodes per axis. Default is 501.
+    cache_dir (str): Directory of the fields. Default is 'build'.
+    """
+	def __init__(self, lo=0., hi=10., n=501, cache_dir='build'):
+		key = hashlib.sha1((config_hash() + source_hash(vecgram)).encode()).hexdigest()
+		fname = os.path.join(cache_dir, 'phase_field_%s_%g_%g_%d.npz'%(key[:12], lo, hi, n))
+		if os.path.exists(fname):
+			with np.load(fname) as f:
+				data = {k: f[k] for k in f.files}
+		else:
+			data = compute_field(lo, hi, n)
+			if not os.path.isdir(cache_dir):
+				os.makedirs(cache_dir)
+			np.savez_compressed(fname, **data)
+		self.fname = fname
+		self.grid, self.phi, self.semi = data['grid'], data['phi'], data['semi']
+		self.region, self.phase2 = data['region'], data['phase2']
+		self.lo, self.n = self.grid[0], len(self.grid)
+		self.h = self.grid[1] - self.grid[0]
+		self.const = _interior(self.region)
+
+	def index(self, r1, r2):
+		"""
+        Indices of the nearest nodes, and True where the states are within the grid.
+        """
+		i = np.rint((np.asarray(r1, dtype=float) - self.lo)/self.h)
+		j = np.rint((np.asarray(r2, dtype=float) - self.lo)/self.h)
+		inside = (i >= 0) & (i < self.n) & (j >= 0) & (j < self.n)
+		return np.clip(i, 0, self.n - 1).astype(int), np.clip(j, 0, self.n - 1).astype(int), inside
+
+	def lookup(self, key, r1, r2, fill=np.nan):
+		"""
+        Value of the raster key ('phi', 'semi', 'region' or 'phase2') at the nearest nodes.
+
+        Parameters:
+        key (str): Name of the raster.
+        r1, r2 (np.array): States.
+        fill: Value outside the grid. Default is nan.
+        """
+		i, j, inside = self.index(r1, r2)
+		A = getattr(self, key)
+		return np.where(inside, A[i, j], fill)
+
+	def constant(self, r1, r2):
+		"""
+        True for the states whose control is 0 without solving the vectogram.
+        """
+		i, j, inside = self.index(r1, r2)
+		return inside & self.const[i, j]
+
+
+if __name__ == '__main__':
+	from vecgram import semipermeable_r
+	from envelope import envelope_dx_batch
+	from retrograde import terminal_seeds
+	from RK4 import rk4
+
+	t0 = time.time()
+	field = PhaseField()
+	print('%s: %.1f s'%(field.fname, time.time() - t0))
+	ok = field.region != INFEASIBLE
+	print('feasible %.1f%% of the nodes: set 0 %.1f%%, constant %.1f%%, Phase II bounds %.1f%%'
+		  %(100*ok.mean(), 100*(field.region[ok] == SET_ZERO).mean(), 100*field.const[ok].mean(),
+			100*field.phase2[ok].mean()))
+
+	# random states: the lookup against the solver
+	rng = np.random.default_rng(0)
+	r1, r2 = rng.uniform(0., 10., 200000), rng.uniform(0., 10., 200000)
+	keep = feasible(r1, r2)
+	r1, r2 = r1[keep], r2[keep]
+	t0 = time.time()
+	const = field.constant(r1, r2)
+	t_lookup = time.time() - t0
+	t0 = time.time()
+	phi, semi, set0 = vectogram_batch(r1, r2)
+	print('%d states: lookup %.3f s, vectogram_batch %.2f s; %d constant, of which %d not set 0'
+		  %(len(r1), t_lookup, time.time() - t0, const.sum(), (const & ~set0).sum()))
+	d = np.abs(field.lookup('semi', r1, r2) - semi)
+	print('semipermeable angle at the nearest node: median error %.1e rad'%np.nanmedian(d))
+	k = np.flatnonzero(~set0)[:20]
+	sc = np.ravel([semipermeable_r(a, b) for a, b in zip(r1[k], r2[k])])
+	print('vectogram_batch against semipermeable_r: largest difference %.1e rad'
+		  %np.abs((semi[k] - sc + np.pi) % (2*np.pi) - np.pi).max())
+
+	# backward integration from the terminal manifold, with and without the field
+	S0 = terminal_seeds(100)
+	for name, f in [('get_phi_batch', None), ('field', field)]:
+		S = S0.copy()
+		t0 = time.time()
+		for _ in range(100):
+			S = rk4(lambda X: envelope_dx_batch(X, backward=True, field=f), S, 0.05)
+		print('%d seeds, 100 steps back with %s: %.2f s'%(len(S0), name, time.time() - t0))
+		if f is None:
+			S_ref = S
+	print('largest difference of the states: %.1e'%np.nanmax(np.abs(S - S_ref)))
@@ -0,0 +1,296 @@
+'''
+Optimization of the initial placement of the defenders.
+
+Monte_Carlo.m samples positions of D1 for a fixed intruder and D2 and keeps the
+ones that succeed. Here the initial positions (and optionally headings) of all N
+defenders are searched for directly, against a fixed set of S intruder starts:
+every candidate placement is played against every start with the batched
+engagement engine (engagement.py), so one generation of a population of P
+candidates is a single batch of P*S engagements.
+
+    fitness = capture rate + margin_weight * mean capture margin
+
+where the capture margin of an intruder is how far from the target area it was
+captured, (rho_I - R)/R, or minus the (normalized) distance of the closest
+defender when it breached. The search is a (mu/mu_w, lambda) CMA-ES in the box
+of allowed positions; evaluations are cached on the rounded parameters, as the
+box repair and the late generations propose nearby placements again, and a
+cache can be shared between restarts of the search. The keys include the
+identity of the problem (Config, intruder starts, defenders, box and options),
+so a cache shared between different problems never mixes their fitness.
+'''
+
+import time
+import hashlib
+import numpy as np
+from math import pi
+from engagement import engagement_step, pairwise_geometry, ACTIVE, CAPTURED, BREACHED, r, R
+from Config import Config, config_hash
+
+
+def evaluate_placements(XD0, hD0, XI0, dt=Config.TIME_STEP, t_max=30., tol=0.5):
+	"""
+    Plays every placement against every intruder start.
+
+    Parameters:
+    XD0 (np.array): Defender positions of the candidates, shape (P, N, 2).
+    hD0 (np.array): Defender headings of the candidates, shape (P, N).
+    XI0 (np.array): Intruder starts, shape (S, M, 2).
+    dt (float): Time step. Default is Config.TIME_STEP.
+    t_max (float): Time horizon. Default is 30 seconds, the StopTime of Monte_Carlo.m.
+    tol (float): Reassignment tolerance passed to assign_defenders(). Default is 0.5.
+
+    Returns:
+    tuple: Capture rate (P,) and mean capture margin (P,) over the starts and intruders.
+    """
+	P, N, S, M = XD0.shape[0], XD0.shape[1], XI0.shape[0], XI0.shape[1]
+	XD = np.repeat(XD0, S, axis=0).astype(float)
+	hD = np.repeat(hD0, S, axis=0).astype(float)
+	XI = np.tile(XI0, (P, 1, 1)).astype(float)
+	status = np.full((P*S, M), ACTIVE)
+	margin = np.zeros((P*S, M))
+	cache = {}
+
+	t = 0
+	while t < t_max and (status == ACTIVE).any():
+		before = status == ACTIVE
+		_, rho_I, d, _, _ = pairwise_geometry(XD, XI)
+		engagement_step(XD, XI, hD, status, cache, dt, tol)
+		t += dt
+		caught = before & (status == CAPTURED)
+		breached = before & (status == BREACHED)
+		margin[caught] = ((rho_I - R)/R)[caught]
+		margin[breached] = -((d.min(axis=1) - r)/R)[breached]
+
+	captured = (status == CAPTURED).reshape(P, S*M)
+	return captured.mean(axis=1), margin.reshape(P, S*M).mean(axis=1)
+
+
+class EvaluationCache(object):
+	"""
+    Fitness of placements already evaluated, keyed by the identity of the problem and the
+    parameters rounded to a grid.
+
+    Parameters:
+    decimals (int): Rounding of the parameters. Default is 2, well below the distance dt*vd
+                    a defender covers in one step.
+    """
+	def __init__(self, decimals=2):
+		self.decimals = decimals
+		self.table = {}
+		self.hits = 0
+		self.misses = 0
+
+	def key(self, theta, problem=''):
+		h = hashlib.sha1(problem.encode())
+		h.update(np.round(theta, self.decimals).tobytes())
+		return h.hexdigest()
+
+	def evaluate(self, thetas, func, problem=''):
+		"""
+        Fitness of every row of thetas, calling func only on the rows not in the cache.
+
+        Parameters:
+        thetas (np.array): Candidates of shape (P, dim).
+        func (callable): Fitness of candidates.
+        problem (str): Identity of the problem func scores, as PlacementProblem.identity().
+        """
+		keys = [self.key(th, problem) for th in thetas]
+		todo = [i for i, k in enumerate(keys) if k not in self.table]
+		# the same placement may appear twice in one population
+		first = {}
+		for i in todo:
+			first.setdefault(keys[i], i)
+		if first:
+			idx = list(first.values())
+			for i, f in zip(idx, func(np.asarray(thetas)[idx])):
+				self.table[keys[i]] = f
+		self.misses += len(first)
+		self.hits += len(keys) - len(first)
+		return np.array([self.table[k] for k in keys])
+
+
+class PlacementProblem(object):
+	"""
+    Maps a parameter vector to a placement of N defenders and scores it.
+
+    Parameters:
+    XI0 (np.array): Intruder starts of shape (S, M, 2).
+    n_defenders (int): Number of defenders.
+    box (tuple): ((x_min, x_max), (y_min, y_max)) of the defender positions.
+    headings (bool): Also optimize the initial headings. Default is False: a defender takes the
+                     pursuit heading as soon as it is assigned, so only idle defenders keep theirs.
+    margin_weight (float): Weight of the capture margin in the fitness. Default is 0.2.
+    kwargs: Passed to evaluate_placements().
+    """
+	def __init__(self, XI0, n_defenders=2, box=((-2*R, 2*R), (-2*R, 2*R)), headings=False, margin_weight=0.2, **kwargs):
+		self.XI0 = np.asarray(XI0, dtype=float)
+		self.N = n_defenders
+		self.box = np.asarray(box, dtype=float)
+		self.headings = headings
+		self.margin_weight = margin_weight
+		self.kwargs = kwargs
+		self.dim = n_defenders*(3 if headings else 2)
+
+	def lower_upper(self):
+		lo = np.tile(self.box[:, 0], self.N)
+		hi = np.tile(self.box[:, 1], self.N)
+		if self.headings:
+			lo = np.concatenate([lo, np.full(self.N, -pi)])
+			hi = np.concatenate([hi, np.full(self.N, pi)])
+		return lo, hi
+
+	def identity(self):
+		"""
+        Hash of everything the fitness depends on besides the parameters: Config, the intruder
+        starts, the number of defenders, the box, the options and the arguments of evaluate_placements().
+        """
+		h = hashlib.sha1(config_hash().encode())
+		h.update(np.ascontiguousarray(self.XI0).tobytes())
+		h.update(str(self.XI0.shape).encode())
+		h.update(np.ascontiguousarray(self.box).tobytes())
+		h.update(repr((self.N, self.headings, float(self.margin_weight), sorted(self.kwargs.items()))).encode())
+		return h.hexdigest()
+
+	def decode(self, thetas):
+		"""
+        Positions (P, N, 2) and headings (P, N) of the rows of thetas. Without optimized headings,
+        the defenders face the target.
+        """
+		thetas = np.atleast_2d(thetas)
+		XD = thetas[:, :2*self.N].reshape(-1, self.N, 2)
+		hD = thetas[:, 2*self.N:] if self.headings else np.arctan2(-XD[..., 1], -XD[..., 0])
+		return XD, hD
+
+	def fitness(self, thetas):
+		"""
+        Fitness to be maximized, and its parts, for the rows of thetas.
+        """
+		XD, hD = self.decode(thetas)
+		rate, margin = evaluate_placements(XD, hD, self.XI0, **self.kwargs)
+		return rate + self.margin_weight*margin, rate, margin
+
+
+def cma_es(func, x0, sigma0, lower, upper, popsize=None, generations=40, seed=None, cache=None, problem='', verbose=True):
+	"""
+    Maximizes func with a (mu/mu_w, lambda) CMA-ES, the candidates being clipped to [lower, upper].
+
+    Parameters:
+    func (callable): Maps candidates (P, dim) to fitness values (P,), higher is better.
+    x0 (np.array): Initial mean.
+    sigma0 (float): Initial step size.
+    lower, upper (np.array): Bounds of the parameters.
+    popsize (int): Candidates per generation. Default is 4 + 3 ln(dim).
+    generations (int): Number of generations. Default is 40.
+    seed (int): Seed of the random generator.
+    cache (EvaluationCache): Cache of evaluations. Default is a new cache.
+    problem (str): Identity of the problem func scores, part of the cache keys.
+    verbose (bool): Print the progress of every generation.
+
+    Returns:
+    tuple: Best candidate, its fitness, and the cache.
+    """
+	rng = np.random.default_rng(seed)
+	cache = EvaluationCache() if cache is None else cache
+	n = len(x0)
+	lam = popsize or 4 + int(3*np.log(n))
+	mu = lam//2
+	w = np.log(mu + 0.5) - np.log(np.arange(1, mu + 1))
+	w /= w.sum()
+	mueff = 1/np.sum(w**2)
+
+	# standard strategy parameters
+	cc = (4 + mueff/n)/(n + 4 + 2*mueff/n)
+	cs = (mueff + 2)/(n + mueff + 5)
+	c1 = 2/((n + 1.3)**2 + mueff)
+	cmu = min(1 - c1, 2*(mueff - 2 + 1/mueff)/((n + 2)**2 + mueff))
+	damps = 1 + 2*max(0, np.sqrt((mueff - 1)/(n + 1)) - 1) + cs
+	chin = np.sqrt(n)*(1 - 1/(4*n) + 1/(21*n**2))
+
+	mean, sigma = np.array(x0, dtype=float), sigma0
+	C, pc, ps = np.eye(n), np.zeros(n), np.zeros(n)
+	best_x, best_f = mean.copy(), -np.inf
+
+	for g in range(generations):
+		evals, B = np.linalg.eigh(C)
+		D = np.sqrt(np.maximum(evals, 1e-20))
+		z = rng.standard_normal((lam, n))
+		y = (z*D) @ B.T
+		x = np.clip(mean + sigma*y, lower, upper)
+		y = (x - mean)/sigma    # the repaired steps drive the update
+
+		f = cache.evaluate(x, func, problem)
+		order = np.argsort(-f)
+		if f[order[0]] > best_f:
+			best_f, best_x = f[order[0]], x[order[0]].copy()
+
+		y_w = w @ y[order[:mu]]
+		mean = mean + sigma*y_w
+		invsqrtC = B @ np.diag(1/D) @ B.T
+		ps = (1 - cs)*ps + np.sqrt(cs*(2 - cs)*mueff)*invsqrtC @ y_w
+		hsig = np.linalg.norm(ps)/np.sqrt(1 - (1 - cs)**(2*(g + 1)))/chin < 1.4 + 2/(n + 1)
+		pc = (1 - cc)*pc + hsig*np.sqrt(cc*(2 - cc)*mueff)*y_w
+		C = (1 - c1 - cmu)*C + c1*(np.outer(pc, pc) + (1 - hsig)*cc*(2 - cc)*C) \
+			+ cmu*(y[order[:mu]].T*w) @ y[order[:mu]]
+		sigma *= np.exp((cs/damps)*(np.linalg.norm(ps)/chin - 1))
+
+		if verbose:
+			print('generation %d: best %.3f, mean of the population %.3f, sigma %.3f, cache hits %d'
+				  %(g, best_f, f.mean(), sigma, cache.hits))
+	return best_x, best_f, cache
+
+
+def optimize_placement(XI0, n_defenders=2, popsize=16, generations=30, seed=0, cache=None, verbose=True, **kwargs):
+	"""
+    Searches the initial placement of the defenders maximizing the fitness against the starts XI0.
+
+    Parameters:
+    XI0 (np.array): Intruder starts of shape (S, M, 2).
+    n_defenders (int): Number of defenders. Default is 2.
+    popsize (int): Candidates per generation. Default is 16.
+    generations (int): Number of generations. Default is 30.
+    seed (int): Seed of the random generator.
+    cache (EvaluationCache): Cache shared with earlier searches; only those on the same problem hit.
+    verbose (bool): Print the progress.
+    kwargs: Passed to PlacementProblem.
+
+    Returns:
+    tuple: Positions (N, 2) and headings (N,) of the best placement, its capture rate and margin.
+    """
+	prob = PlacementProblem(XI0, n_defenders, **kwargs)
+	lo, hi = prob.lower_upper()
+	x0 = (lo + hi)/2
+	best, _, cache = cma_es(lambda th: prob.fitness(th)[0], x0, 0.3*np.max(hi - lo)/2, lo, hi,
+							popsize, generations, seed, cache, prob.identity(), verbose)
+	_, rate, margin = prob.fitness(best[None])
+	XD, hD = prob.decode(best[None])
+	return XD[0], hD[0], rate[0], margin[0]
+
+
+if __name__ == '__main__':
+	from engagement import random_scenarios
+
+	# 16 intruder starts in the ring R+4r..R+8r, two defenders
+	_, XI0 = random_scenarios(16, 1, 1, np.random.default_rng(1))
+
+	# two restarts sharing the evaluations
+	cache = EvaluationCache()
+	for seed in range(2):
+		t0 = time.time()
+		XD, hD, rate, margin = optimize_placement(XI0, n_defenders=2, seed=seed, cache=cache, verbose=False)
+		print('restart %d: %.1f s, %d evaluations, %d cache hits'%(seed, time.time() - t0, cache.misses, cache.hits))
+		print('defenders at', np.round(XD, 2).tolist(), 'capture rate %.2f, margin %.3f'%(rate, margin))
+
+	# the best placement, scored again on the same problem and against other intruder starts
+	_, XI1 = random_scenarios(16, 1, 1, np.random.default_rng(2))
+	theta = XD.reshape(1, -1)
+	for starts, hit in ((XI0, True), (XI1, False)):
+		prob = PlacementProblem(starts, 2)
+		hits = cache.hits
+		cache.evaluate(theta, lambda th: prob.fitness(th)[0], prob.identity())
+		assert (cache.hits > hits) == hit, 'the cache mixed the fitness of two problems'
+
+	# reference: both defenders on the target boundary, on the far side of the mean intruder bearing
+	ref = np.array([[[R, 0.], [-R, 0.]]])
+	rate_ref, margin_ref = evaluate_placements(ref, np.arctan2(-ref[..., 1], -ref[..., 0]), XI0)
+	print('reference placement capture rate %.2f, margin %.3f'%(rate_ref[0], margin_ref[0]))
@@ -0,0 +1,219 @@
+'''
+Batched 3D engagements of quadrotors modelled as point masses.
+
+The animation of Matlab/Animation flies the quadrotors in 3D, while the games of
+engagement.py are planar. Here every player has a position and a velocity in
+3D, follows a commanded velocity with a bounded acceleration, and never exceeds
+its speed (VD, VI of Config):
+
+    dp/dt = v,    dv/dt = sat((v_cmd - v)/tau, a_max),    |v| <= vmax
+
+integrated with RK4 (the command held over the step). The commands extend the
+planar laws of engagement.py: the heading in the horizontal plane is the one of
+engagement_guidance(..) on the horizontal projections (pursuit, get_phi in
+Phase II, best response of the intruder), and the vertical speed closes the
+altitude gap, the defender to its intruder, the intruder to its cruise
+altitude, within a fraction of the speed. The target area is the vertical
+cylinder of radius R, and a capture needs the intruder inside the capture cone
+of the defender (is_within_cone), the 3D sector of is_within_sector: within r
+of the defender and within half the sector angle of its axis, a sphere for a
+sector angle of 2*pi.
+
+With a_max=None the velocity is the command at every step (kinematic players,
+as in engagement.py). With every player at the same altitude, the engagements
+are then the ones of run_engagement(..), the positions identical to the last
+bit, see the check at the end of the file.
+'''
+
+import time
+import numpy as np
+from math import pi
+from RK4 import rk4
+from engagement import engagement_guidance, ACTIVE, CAPTURED, BREACHED, r, R, vd, vi, sector_angle
+from Config import Config
+
+
+def saturate(v, vmax):
+	"""
+    Scales the vectors v (..., 3) down to a norm of at most vmax.
+    """
+	n = np.linalg.norm(v, axis=-1, keepdims=True)
+	return v*np.minimum(1., vmax/np.maximum(n, 1e-12))
+
+def point_mass_dx(x, cmd, a_max, tau):
+	"""
+    Time derivative of point masses x (..., 6) = (position, velocity) following the velocity cmd (..., 3).
+    """
+	return np.concatenate([x[..., 3:], saturate((cmd - x[..., 3:])/tau, a_max)], axis=-1)
+
+def is_within_cone(PD, axis, PI, capture_radius=r, half_angle=sector_angle/2):
+	"""
+    Checks if the intruders are within the capture cone of the defenders.
+
+    Parameters:
+    PD (np.array): Defender positions (..., N, 3).
+    axis (np.array): Axes of the cones (..., N, 3), e.g. the velocity of the defender.
+    PI (np.array): Intruder positions (..., M, 3).
+    capture_radius (float): Radius of the cone.
+    half_angle (float): Angle between the axis and the side of the cone, pi for a sphere.
+
+    Returns:
+    np.array: True where intruder m is in the cone of defender n, shape (..., N, M).
+    """
+	los = PI[..., None, :, :] - PD[..., :, None, :]
+	d = np.linalg.norm(los, axis=-1)
+	a = axis/np.maximum(np.linalg.norm(axis, axis=-1, keepdims=True), 1e-12)
+	cos_off = np.einsum('...nk,...nmk->...nm', a, los)/np.maximum(d, 1e-12)
+	return (d <= capture_radius) & (np.arccos(np.clip(cos_off, -1., 1.)) <= half_angle)
+
+
+# azimuth and elevation of vectors (..., 3)
+def _angles(v):
+	return np.arctan2(v[..., 1], v[..., 0]), np.arctan2(v[..., 2], np.hypot(v[..., 0], v[..., 1]))
+
+def engagement_step_3d(PD, VD, PI, VI, hD, status, cache, dt, tol=0.5, sector_angle=sector_angle,
+					   a_max=None, tau=0.2, climb=0.5, kz=1., zI_ref=None):
+	"""
+    Advances a batch of 3D engagements by one time step, updating PD, VD, PI, VI, hD and status in place.
+
+    Parameters:
+    PD, VD (np.array): Defender positions and velocities of shape (B, N, 3).
+    PI, VI (np.array): Intruder positions and velocities of shape (B, M, 3).
+    hD (np.array): Defender headings in the horizontal plane, shape (B, N).
+    status (np.array): Intruder status of shape (B, M), one of ACTIVE, CAPTURED, BREACHED.
+    cache (dict): Assignment cache passed to assign_defenders().
+    dt (float): Time step.
+    tol (float): Reassignment tolerance passed to assign_defenders(). Default is 0.5.
+    sector_angle (float): Apex angle of the capture cone, 2*pi for a sphere.
+    a_max (float): Largest acceleration. Default is None, kinematic players.
+    tau (float): Time constant of the velocity tracking. Default is 0.2 seconds.
+    climb (float): Largest vertical speed as a fraction of the speed. Default is 0.5.
+    kz (float): Gain of the altitude tracking, per second. Default is 1.
+    zI_ref (np.array): Cruise altitude of the intruders (B, M). Default is None, the current altitude.
+
+    Returns:
+    np.array: The assignment used during the step, shape (B, N).
+    """
+	B, N = PD.shape[0], PD.shape[1]
+	assign, chasing, hI, rho_I, _, _ = engagement_guidance(PD[..., :2], PI[..., :2], hD, status, cache, tol)
+	active = status == ACTIVE
+
+	# vertical speed closing the altitude gap, the rest of the speed in the horizontal plane
+	zD_ref = PI[np.arange(B)[:, None], np.maximum(assign, 0), 2]
+	zI_ref = PI[..., 2] if zI_ref is None else zI_ref
+	vzD = np.clip(kz*(zD_ref - PD[..., 2]), -climb*vd, climb*vd)*chasing
+	vzI = np.clip(kz*(zI_ref - PI[..., 2]), -climb*vi, climb*vi)*active
+	hsD, hsI = np.sqrt(vd**2 - vzD**2), np.sqrt(vi**2 - vzI**2)
+	cmdD = np.concatenate([(hsD*chasing)[..., None]*np.stack([np.cos(hD), np.sin(hD)], axis=-1), vzD[..., None]], axis=-1)
+	cmdI = np.concatenate([(hsI*active)[..., None]*np.stack([np.cos(hI), np.sin(hI)], axis=-1), vzI[..., None]], axis=-1)
+
+	# capture: the axis of the cone is the velocity (the command for kinematic players),
+	# the heading for a defender at rest
+	if a_max is None:
+		VD[:] = cmdD
+		VI[:] = cmdI
+	azD, elD = _angles(VD)
+	still = np.linalg.norm(VD, axis=-1) < 1e-9
+	azD[still], elD[still] = hD[still], 0.
+	axis = np.stack([np.cos(elD)*np.cos(azD), np.cos(elD)*np.sin(azD), np.sin(elD)], axis=-1)
+	in_cone = is_within_cone(PD, axis, PI, r, sector_angle/2)
+	status[active & in_cone.any(axis=1)] = CAPTURED
+	status[(status == ACTIVE) & (rho_I <= R)] = BREACHED
+
+	# idle defenders and finished intruders stay put
+	active = status == ACTIVE
+	if a_max is None:
+		# exact for constant velocity, written as in engagement_step
+		PD[..., :2] += (hsD*dt*chasing)[..., None]*np.stack([np.cos(hD), np.sin(hD)], axis=-1)
+		PI[..., :2] += (hsI*dt*active)[..., None]*np.stack([np.cos(hI), np.sin(hI)], axis=-1)
+		PD[..., 2] += vzD*dt
+		PI[..., 2] += vzI*dt*active
+		VI[~active] = 0.
+	else:
+		x = rk4(lambda x: point_mass_dx(x, cmdD, a_max, tau), np.concatenate([PD, VD], axis=-1), dt)
+		PD[:], VD[:] = x[..., :3], saturate(x[..., 3:], vd)
+		x = rk4(lambda x: point_mass_dx(x, cmdI, a_max, tau), np.concatenate([PI, VI], axis=-1), dt)
+		PI[active], VI[active] = x[..., :3][active], saturate(x[..., 3:], vi)[active]
+		VI[~active] = 0.
+	return assign
+
+def run_engagement_3d(PD0, PI0, hD0=None, VD0=None, VI0=None, dt=Config.TIME_STEP, t_max=60., tol=0.5,
+					  sector_angle=sector_angle, a_max=None, record=False, **kwargs):
+	"""
+    Simulates a batch of 3D engagements until every intruder is captured or has reached the
+    target area, or until t_max.
+
+    Parameters:
+    PD0 (np.array): Initial defender positions, shape (B, N, 3) or (N, 3) for a single scenario.
+    PI0 (np.array): Initial intruder positions, shape (B, M, 3) or (M, 3).
+    hD0 (np.array): Initial defender headings of shape (B, N). Default points at the target.
+    VD0, VI0 (np.array): Initial velocities. Default is at rest.
+    dt (float): Time step. Default is Config.TIME_STEP.
+    t_max (float): Time horizon. Default is 60 seconds.
+    tol (float): Reassignment tolerance passed to assign_defenders(). Default is 0.5.
+    sector_angle (float): Apex angle of the capture cone, 2*pi for a sphere.
+    a_max (float): Largest acceleration. Default is None, kinematic players.
+    record (bool): If True, also return the positions at every step.
+    kwargs: Passed to engagement_step_3d().
+
+    Returns:
+    tuple: Intruder status (B, M), time each intruder was captured or breached (B, M, nan if
+           still active), and the recorded positions (PDs, PIs) of shape (T, B, N, 3),
+           (T, B, M, 3) or None.
+    """
+	PD = np.array(PD0, dtype=float, ndmin=3)
+	PI = np.array(PI0, dtype=float, ndmin=3)
+	B, N, M = PD.shape[0], PD.shape[1], PI.shape[1]
+	VD = np.zeros_like(PD) if VD0 is None else np.array(VD0, dtype=float).reshape(B, N, 3)
+	VI = np.zeros_like(PI) if VI0 is None else np.array(VI0, dtype=float).reshape(B, M, 3)
+	hD = np.arctan2(-PD[..., 1], -PD[..., 0]) if hD0 is None else np.array(hD0, dtype=float).reshape(B, N)
+	status = np.full((B, M), ACTIVE)
+	t_end = np.full((B, M), np.nan)
+	cache = {}
+	PDs, PIs = [PD.copy()], [PI.copy()]
+
+	t = 0
+	while t < t_max and (status == ACTIVE).any():
+		before = status == ACTIVE
+		engagement_step_3d(PD, VD, PI, VI, hD, status, cache, dt, tol, sector_angle, a_max, **kwargs)
+		t += dt
+		t_end[before & (status != ACTIVE)] = t
+		if record:
+			PDs.append(PD.copy())
+			PIs.append(PI.copy())
+
+	traj = (np.asarray(PDs), np.asarray(PIs)) if record else None
+	return status, t_end, traj
+
+
+def lift(X, z):
+	"""
+    Planar positions X (..., 2) at altitudes z (broadcast to X[..., 0]), shape (..., 3).
+    """
+	return np.concatenate([X, np.broadcast_to(z, X.shape[:-1])[..., None]], axis=-1)
+
+
+if __name__ == '__main__':
+	from engagement import run_engagement, random_scenarios
+
+	rng = np.random.default_rng(0)
+	B, N, M = 500, 3, 3
+	XD0, XI0 = random_scenarios(B, N, M, rng)
+
+	# planar engagements recovered at a fixed altitude
+	status, t_end, (XDs, XIs) = run_engagement(XD0, XI0, record=True)
+	status3, t_end3, (PDs, PIs) = run_engagement_3d(lift(XD0, 10.), lift(XI0, 10.), record=True)
+	same_t = np.array_equal(np.nan_to_num(t_end, nan=-1), np.nan_to_num(t_end3, nan=-1))
+	print('fixed altitude: same status %s, same times %s, largest position difference %.1e'
+		  %(np.array_equal(status, status3), same_t,
+			max(np.abs(PDs[..., :2] - XDs).max(), np.abs(PIs[..., :2] - XIs).max())))
+
+	# 3D: defenders low, intruders at 5..15, bounded acceleration, cone and sphere
+	B = 2000
+	XD0, XI0 = random_scenarios(B, N, M, rng)
+	PD0, PI0 = lift(XD0, rng.uniform(0., 2., (B, N))), lift(XI0, rng.uniform(5., 15., (B, M)))
+	for name, angle in [('cone', sector_angle), ('sphere', 2*pi)]:
+		t0 = time.time()
+		status, _, _ = run_engagement_3d(PD0, PI0, a_max=3., sector_angle=angle)
+		print('%d engagements, %s: %.1f s, %.1f%% captured, %.1f%% breached'
+			  %(B, name, time.time() - t0, 100*(status == CAPTURED).mean(), 100*(status == BREACHED).mean()))
@@ -0,0 +1,185 @@
+'''
+Retrograde (backward-time) generation of the envelope barrier.
+
+envelope_barrier(..) in envelope.py integrates forward from hand-picked (r1, r2),
+so most of the effort goes to trajectories that are later thrown away. Here we
+start from the other end: points are seeded on the terminal manifold of the game
+(the Phase II constraints |rho_D - rho_I| = r and rho_D + rho_I = r, see the
+dashed black lines in Figure 16) and the whole family is integrated backward in
+time with velocity_vec(.., backward=True), one batched rk4 step for all seeds.
+
+    script      |       paper
+----------------+-------------------
+    r1          |       rho_D
+    r2          |       rho_I
+    ...         |       ...
+----------------+-------------------
+'''
+
+from envelope import *
+
+
+# sample the terminal manifold, i.e. the three edges of the Phase II constraint
+#   rho_I = rho_D - r    (triag_cnstr_1 in overall_plot.py)
+#   rho_I = rho_D + r    (triag_cnstr_2)
+#   rho_I = r - rho_D    (triag_cnstr_3)
+# every seed is moved inside the feasible region by eps, which by default is the
+# same margin (dt*vi) that envelope_barrier uses to detect the end of the game
+def terminal_seeds(n=50, eps=0.05*vi, r_max=10., phase2=False, tht1=0):
+	"""
+    Samples initial states for the retrograde integration on the terminal manifold.
+
+    Parameters:
+    n (int): Number of seeds on each edge of the Phase II constraint.
+    eps (float): Distance the seeds are moved inside the feasible region. Default is 0.05*vi.
+    r_max (float): Largest rho_D (and rho_I) to be sampled. Default is 10.
+    phase2 (bool): If True, keep only the seeds satisfying the Phase II bounds
+                   rDcap_min <= rho_D <= rDcap_max and rIcap_min <= rho_I <= rIcap_max.
+    tht1 (float): Angular position of the defender for all seeds. Default is 0.
+
+    Returns:
+    np.array: Seed states of shape (N, 4), rows [rho_D, theta_D, rho_I, theta_I].
+    """
+	r1s = np.concatenate([np.linspace(r, r_max, n),            # rho_I = rho_D - r
+						  np.linspace(eps, r_max - r, n),      # rho_I = rho_D + r
+						  np.linspace(eps, r - eps, n)])       # rho_I = r - rho_D
+	r2s = np.concatenate([r1s[:n] - r + eps,
+						  r1s[n:2*n] + r - eps,
+						  r - r1s[2*n:] + eps])
+
+	keep = (r1s > 0) & (r2s > 0)
+	if phase2:
+		keep &= (r1s >= rDcap_min) & (r1s <= rDcap_max) & (r2s >= rIcap_min) & (r2s <= rIcap_max)
+	r1s, r2s = r1s[keep], r2s[keep]
+
+	# See equation (19)
+	dtht = np.arccos(np.clip((r1s**2 + r2s**2 - r**2)/(2*r1s*r2s), -1., 1.))
+	return np.stack([r1s, np.full(len(r1s), tht1), r2s, tht1 - dtht], axis=-1)
+
+
+# integrate all seeds backward in time together
+# a trajectory is frozen as soon as it leaves the feasible region, or the box
+# rho_D, rho_I <= r_max; seeds whose backward flow leaves the region right away
+# are not the end point of any optimal trajectory and get length 1
+def retrograde_barrier(seeds, dt=0.05, t_max=60., r_max=10.):
+	"""
+    Integrates a family of optimal trajectories backward in time from the terminal manifold.
+
+    Parameters:
+    seeds (np.array): Terminal states of shape (N, 4), e.g. from terminal_seeds().
+    dt (float): Time step for integration. Default is 0.05 seconds.
+    t_max (float): Backward time horizon. Default is 60 seconds.
+    r_max (float): Trajectories are stopped once rho_D or rho_I exceeds this value. Default is 10.
+
+    Returns:
+    tuple: States of shape (T, N, 4) in backward time (nan once a trajectory has stopped),
+           number of valid steps of each trajectory, and the time stamps of shape (T,).
+    """
+	S = np.array(seeds, dtype=float)
+	alive = np.ones(len(S), dtype=bool)
+	lengths = np.ones(len(S), dtype=int)
+	ss, ts = [S.copy()], [0.]
+
+	t = 0
+	while t < t_max and alive.any():
+		S_ = np.full(S.shape, np.nan)
+		S_[alive] = rk4(lambda s: envelope_dx_batch(s, backward=True), S[alive], dt)
+
+		# same test as in envelope_barrier, plus the size of the plotted domain
+		out = (np.abs(S_[:, 0] - S_[:, 2]) >= r) | (S_[:, 0] + S_[:, 2] <= r) \
+			| (S_[:, 0] > r_max) | (S_[:, 2] > r_max) | ~np.isfinite(S_).all(axis=1)
+		alive &= ~out
+		S_[~alive] = np.nan
+		lengths += alive
+
+		S = S_
+		t += dt
+		ss.append(S)
+		ts.append(t)
+
+	return np.asarray(ss), lengths, np.asarray(ts)
+
+
+# turn the output of retrograde_barrier into a list of forward-time trajectories,
+# each in the same layout as the ss returned by envelope_barrier
+def forward_family(ss, lengths, min_len=2):
+	"""
+    Splits a retrograde family into forward-time trajectories.
+
+    Parameters:
+    ss (np.array): States of shape (T, N, 4) as returned by retrograde_barrier().
+    lengths (np.array): Number of valid steps of each trajectory.
+    min_len (int): Trajectories with fewer steps are dropped. Default is 2.
+
+    Returns:
+    list: Arrays of shape (lengths[i], 4), ordered from the initial to the terminal state.
+    """
+	return [ss[:n, i][::-1] for i, n in enumerate(lengths) if n >= min_len]
+
+
+# same file layout as envelope_barrier, so that read_data() in overall_plot.py
+# picks the retrograde family up for Figure 16
+def save_family(family, root='res'):
+	"""
+    Saves forward-time trajectories to root/r1_%.3f-r2_%.3f/data.csv, keyed by the initial state.
+
+    Parameters:
+    family (list): Forward-time trajectories as returned by forward_family().
+    root (str): Directory under which the trajectories are written. Default is 'res'.
+    """
+	for s in family:
+		dname = os.path.join(root, 'r1_%.3f-r2_%.3f'%(s[0, 0], s[0, 2]))
+		if not os.path.isdir(dname):
+			os.makedirs(dname)
+		phis = get_phi_batch(s[:, 0], s[:, 2])
+		np.savetxt(os.path.join(dname, 'data.csv'), np.column_stack([s, phis]), delimiter=',',
+				   fmt=['%.17g']*4 + ['%.10f'])
+
+
+if __name__ == '__main__':
+
+	from overall_plot import plot_bds, triag_cnstr_1, triag_cnstr_2, triag_cnstr_3, r1_min, r2_min
+	from vecgram import get_phi, _alpha_beta_batch, _grid_slope
+
+	# get_phi_batch against the scalar get_phi on random states of the reduced game.
+	# The scalar optimizer climbs the wrapped atan2 angle, so it is only trusted where
+	# the vectogram does not cross the branch cut at +-pi (a curve winding around the
+	# origin always does). Next to the set 0 the tangent tends to 0, and the two may
+	# fall on either side of the boundary
+	rng = np.random.default_rng(0)
+	r1s, r2s = rng.uniform(0.2, 10., 2000), rng.uniform(0.2, 10., 2000)
+	keep = (np.abs(r1s - r2s) <= r) & (r1s + r2s >= r)
+	r1s, r2s = r1s[keep][:300], r2s[keep][:300]
+	phi_b = get_phi_batch(r1s, r2s)
+	phi_s = np.array([float(np.ravel(get_phi(a, b))[0]) for a, b in zip(r1s, r2s)])
+	diff = np.abs((phi_b - phi_s + pi) % (2*pi) - pi)
+	vals = _grid_slope(np.linspace(-pi, pi, 360, endpoint=False), *_alpha_beta_batch(r1s, r2s))
+	cut = np.abs(np.diff(np.column_stack([vals, vals[:, :1]]), axis=1)).max(axis=1) > pi
+	edge = ((phi_b == 0) | (phi_s == 0)) & (diff < 0.05)
+	bad = ~cut & ~edge & (diff > 1e-3)
+	print('get_phi_batch against get_phi: %d states, %d across the branch cut, %d next to the set 0, '
+		  'largest difference elsewhere %.1e rad'%(len(r1s), cut.sum(), (edge & ~cut).sum(), diff[~cut & ~edge].max()))
+	assert not bad.any(), 'get_phi_batch disagrees with get_phi at %s'%list(zip(r1s[bad], r2s[bad]))
+
+	t0 = time.time()
+	seeds = terminal_seeds(n=60)
+	ss, lengths, ts = retrograde_barrier(seeds)
+	family = forward_family(ss, lengths)
+	print('%d seeds, %d trajectories, %.1f s'%(len(seeds), len(family), time.time() - t0))
+
+	fig, ax = plt.subplots()
+	plot_bds(ax, triag_cnstr_3)
+	plot_bds(ax, triag_cnstr_2)
+	plot_bds(ax, triag_cnstr_1, label=r'Phase II constraint')
+	for s in family:
+		ax.plot(s[:,0], s[:,2], 'c-', alpha=0.6)
+	ax.plot(r1_min, r2_min, 'ro', label='attractor', zorder=1002)
+	ax.grid()
+	ax.axis('equal')
+	ax.set_xlim([0, 10])
+	ax.set_ylim([0, 10])
+	plt.xlabel(r'$\rho_D$', fontsize=14)
+	plt.ylabel(r'$\rho_I$', fontsize=14)
+	ax.legend(fontsize=12)
+	plt.savefig('retrograde.png')
+	plt.show()
@@ -0,0 +1,227 @@
+'''
+Vectorized environment and replay buffer for learning in the target defense game.
+
+Many episodes of the reduced game are stepped together with numpy. The state of
+each episode is the 4D state of envelope.py,
+
+    s = (rho_D, theta_D, rho_I, theta_I)
+
+and the dynamics are those of velocity_vec_batch(..) with both controls given,
+integrated with rk4 while the controls are held over one step. One player (the
+learner) picks its control angle from the action, the other plays the optimal
+strategy of the paper:
+
+    learner = 'defender'    action = phi_D, the intruder best responds, see (22)
+    learner = 'intruder'    action = phi_I, the defender plays get_phi (algorithm 3)
+
+The distance d between the players follows from the state, so a learning intruder
+is free to leave (or enter) the capture circle. An episode ends like envelope_barrier:
+
+    intruder wins   rho_D - rho_I >= d (the intruder got past the defender),
+                    or rho_D + rho_I <= d (the intruder reached the target)
+    defender wins   rho_I - rho_D >= d (the defender blocks the way), the intruder
+                    is pushed inside the capture radius, or the time horizon runs out
+
+The learner gets +1 when it wins and -1 when it loses, 0 on every other step.
+'''
+
+import numpy as np
+from math import pi
+from RK4 import rk4
+from vecgram import get_phi_batch, _alpha_beta_batch, r, vd, vi
+from envelope import NONE, DEFENDER, INTRUDER
+from Config import Config
+
+
+class ReplayBuffer(object):
+	"""
+    Ring buffer of transitions (obs, act, rew, next_obs, done), preallocated to a fixed size.
+
+    Parameters:
+    obs_dim (int): Size of one observation.
+    size (int): Number of transitions kept. Default is Config.MAX_BUFFER_SIZE.
+    """
+	def __init__(self, obs_dim, size=Config.MAX_BUFFER_SIZE):
+		self.size = size
+		self.obs = np.zeros((size, obs_dim))
+		self.act = np.zeros(size)
+		self.rew = np.zeros(size)
+		self.next_obs = np.zeros((size, obs_dim))
+		self.done = np.zeros(size, dtype=bool)
+		self.ptr = 0       # where the next transition goes
+		self.n = 0         # number of valid transitions
+
+	def add_batch(self, obs, act, rew, next_obs, done):
+		"""
+        Appends a batch of transitions, overwriting the oldest ones when the buffer is full.
+        """
+		k = len(rew)
+		if k > self.size:
+			obs, act, rew, next_obs, done = obs[-self.size:], act[-self.size:], rew[-self.size:], \
+											next_obs[-self.size:], done[-self.size:]
+			k = self.size
+		idx = (self.ptr + np.arange(k)) % self.size
+		self.obs[idx] = obs
+		self.act[idx] = act
+		self.rew[idx] = rew
+		self.next_obs[idx] = next_obs
+		self.done[idx] = done
+		self.ptr = (self.ptr + k) % self.size
+		self.n = min(self.n + k, self.size)
+
+	def sample(self, batch_size=Config.BATCH_SIZE, rng=None):
+		"""
+        Draws a batch of stored transitions uniformly, with replacement.
+
+        Returns:
+        tuple: Arrays (obs, act, rew, next_obs, done) of length batch_size.
+        """
+		rng = np.random.default_rng() if rng is None else rng
+		idx = rng.integers(0, self.n, batch_size)
+		return self.obs[idx], self.act[idx], self.rew[idx], self.next_obs[idx], self.done[idx]
+
+	def save(self, fname=Config.DATA_FILE):
+		"""
+        Writes the stored transitions to a csv file, one row [obs, act, rew, next_obs, done] per transition.
+        """
+		order = (self.ptr - self.n + np.arange(self.n)) % self.size
+		np.savetxt(fname, np.column_stack([self.obs[order], self.act[order], self.rew[order],
+										   self.next_obs[order], self.done[order]]), delimiter=',')
+
+
+class TargetDefenseEnv(object):
+	"""
+    Gym-style vectorized environment of the reduced target defense game.
+
+    Parameters:
+    n_envs (int): Number of episodes stepped in parallel.
+    learner (str): 'defender' or 'intruder', the player controlled by the actions.
+    dt (float): Time step. Default is Config.TIME_STEP.
+    t_max (float): Time horizon of an episode. Default is 60 seconds.
+    r_max (float): Largest rho_D, rho_I of the initial states. Default is 10.
+    seed (int): Seed of the random generator used for the initial states.
+    """
+	obs_dim = 3    # rho_D, rho_I, d
+
+	def __init__(self, n_envs=1024, learner='defender', dt=Config.TIME_STEP, t_max=60., r_max=10., seed=None):
+		if learner not in ('defender', 'intruder'):
+			raise ValueError('learner must be \'defender\' or \'intruder\'')
+		self.n_envs = n_envs
+		self.learner = learner
+		self.dt = dt
+		self.max_steps = int(round(t_max/dt))
+		self.r_max = r_max
+		self.rng = np.random.default_rng(seed)
+		self.S = np.zeros((n_envs, 4))
+		self.steps = np.zeros(n_envs, dtype=int)
+
+	# initial states on the capture circle (d = r), see equation (19)
+	def _sample(self, n):
+		r1 = self.rng.uniform(r, self.r_max, n)
+		r2 = r1 + self.rng.uniform(-0.95*r, 0.95*r, n)
+		dtht = np.arccos(np.clip((r1**2 + r2**2 - r**2)/(2*r1*r2), -1., 1.))
+		tht1 = self.rng.uniform(-pi, pi, n)
+		return np.stack([r1, tht1, r2, tht1 - dtht], axis=-1)
+
+	def _distance(self, S):
+		d = np.sqrt(np.maximum(S[:, 0]**2 + S[:, 2]**2 - 2*S[:, 0]*S[:, 2]*np.cos(S[:, 1] - S[:, 3]), 0))
+		return np.maximum(d, 1e-9)
+
+	def _obs(self, S):
+		return np.stack([S[:, 0], S[:, 2], self._distance(S)], axis=-1)
+
+	def reset(self):
+		"""
+        Starts new episodes in every environment.
+
+        Returns:
+        np.array: Observations of shape (n_envs, 3), rows [rho_D, rho_I, d].
+        """
+		self.S = self._sample(self.n_envs)
+		self.steps[:] = 0
+		return self._obs(self.S)
+
+	def controls(self, S, action):
+		"""
+        Control angles of both players for the given states and learner actions.
+
+        Returns:
+        tuple: phi (defender) and psi (intruder), both measured from the line of sight.
+        """
+		if self.learner == 'defender':
+			phi = np.asarray(action, dtype=float)
+			psi = -np.arccos(vd/vi*np.cos(phi))
+		else:
+			phi = get_phi_batch(S[:, 0], S[:, 2], self._distance(S))
+			psi = np.asarray(action, dtype=float)
+		return phi, psi
+
+	def dynamics(self, S, phi, psi):
+		"""
+        Time derivative of the states for fixed controls, as velocity_vec_batch.
+        """
+		# velocity_vec assumes the intruder is clockwise of the defender, mirror otherwise
+		side = np.where(np.sin(S[:, 1] - S[:, 3]) >= 0, 1., -1.)
+		# Eq (21), with the intruder's control given instead of its best response to phi
+		alpha, beta = _alpha_beta_batch(S[:, 0], S[:, 2], self._distance(S))
+		vtht1 = -vd*np.sin(alpha + phi)/S[:, 0]
+		vtht2 = -vi*np.sin(beta + psi)/S[:, 2]
+		return np.stack([-vd*np.cos(alpha + phi), side*vtht1, -vi*np.cos(beta + psi), side*vtht2], axis=-1)
+
+	def winner(self, S):
+		"""
+        Winner of each state, NONE while the game goes on.
+        """
+		d = self._distance(S)
+		win_i = (S[:, 0] - S[:, 2] >= d - self.dt*vi) | (S[:, 0] + S[:, 2] <= d + self.dt*vi)
+		win_d = (S[:, 2] - S[:, 0] >= d - self.dt*vi) | (d < r - self.dt*vi)
+		return np.where(win_i, INTRUDER, np.where(win_d, DEFENDER, NONE))
+
+	def step(self, action):
+		"""
+        Advances every episode by one time step; finished episodes are reset automatically.
+
+        Parameters:
+        action (np.array): Control angle of the learner for every environment, shape (n_envs,).
+
+        Returns:
+        tuple: Next observations (n_envs, 3), rewards (n_envs,), done flags (n_envs,) and an info
+               dict with the 'winner' of each episode and the 'final_obs' before the reset.
+        """
+		phi, psi = self.controls(self.S, action)
+		self.S = rk4(lambda s: self.dynamics(s, phi, psi), self.S, self.dt)
+		self.steps += 1
+
+		winner = self.winner(self.S)
+		winner[(winner == NONE) & (self.steps >= self.max_steps)] = DEFENDER
+		done = winner != NONE
+		me = DEFENDER if self.learner == 'defender' else INTRUDER
+		rew = np.where(winner == me, 1., np.where(done, -1., 0.))
+
+		final_obs = self._obs(self.S)
+		if done.any():
+			self.S[done] = self._sample(int(done.sum()))
+			self.steps[done] = 0
+		obs = self._obs(self.S) if done.any() else final_obs
+		return obs, rew, done, {'winner': winner, 'final_obs': final_obs}
+
+
+if __name__ == '__main__':
+	import time
+
+	# random defender against the optimal intruder, to measure the sample throughput
+	env = TargetDefenseEnv(n_envs=4096, learner='defender', seed=0)
+	buf = ReplayBuffer(env.obs_dim)
+	obs = env.reset()
+	rng = np.random.default_rng(0)
+
+	t0, n_steps, n_done = time.time(), 200, 0
+	for _ in range(n_steps):
+		act = rng.uniform(-pi, pi, env.n_envs)
+		next_obs, rew, done, info = env.step(act)
+		buf.add_batch(obs, act, rew, info['final_obs'], done)
+		obs = next_obs
+		n_done += done.sum()
+	el = time.time() - t0
+	print('%d transitions in %.2f s (%.0f per s), %d episodes finished'%(n_steps*env.n_envs, el, n_steps*env.n_envs/el, n_done))
+	print('buffer holds %d transitions, batch of %d sampled'%(buf.n, len(buf.sample()[2])))
@@ -0,0 +1,391 @@
+'''
+Learned surrogate of the optimal control and of the outcome of the game.
+
+A small numpy MLP, with the hidden layers of Config.LAYER_SIZES and tanh
+activations, maps a state (rho_D, rho_I) of the reduced game to
+
+    cos(phi_D*), sin(phi_D*)    regression of get_phi (algorithm 3)
+    logit of P(defender wins)   classification of the outcome of the optimal play
+
+The control labels come from get_phi_batch, the outcome labels from
+envelope_barrier_batch. The model is saved to Config.MODEL_DIR/Config.MODEL_FILE.npz.
+Outside the domain it was trained on, get_phi_surrogate and outcome_surrogate fall
+back to the exact solvers.
+
+phi_D* jumps across the switches of the control (the boundary of the set 0 and
+the change of tangent), which a smooth network cannot follow: there its error
+reaches pi. calibrate_surrogate(..) measures the error on a dense sample, and
+get_phi_surrogate only uses the network in the cells of a grid of the domain
+where the error stayed below tol (the cells next to a failing cell excluded
+too); elsewhere it falls back to get_phi_batch.
+'''
+
+import os
+import time
+import numpy as np
+from envelope import *
+from timestep import recommended_dt
+from Config import Config
+
+# box of the training data in the (rho_D, rho_I) plane
+R_LO, R_HI = 0.5, 10.
+# cells per axis of the box, and the largest phi_D* error of a trusted cell (rad)
+TRUST_CELLS, TRUST_TOL = 160, 0.1
+
+
+# the feasible strip of the reduced game (Phase II constraints) inside the box [lo, hi]^2
+def in_domain(r1, r2, lo=R_LO, hi=R_HI):
+	"""
+    Checks which states lie in the domain covered by the training data.
+
+    Parameters:
+    r1 (np.array): Radial distances of the defender from the target center.
+    r2 (np.array): Radial distances of the intruder from the target center.
+    lo (float): Lower bound of rho_D and rho_I. Default is R_LO.
+    hi (float): Upper bound of rho_D and rho_I. Default is R_HI.
+
+    Returns:
+    np.array: Boolean mask, True inside the domain.
+    """
+	r1, r2 = np.asarray(r1, dtype=float), np.asarray(r2, dtype=float)
+	return (r1 >= lo) & (r1 <= hi) & (r2 >= lo) & (r2 <= hi) & (np.abs(r1 - r2) < r) & (r1 + r2 > r)
+
+def sample_states(n, rng, lo=R_LO, hi=R_HI):
+	"""
+    Draws states uniformly from the domain by rejection sampling.
+
+    Returns:
+    tuple: Arrays r1, r2 of length n.
+    """
+	r1s, r2s = [], []
+	while sum(len(a) for a in r1s) < n:
+		a, b = rng.uniform(lo, hi, 2*n), rng.uniform(lo, hi, 2*n)
+		keep = in_domain(a, b, lo, hi)
+		r1s.append(a[keep])
+		r2s.append(b[keep])
+	return np.concatenate(r1s)[:n], np.concatenate(r2s)[:n]
+
+
+class MLP(object):
+	"""
+    Fully connected network with tanh hidden layers and a linear output layer.
+
+    Parameters:
+    sizes (list): Layer sizes, including the input and the output layer.
+    rng (np.random.Generator): Random generator used for the initial weights.
+    """
+	def __init__(self, sizes, rng=None):
+		rng = np.random.default_rng() if rng is None else rng
+		self.sizes = list(sizes)
+		self.W = [rng.normal(0, np.sqrt(1./m), (m, n)) for m, n in zip(sizes[:-1], sizes[1:])]
+		self.b = [np.zeros(n) for n in sizes[1:]]
+
+	def forward(self, X):
+		"""
+        Returns the output of the network and the activations of every layer.
+        """
+		acts = [X]
+		for i, (W, b) in enumerate(zip(self.W, self.b)):
+			z = acts[-1] @ W + b
+			acts.append(z if i == len(self.W) - 1 else np.tanh(z))
+		return acts[-1], acts
+
+	def backward(self, acts, grad_out):
+		"""
+        Backpropagates the gradient of the loss w.r.t. the output, returns the gradients of W and b.
+        """
+		gW, gb = [None]*len(self.W), [None]*len(self.b)
+		g = grad_out
+		for i in reversed(range(len(self.W))):
+			gW[i] = acts[i].T @ g
+			gb[i] = g.sum(axis=0)
+			if i > 0:
+				g = (g @ self.W[i].T)*(1 - acts[i]**2)
+		return gW, gb
+
+	def save(self, fname, **extra):
+		"""
+        Saves the weights (and any extra arrays) to a .npz file.
+        """
+		arrays = {'W%d'%i: W for i, W in enumerate(self.W)}
+		arrays.update({'b%d'%i: b for i, b in enumerate(self.b)})
+		np.savez(fname, sizes=np.asarray(self.sizes), **arrays, **extra)
+
+	@classmethod
+	def load(cls, fname):
+		"""
+        Loads a network saved by save(), returns the network and the file contents.
+        """
+		data = np.load(fname)
+		net = cls(data['sizes'])
+		net.W = [data['W%d'%i] for i in range(len(net.W))]
+		net.b = [data['b%d'%i] for i in range(len(net.b))]
+		return net, data
+
+
+def _features(r1, r2, lo=R_LO, hi=R_HI):
+	# inputs scaled to [-1, 1]
+	mid, half = (hi + lo)/2, (hi - lo)/2
+	return np.stack([(np.asarray(r1) - mid)/half, (np.asarray(r2) - mid)/half], axis=-1)
+
+
+def make_dataset(n_phi=20000, n_outcome=2000, dt=None, attractor_tol=0.25, seed=0):
+	"""
+    Generates training data from the exact solvers.
+
+    Parameters:
+    n_phi (int): Number of states labelled with phi_D* (get_phi_batch).
+    n_outcome (int): Number of states labelled with the winner (envelope_barrier_batch).
+    dt (float): Time step of the outcome integration. Default is recommended_dt() of timestep.py.
+    attractor_tol (float): Passed to envelope_barrier_batch to stop defender wins early.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    tuple: (r1, r2, phi) of the control data and (r1, r2, defender_wins) of the outcome data.
+    """
+	dt = recommended_dt() if dt is None else dt
+	rng = np.random.default_rng(seed)
+	r1p, r2p = sample_states(n_phi, rng)
+	phis = get_phi_batch(r1p, r2p)
+	r1o, r2o = sample_states(n_outcome, rng)
+	_, _, _, winner = envelope_barrier_batch(r1o, r2o, dt=dt, attractor_tol=attractor_tol, record=False)
+	return (r1p, r2p, phis), (r1o, r2o, (winner == DEFENDER).astype(float))
+
+
+def train_surrogate(phi_data, outcome_data, layer_sizes=Config.LAYER_SIZES, lr=Config.LEARNING_RATE,
+					epochs=Config.TRAIN_STEPS, batch_size=Config.BATCH_SIZE, seed=0, verbose=True):
+	"""
+    Trains the MLP on both heads with Adam, the outcome loss being masked on control-only samples.
+
+    Parameters:
+    phi_data (tuple): (r1, r2, phi) from make_dataset().
+    outcome_data (tuple): (r1, r2, defender_wins) from make_dataset().
+    layer_sizes (list): Sizes of the hidden layers. Default is Config.LAYER_SIZES.
+    lr (float): Learning rate. Default is Config.LEARNING_RATE.
+    epochs (int): Number of passes over the data. Default is Config.TRAIN_STEPS.
+    batch_size (int): Minibatch size. Default is Config.BATCH_SIZE.
+    seed (int): Seed of the random generator.
+    verbose (bool): Print the loss every Config.PRINTING_FREQUENCY epochs.
+
+    Returns:
+    MLP: The trained network.
+    """
+	rng = np.random.default_rng(seed)
+	net = MLP([2] + list(layer_sizes) + [3], rng)
+
+	# one table for both heads, a column of masks tells which labels are present
+	r1p, r2p, phis = phi_data
+	r1o, r2o, wins = outcome_data
+	X = np.concatenate([_features(r1p, r2p), _features(r1o, r2o)])
+	Y = np.concatenate([np.stack([np.cos(phis), np.sin(phis), np.zeros(len(phis))], axis=-1),
+						np.stack([np.zeros(len(wins)), np.zeros(len(wins)), wins], axis=-1)])
+	has_phi = np.concatenate([np.ones(len(phis)), np.zeros(len(wins))])
+	has_out = 1 - has_phi
+	w_out = len(X)/max(len(wins), 1)   # the outcome labels are rarer, weight them up
+
+	params = net.W + net.b
+	m = [np.zeros_like(p) for p in params]
+	v = [np.zeros_like(p) for p in params]
+	beta1, beta2, eps, k = 0.9, 0.999, 1e-8, 0
+
+	for epoch in range(1, epochs + 1):
+		order = rng.permutation(len(X))
+		for i in range(0, len(X), batch_size):
+			idx = order[i:i + batch_size]
+			out, acts = net.forward(X[idx])
+			p = 1/(1 + np.exp(-out[:, 2]))
+			grad = np.zeros_like(out)
+			grad[:, :2] = 2*(out[:, :2] - Y[idx, :2])*has_phi[idx, None]
+			grad[:, 2] = w_out*(p - Y[idx, 2])*has_out[idx]
+			gW, gb = net.backward(acts, grad/len(idx))
+
+			k += 1
+			for j, g in enumerate(gW + gb):
+				m[j] = beta1*m[j] + (1 - beta1)*g
+				v[j] = beta2*v[j] + (1 - beta2)*g**2
+				params[j] -= lr*(m[j]/(1 - beta1**k))/(np.sqrt(v[j]/(1 - beta2**k)) + eps)
+
+		if verbose and epoch%Config.PRINTING_FREQUENCY == 0:
+			out, _ = net.forward(X)
+			mse = np.sum((out[:, :2] - Y[:, :2])**2*has_phi[:, None])/has_phi.sum()
+			acc = np.sum(((out[:, 2] > 0) == (Y[:, 2] > 0.5))*has_out)/max(has_out.sum(), 1)
+			print('epoch %d: control mse %.4f, outcome accuracy %.3f'%(epoch, mse, acc))
+
+	return net
+
+
+def model_path(model_dir=Config.MODEL_DIR, model_file=Config.MODEL_FILE):
+	return os.path.join(model_dir, model_file + '.npz')
+
+def save_surrogate(net, fname=None):
+	"""
+    Saves the network, the bounds of its training domain and the cells of calibrate_surrogate().
+    """
+	fname = model_path() if fname is None else fname
+	if os.path.dirname(fname) and not os.path.isdir(os.path.dirname(fname)):
+		os.makedirs(os.path.dirname(fname))
+	extra = {'trust': net.trust, 'tol': net.tol} if hasattr(net, 'trust') else {}
+	net.save(fname, domain=np.array([R_LO, R_HI]), **extra)
+
+def load_surrogate(fname=None):
+	"""
+    Loads a network saved by save_surrogate().
+    """
+	net, data = MLP.load(model_path() if fname is None else fname)
+	net.domain = tuple(data['domain'])
+	if 'trust' in data.files:
+		net.trust, net.tol = data['trust'], float(data['tol'])
+	return net
+
+def calibrate_surrogate(net, n=200000, cells=TRUST_CELLS, tol=TRUST_TOL, seed=2):
+	"""
+    Measures the phi_D* error of the network against get_phi_batch on a grid of cells of the
+    domain, and keeps the cells it can be trusted in (stored on the network as net.trust).
+
+    Parameters:
+    net (MLP): The surrogate.
+    n (int): Number of random states of the calibration, drawn apart from the training data.
+    cells (int): Cells per axis of the domain. Default is TRUST_CELLS.
+    tol (float): Largest error of a trusted cell, in radians. Default is TRUST_TOL.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    float: Fraction of the calibration states in trusted cells.
+    """
+	lo, hi = getattr(net, 'domain', (R_LO, R_HI))
+	r1, r2 = sample_states(n, np.random.default_rng(seed), lo, hi)
+	err = np.abs((_predict(net, r1, r2)[0] - get_phi_batch(r1, r2) + pi) % (2*pi) - pi)
+	i, j = _cells(r1, r2, lo, hi, cells)
+	worst, count = np.zeros((cells, cells)), np.zeros((cells, cells))
+	np.maximum.at(worst, (i, j), err)
+	np.add.at(count, (i, j), 1)
+	bad = np.pad(worst > tol, 1)
+	trust = count > 0
+	for a in range(3):
+		for b in range(3):
+			trust &= ~bad[a:a + cells, b:b + cells]
+	net.trust, net.tol = trust, tol
+	return trust[i, j].mean()
+
+
+def _cells(r1, r2, lo, hi, cells):
+	h = (hi - lo)/cells
+	i = np.clip(((np.asarray(r1) - lo)/h).astype(int), 0, cells - 1)
+	j = np.clip(((np.asarray(r2) - lo)/h).astype(int), 0, cells - 1)
+	return i, j
+
+def trusted(r1, r2, net):
+	"""
+    True for the states where get_phi_surrogate uses the network: inside the domain, in a cell
+    whose calibration error is below net.tol.
+    """
+	if not hasattr(net, 'trust'):
+		raise ValueError('the surrogate is not calibrated, call calibrate_surrogate() first')
+	lo, hi = getattr(net, 'domain', (R_LO, R_HI))
+	i, j = _cells(r1, r2, lo, hi, len(net.trust))
+	return in_domain(r1, r2, lo, hi) & net.trust[i, j]
+
+def _predict(net, r1, r2):
+	lo, hi = getattr(net, 'domain', (R_LO, R_HI))
+	out, _ = net.forward(_features(r1, r2, lo, hi))
+	return np.arctan2(out[:, 1], out[:, 0]), 1/(1 + np.exp(-out[:, 2]))
+
+def get_phi_surrogate(r1, r2, net):
+	"""
+    phi_D* from the surrogate where it is trusted (see trusted()), from get_phi_batch elsewhere.
+
+    Parameters:
+    r1 (np.array): Radial distances of the defender from the target center.
+    r2 (np.array): Radial distances of the intruder from the target center.
+    net (MLP): Network from train_surrogate() or load_surrogate().
+
+    Returns:
+    np.array: The optimal control angles phi_D* for the defender.
+    """
+	r1, r2 = np.broadcast_arrays(np.atleast_1d(np.asarray(r1, dtype=float)), np.atleast_1d(np.asarray(r2, dtype=float)))
+	inside = trusted(r1, r2, net)
+	phi = np.zeros(r1.shape)
+	phi[inside] = _predict(net, r1[inside], r2[inside])[0]
+	if (~inside).any():
+		phi[~inside] = get_phi_batch(r1[~inside], r2[~inside])
+	return phi
+
+def outcome_surrogate(r1, r2, net, dt=None):
+	"""
+    Probability that the defender wins from (r1, r2), by integration outside the trained domain.
+
+    Returns:
+    np.array: P(defender wins), exactly 0 or 1 where the exact integration was used.
+    """
+	r1, r2 = np.broadcast_arrays(np.atleast_1d(np.asarray(r1, dtype=float)), np.atleast_1d(np.asarray(r2, dtype=float)))
+	inside = in_domain(r1, r2, *getattr(net, 'domain', (R_LO, R_HI)))
+	p = np.zeros(r1.shape)
+	p[inside] = _predict(net, r1[inside], r2[inside])[1]
+	if (~inside).any():
+		dt = recommended_dt() if dt is None else dt
+		_, _, _, winner = envelope_barrier_batch(r1[~inside], r2[~inside], dt=dt, attractor_tol=0.25, record=False)
+		p[~inside] = winner == DEFENDER
+	return p
+
+
+def validate_surrogate(net, n=5000, n_scalar=200, outcome_data=None, seed=1):
+	"""
+    Prints and returns the error of the surrogate against the exact solvers, and its speed.
+
+    Parameters:
+    net (MLP): The surrogate.
+    n (int): Number of random states compared with get_phi_batch.
+    n_scalar (int): Number of random states compared with the scalar get_phi.
+    outcome_data (tuple): Held-out (r1, r2, defender_wins) for the outcome accuracy, optional.
+    seed (int): Seed of the random generator.
+
+    Returns:
+    dict: Error statistics (radians) and timings (seconds per state).
+    """
+	rng = np.random.default_rng(seed)
+	r1, r2 = sample_states(n, rng)
+	wrap = lambda a: np.abs((a + pi) % (2*pi) - pi)
+
+	t0 = time.time()
+	phi_s = get_phi_surrogate(r1, r2, net)
+	t_sur = (time.time() - t0)/n
+	t0 = time.time()
+	phi_b = get_phi_batch(r1, r2)
+	t_batch = (time.time() - t0)/n
+	err = wrap(phi_s - phi_b)
+	err_net = wrap(_predict(net, r1, r2)[0] - phi_b)
+	used = trusted(r1, r2, net)
+
+	t0 = time.time()
+	phi_e = np.array([float(np.ravel(get_phi(a, b))[0]) for a, b in zip(r1[:n_scalar], r2[:n_scalar])])
+	t_exact = (time.time() - t0)/n_scalar
+	err_e = wrap(phi_s[:n_scalar] - phi_e)
+
+	report = {'median': np.median(err), 'p95': np.percentile(err, 95), 'max': err.max(),
+			  'net_p95': np.percentile(err_net, 95), 'net_max': err_net.max(), 'trusted': used.mean(),
+			  'median_vs_get_phi': np.median(err_e), 'p95_vs_get_phi': np.percentile(err_e, 95),
+			  't_surrogate': t_sur, 't_get_phi_batch': t_batch, 't_get_phi': t_exact}
+	print('network alone vs get_phi_batch: p95 %.4f, max %.4f rad'%(report['net_p95'], report['net_max']))
+	print('network used for %.1f%% of the states (tol %.2f rad)'%(100*report['trusted'], net.tol))
+	print('phi_D* error vs get_phi_batch: median %.4f, p95 %.4f, max %.4f rad'%(report['median'], report['p95'], report['max']))
+	print('phi_D* error vs get_phi:       median %.4f, p95 %.4f rad'%(report['median_vs_get_phi'], report['p95_vs_get_phi']))
+	if outcome_data is not None:
+		p = outcome_surrogate(outcome_data[0], outcome_data[1], net)
+		report['outcome_accuracy'] = np.mean((p > 0.5) == (outcome_data[2] > 0.5))
+		print('outcome accuracy: %.3f'%report['outcome_accuracy'])
+	print('time per state: surrogate %.2e s, get_phi_batch %.2e s, get_phi %.2e s (%.0fx faster)'
+		  %(t_sur, t_batch, t_exact, t_exact/t_sur))
+	return report
+
+
+if __name__ == '__main__':
+
+	phi_data, outcome_data = make_dataset()
+	n_train = int(0.8*len(outcome_data[0]))
+	train_out = tuple(a[:n_train] for a in outcome_data)
+	test_out = tuple(a[n_train:] for a in outcome_data)
+
+	net = train_surrogate(phi_data, train_out)
+	calibrate_surrogate(net)
+	save_surrogate(net)
+	validate_surrogate(load_surrogate(), outcome_data=test_out)
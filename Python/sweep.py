@@ -0,0 +1,350 @@
+'''
+Sweeps over Config variants and initial conditions, run by any number of workers
+on any number of hosts sharing one directory.
+
+A sweep is a directory of work units:
+
+    root/units/<unit>.json      Config overrides and a chunk of initial (rho_D, rho_I)
+    root/leases/<unit>.json     owner and expiry time of a claimed unit
+    root/results/<unit>.npz     winner, number of steps and terminal state of every condition
+    root/workers/<worker>.json  progress of every worker, for the throughput report
+    root/queue.lock             lock file serializing the claims
+
+Claims and lease renewals happen while holding an fcntl lock on queue.lock,
+which is honoured across hosts by NFS (lockd or v4) and by local filesystems.
+A lease expires when its worker stops renewing it (crash, lost host), after
+which any worker may claim the unit again. Results are written to a temporary
+file and renamed into place, and a unit is never claimed once its result exists,
+so a unit computed twice only overwrites its result with the same numbers.
+
+    python sweep.py init ROOT           create the demo sweep (three values of VI)
+    python sweep.py work ROOT           run a worker until no unit is left
+    python sweep.py status ROOT         progress and aggregate throughput
+    python sweep.py demo ROOT -n 4      init, then run 4 local workers, one of them crashing
+'''
+
+import os
+import json
+import time
+import fcntl
+import socket
+import argparse
+import importlib
+import threading
+import numpy as np
+from Config import Config
+from timestep import recommended_dt
+
+# values of Config before any override, restored when a worker changes variant
+_DEFAULTS = {k: v for k, v in vars(Config).items() if not k.startswith('_')}
+
+
+def _path(root, kind, name=None):
+	return os.path.join(root, kind) if name is None else os.path.join(root, kind, name)
+
+def _done(root):
+	# units with a result, leaving out the temporary files of results being written
+	return set(f[:-4] for f in os.listdir(_path(root, 'results')) if f.endswith('.npz') and '.tmp' not in f)
+
+def _write_json(fname, obj):
+	# write then rename, so readers never see half a file
+	tmp = '%s.%s.%d.tmp'%(fname, socket.gethostname(), os.getpid())
+	with open(tmp, 'w') as f:
+		json.dump(obj, f)
+	os.replace(tmp, fname)
+
+def _read_json(fname):
+	try:
+		with open(fname) as f:
+			return json.load(f)
+	except (OSError, ValueError):
+		return None
+
+
+class QueueLock(object):
+	"""
+    Exclusive fcntl lock on root/queue.lock, used as a context manager.
+    """
+	def __init__(self, root):
+		self.fname = _path(root, 'queue.lock')
+
+	def __enter__(self):
+		self.f = open(self.fname, 'a')
+		fcntl.lockf(self.f, fcntl.LOCK_EX)
+		return self
+
+	def __exit__(self, *exc):
+		fcntl.lockf(self.f, fcntl.LOCK_UN)
+		self.f.close()
+
+
+def create_sweep(root, variants, r1, r2, chunk=64, dt=None, t_max=60., attractor_tol=0.25):
+	"""
+    Creates (or extends) a sweep: every variant of Config with every feasible initial condition.
+
+    Parameters:
+    root (str): Directory shared by the workers.
+    variants (list): Dicts of Config overrides, e.g. [{'VI': 1.5}, {'VI': 1.3}].
+    r1 (np.array): Initial radial distances of the defender.
+    r2 (np.array): Initial radial distances of the intruder.
+    chunk (int): Number of initial conditions per work unit. Default is 64.
+    dt (float): Time step for integration. Default is the step recommended for each variant by
+                timestep.py, or timestep.SAFE_DT when no study was stored.
+    t_max (float): Time horizon. Default is 60 seconds.
+    attractor_tol (float): Passed to envelope_barrier_batch. Default is 0.25.
+
+    Returns:
+    int: Number of units in the sweep.
+    """
+	for kind in ('units', 'leases', 'results', 'workers'):
+		if not os.path.isdir(_path(root, kind)):
+			os.makedirs(_path(root, kind))
+	r1, r2 = np.ravel(r1).astype(float), np.ravel(r2).astype(float)
+
+	n = 0
+	for v, overrides in enumerate(variants):
+		# Phase II starts on the capture circle of this variant, see equation (19)
+		cap = overrides.get('CAP_RANGE', _DEFAULTS['CAP_RANGE'])
+		ok = (np.abs(r1 - r2) < cap) & (r1 + r2 > cap)
+		dt_v = recommended_dt(overrides) if dt is None else dt
+		a, b = r1[ok], r2[ok]
+		for c, i in enumerate(range(0, len(a), chunk)):
+			unit = 'v%03d_c%05d'%(v, c)
+			fname = _path(root, 'units', unit + '.json')
+			if not os.path.exists(fname):
+				_write_json(fname, {'variant': overrides, 'r1': a[i:i + chunk].tolist(), 'r2': b[i:i + chunk].tolist(),
+									'dt': dt_v, 't_max': t_max, 'attractor_tol': attractor_tol})
+			n += 1
+	return n
+
+
+def claim_unit(root, worker, lease=300.):
+	"""
+    Claims one unit that has no result and no valid lease.
+
+    Parameters:
+    root (str): Sweep directory.
+    worker (str): Name of the claiming worker.
+    lease (float): Seconds the claim is valid without being renewed. Default is 300.
+
+    Returns:
+    str: Name of the claimed unit, None if there is nothing left to claim.
+    """
+	units = sorted(f[:-5] for f in os.listdir(_path(root, 'units')) if f.endswith('.json'))
+	done = _done(root)
+	# different workers start from different places to find free units faster
+	start = hash(worker) % max(len(units), 1)
+	with QueueLock(root):
+		now = time.time()
+		for unit in units[start:] + units[:start]:
+			if unit in done:
+				continue
+			held = _read_json(_path(root, 'leases', unit + '.json'))
+			if held is not None and held['expires'] > now:
+				continue
+			_write_json(_path(root, 'leases', unit + '.json'),
+						{'worker': worker, 'expires': now + lease, 'stolen_from': held and held['worker']})
+			return unit
+	return None
+
+def renew_lease(root, unit, worker, lease=300.):
+	"""
+    Extends the lease of a unit, if the worker still owns it.
+
+    Returns:
+    bool: False if the lease was lost to another worker.
+    """
+	fname = _path(root, 'leases', unit + '.json')
+	with QueueLock(root):
+		held = _read_json(fname)
+		if held is None or held['worker'] != worker:
+			return False
+		held['expires'] = time.time() + lease
+		_write_json(fname, held)
+		return True
+
+
+# worker side: Config overrides are applied by reloading the modules that read Config at import
+_loaded = [None]
+
+def apply_variant(overrides):
+	"""
+    Sets Config to its defaults plus the overrides, and reloads vecgram and envelope.
+
+    Returns:
+    module: The reloaded envelope module.
+    """
+	import vecgram, envelope
+	key = json.dumps(overrides, sort_keys=True)
+	if _loaded[0] != key:
+		for k, v in _DEFAULTS.items():
+			setattr(Config, k, v)
+		for k, v in overrides.items():
+			setattr(Config, k, v)
+		importlib.reload(vecgram)
+		importlib.reload(envelope)
+		_loaded[0] = key
+	return envelope
+
+def run_unit(spec):
+	"""
+    Integrates the initial conditions of one unit.
+
+    Returns:
+    dict: Arrays r1, r2, winner, lengths and the terminal states S.
+    """
+	envelope = apply_variant(spec['variant'])
+	S, lengths, ts, winner = envelope.envelope_barrier_batch(spec['r1'], spec['r2'], dt=spec['dt'], t_max=spec['t_max'],
+															 attractor_tol=spec['attractor_tol'], record=False)
+	return {'r1': np.asarray(spec['r1']), 'r2': np.asarray(spec['r2']), 'winner': winner, 'lengths': lengths, 'S': S}
+
+def save_result(root, unit, result):
+	"""
+    Writes the result of a unit atomically; writing the same unit twice is harmless.
+    """
+	fname = _path(root, 'results', unit + '.npz')
+	tmp = '%s.%s.%d.tmp.npz'%(fname[:-4], socket.gethostname(), os.getpid())
+	np.savez(tmp, **result)
+	os.replace(tmp, fname)
+
+
+def _remaining(root):
+	units = set(f[:-5] for f in os.listdir(_path(root, 'units')) if f.endswith('.json'))
+	return len(units - _done(root))
+
+def run_worker(root, worker=None, lease=300., max_units=None, wait=True, crash_after=None):
+	"""
+    Claims and runs units until none is left.
+
+    Parameters:
+    root (str): Sweep directory.
+    worker (str): Name of the worker. Default is host:pid.
+    lease (float): Lease duration in seconds, renewed every lease/3 while a unit runs. Default is 300.
+    max_units (int): Stop after this many units. Default is None, no limit.
+    wait (bool): When every open unit is leased, wait for the leases to end instead of leaving.
+    crash_after (int): For testing, exit abruptly (holding a lease) when starting this unit number.
+
+    Returns:
+    dict: Progress of the worker, as written to root/workers/<worker>.json.
+    """
+	worker = '%s:%d'%(socket.gethostname(), os.getpid()) if worker is None else worker
+	stats = {'worker': worker, 'units': 0, 'conditions': 0, 'start': time.time(), 'busy': 0.}
+	stats_file = _path(root, 'workers', worker.replace(':', '_').replace('/', '_') + '.json')
+
+	while max_units is None or stats['units'] < max_units:
+		unit = claim_unit(root, worker, lease)
+		if unit is None:
+			# the units leased by other workers come back if those workers die
+			if not wait or _remaining(root) == 0:
+				break
+			time.sleep(min(lease/3, 10.))
+			continue
+		if crash_after is not None and stats['units'] == crash_after:
+			os._exit(1)
+
+		# heartbeat: keep the lease while the unit runs
+		stop = threading.Event()
+		def heartbeat():
+			while not stop.wait(lease/3):
+				if not renew_lease(root, unit, worker, lease):
+					return
+		hb = threading.Thread(target=heartbeat, daemon=True)
+		hb.start()
+
+		t0 = time.time()
+		spec = _read_json(_path(root, 'units', unit + '.json'))
+		save_result(root, unit, run_unit(spec))
+		stop.set()
+		hb.join()
+
+		stats['units'] += 1
+		stats['conditions'] += len(spec['r1'])
+		stats['busy'] += time.time() - t0
+		stats['end'] = time.time()
+		_write_json(stats_file, stats)
+	return stats
+
+
+def sweep_status(root):
+	"""
+    Progress of a sweep and the aggregate throughput of its workers.
+
+    Returns:
+    dict: Number of units done, leased, with an expired lease and pending; number of workers,
+          conditions computed and conditions per second over the wall time of the sweep.
+    """
+	units = [f[:-5] for f in os.listdir(_path(root, 'units')) if f.endswith('.json')]
+	done = _done(root)
+	now, leased, expired = time.time(), 0, 0
+	for unit in units:
+		if unit in done:
+			continue
+		held = _read_json(_path(root, 'leases', unit + '.json'))
+		if held is not None:
+			leased += held['expires'] > now
+			expired += held['expires'] <= now
+	workers = [w for w in (_read_json(_path(root, 'workers', f)) for f in os.listdir(_path(root, 'workers'))
+						   if f.endswith('.json')) if w is not None]
+	n_cond = sum(w['conditions'] for w in workers)
+	wall = max([w.get('end', w['start']) for w in workers] or [0]) - min([w['start'] for w in workers] or [0])
+	return {'units': len(units), 'done': len(done), 'leased': leased, 'expired': expired,
+			'pending': len(units) - len(done) - leased - expired, 'workers': len(workers),
+			'conditions': n_cond, 'rate': n_cond/wall if wall > 0 else 0.}
+
+def collect(root):
+	"""
+    Gathers the results of a sweep, grouped by variant.
+
+    Returns:
+    dict: For every variant (as a json string of its overrides), the concatenated arrays
+          r1, r2, winner, lengths and S of its finished units.
+    """
+	out = {}
+	for f in sorted(os.listdir(_path(root, 'results'))):
+		if not f.endswith('.npz') or '.tmp' in f:
+			continue
+		spec = _read_json(_path(root, 'units', f[:-4] + '.json'))
+		key = json.dumps(spec['variant'], sort_keys=True)
+		res = np.load(_path(root, 'results', f))
+		group = out.setdefault(key, {k: [] for k in res.files})
+		for k in res.files:
+			group[k].append(res[k])
+	return {key: {k: np.concatenate(v) for k, v in group.items()} for key, group in out.items()}
+
+
+def _demo_sweep(root):
+	r1, r2 = np.meshgrid(np.linspace(0.5, 10, 40), np.linspace(0.5, 10, 40))
+	return create_sweep(root, [{'VI': 1.5}, {'VI': 1.3}, {'VI': 1.8}], r1, r2, chunk=32)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Sweep over Config variants and initial conditions on a shared directory.')
+	parser.add_argument('cmd', choices=['init', 'work', 'status', 'demo'])
+	parser.add_argument('root')
+	parser.add_argument('-n', type=int, default=4, help='number of local workers (demo)')
+	parser.add_argument('--lease', type=float, default=300., help='lease duration in seconds')
+	args = parser.parse_args()
+
+	if args.cmd == 'init':
+		print('%d units'%_demo_sweep(args.root))
+	elif args.cmd == 'work':
+		print(run_worker(args.root, lease=args.lease))
+	elif args.cmd == 'demo':
+		import multiprocessing as mp
+		print('%d units'%_demo_sweep(args.root))
+		t0 = time.time()
+		# the first worker dies holding a lease, which expires and is picked up by the others
+		procs = [mp.Process(target=run_worker, args=(args.root, 'local%d'%i, 5., None, True, 1 if i == 0 else None))
+				 for i in range(args.n)]
+		for p in procs:
+			p.start()
+		for p in procs:
+			p.join()
+		print('%.1f s, exit codes %s'%(time.time() - t0, [p.exitcode for p in procs]))
+
+	status = sweep_status(args.root)
+	print('%(done)d/%(units)d units done, %(leased)d leased, %(expired)d expired, %(pending)d pending'%status)
+	print('%(workers)d workers, %(conditions)d conditions, %(rate).1f conditions/s'%status)
+	if args.cmd in ('status', 'demo'):
+		from envelope import DEFENDER
+		for key, res in collect(args.root).items():
+			print('%s: %d conditions, defender wins %.1f%%'%(key, len(res['winner']), 100*np.mean(res['winner'] == DEFENDER)))
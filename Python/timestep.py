@@ -0,0 +1,220 @@
+'''
+Convergence study of the time step of the optimal play.
+
+envelope_barrier(..) integrates with dt = 0.05, the sweeps with Config.TIME_STEP,
+and the error of either was never measured. Here the scenarios of the thesis
+are integrated with envelope_barrier_batch at dt0, dt0/2, dt0/4, .. and the
+error of every step is estimated by Richardson extrapolation of
+
+    the terminal time           when the game is decided (or the attractor reached)
+    the terminal positions      (x_D, y_D, x_I, y_I) at that time
+
+between successive levels: with q(h) - q* ~ C h^p,
+
+    |q(h) - q*| ~ |q(h) - q(h/2)| / (1 - 2^-p)
+
+the order p being observed from three successive levels. The stopping test of
+envelope_winner has a margin of dt*vi, so the order is about 1 when the game
+ends across the barrier, and about 1/2 when it ends tangentially, as in the
+intruder winning scenario. With attractor_tol set, the defender winning
+scenario ends on a small circle around the attractor, which the trajectory
+approaches slowly, and its terminal time is then mostly the error of the test;
+the study stops by the rules of the game alone by default. The largest step whose
+error estimates, and those of every finer step, are within the tolerances, and
+which gives every scenario the winner of the finest step, is recommended and
+stored in timestep.json under the hash of Config, where recommended_dt(..) finds
+it. sweep.py, surrogate.py, outcome_index.py, outcome_map.py and the ensemble
+demo take their default step from there, and from SAFE_DT for a Config that was
+never studied. Config.TIME_STEP = 0.1 is too coarse: the defender winning
+scenario stops at 7.2 s instead of running to the horizon. At 0.05, the step of
+envelope_barrier, every terminal time is within 0.26 s of its extrapolation.
+
+    python timestep.py                          study, recommend and store for Config
+    python timestep.py --tol-t 0.25 --set VI=1.3 for a variant of Config
+'''
+
+import os
+import json
+import time
+import argparse
+import numpy as np
+from Config import Config, config_hash
+
+# the three scenarios of the thesis, (rho_D, rho_I) at t = 0, as CASES in build.py
+SCENARIOS = {'D_win': (6.1, 6.6), 'barrier': (6.5, 6.54), 'I_win': (6.5, 6.1)}
+
+STORE = 'timestep.json'
+# step used when no study was stored for Config
+SAFE_DT = 0.05
+
+
+def terminal_values(r1, r2, dt, t_max=60., attractor_tol=None):
+	"""
+    Integrates the scenarios with one time step.
+
+    Returns:
+    tuple: Terminal time (K,), terminal positions (K, 4) as (x_D, y_D, x_I, y_I), and winner (K,).
+    """
+	# imported here so that a variant of Config set before the call is used
+	from envelope import envelope_barrier_batch
+	S, lengths, ts, winner = envelope_barrier_batch(r1, r2, dt=dt, t_max=t_max, attractor_tol=attractor_tol, record=False)
+	x = np.stack([S[:, 0]*np.cos(S[:, 1]), S[:, 0]*np.sin(S[:, 1]),
+				  S[:, 2]*np.cos(S[:, 3]), S[:, 2]*np.sin(S[:, 3])], axis=-1)
+	return ts[lengths - 1], x, winner
+
+def richardson(q, p_min=0.5, p_max=8.):
+	"""
+    Richardson error estimates of values computed with halving steps.
+
+    Parameters:
+    q (np.array): Values of shape (L, K) or (L, K, d) for the steps h, h/2, .., h/2^(L-1);
+                  vectors are compared with the Euclidean norm.
+    p_min, p_max (float): Bounds of the observed order.
+
+    Returns:
+    tuple: Error estimates of the L-1 coarsest levels (L-1, K), observed order (K,) and the
+           extrapolated values (K,) or (K, d).
+    """
+	q = np.asarray(q, dtype=float)
+	diff = q[:-1] - q[1:]
+	dn = np.linalg.norm(diff, axis=-1) if q.ndim == 3 else np.abs(diff)
+	# order of every triplet of levels, median over the triplets, 1 when undefined
+	with np.errstate(divide='ignore', invalid='ignore'):
+		p_k = np.log2(dn[:-1]/dn[1:])
+	p_k[~np.isfinite(p_k)] = np.nan
+	p = np.full(q.shape[1], 1.)
+	ok = np.isfinite(p_k).any(axis=0) if len(p_k) else np.zeros(q.shape[1], dtype=bool)
+	if ok.any():
+		p[ok] = np.clip(np.nanmedian(p_k[:, ok], axis=0), p_min, p_max)
+	f = 1/(1 - 2.**-p)
+	ext = q[-1] + ((q[-1] - q[-2]).T/(2.**p - 1)).T
+	return dn*f, p, ext
+
+def convergence_study(scenarios=SCENARIOS, dt0=0.2, levels=6, t_max=60., attractor_tol=None, verbose=True):
+	"""
+    Integrates the scenarios with the steps dt0, dt0/2, .., and estimates the error of every step.
+
+    Parameters:
+    scenarios (dict): Initial (rho_D, rho_I) of every scenario. Default is SCENARIOS.
+    dt0 (float): Coarsest time step. Default is 0.2 seconds.
+    levels (int): Number of steps, at least 3. Default is 6.
+    t_max (float): Time horizon. Default is 60 seconds.
+    attractor_tol (float): Passed to envelope_barrier_batch. Default is None.
+    verbose (bool): Print the time spent at every level.
+
+    Returns:
+    dict: 'names', 'dts' (L,), 't_end' (L, K), 'x_end' (L, K, 4), 'winner' (L, K); the error
+          estimates 'err_t', 'err_x' (L-1, K), the observed orders 'p_t', 'p_x' (K,) and the
+          extrapolated 't_star' (K,).
+    """
+	if levels < 3:
+		raise ValueError('levels must be at least 3 to observe the order')
+	names = list(scenarios)
+	r1 = np.array([scenarios[n][0] for n in names])
+	r2 = np.array([scenarios[n][1] for n in names])
+	dts = dt0/2.**np.arange(levels)
+
+	t_end, x_end, winner = [], [], []
+	for dt in dts:
+		t0 = time.time()
+		t, x, w = terminal_values(r1, r2, dt, t_max, attractor_tol)
+		t_end.append(t)
+		x_end.append(x)
+		winner.append(w)
+		if verbose:
+			print('dt = %.4f: %.2f s'%(dt, time.time() - t0))
+
+	err_t, p_t, t_star = richardson(t_end)
+	err_x, p_x, _ = richardson(x_end)
+	return {'names': names, 'dts': dts, 't_end': np.asarray(t_end), 'x_end': np.asarray(x_end),
+			'winner': np.asarray(winner), 'err_t': err_t, 'err_x': err_x, 'p_t': p_t, 'p_x': p_x,
+			't_star': t_star}
+
+def recommend_dt(study, tol_t=0.5, tol_x=0.5):
+	"""
+    Largest step of a study meeting the tolerances.
+
+    Parameters:
+    study (dict): Output of convergence_study().
+    tol_t (float): Tolerance on the terminal time, in seconds. Default is 0.5.
+    tol_x (float): Tolerance on the terminal positions. Default is 0.5, a quarter of the capture radius.
+
+    Returns:
+    float: The step, or None if only the finest step (which has no estimate) could be used.
+    """
+	ok = (study['err_t'] <= tol_t) & (study['err_x'] <= tol_x) & (study['winner'][:-1] == study['winner'][-1])
+	ok = ok.all(axis=1)
+	# the step and every finer one must pass
+	good = np.flatnonzero(np.logical_and.accumulate(ok[::-1])[::-1])
+	return float(study['dts'][good[0]]) if len(good) else None
+
+def print_study(study):
+	"""
+    Prints the error estimates of every step and scenario.
+    """
+	print('%8s'%'dt' + ''.join('%24s'%n for n in study['names']))
+	for k, dt in enumerate(study['dts'][:-1]):
+		print('%8.4f'%dt + ''.join('   t %6.3f  err %5.3f/%5.3f'%(t, et, ex) for t, et, ex in
+								   zip(study['t_end'][k], study['err_t'][k], study['err_x'][k])))
+	print('observed order: time ' + ', '.join('%.2f'%p for p in study['p_t'])
+		  + '; positions ' + ', '.join('%.2f'%p for p in study['p_x']))
+	print('extrapolated terminal time: ' + ', '.join('%.3f'%t for t in study['t_star']))
+
+
+def _read_store(fname):
+	if not os.path.exists(fname):
+		return {}
+	with open(fname) as f:
+		return json.load(f)
+
+def store_dt(dt, study, tol_t, tol_x, overrides=None, fname=STORE):
+	"""
+    Stores the recommended step of a study under the hash of Config (with the overrides applied).
+    """
+	table = _read_store(fname)
+	table[config_hash(overrides)] = {'dt': dt, 'tol_t': tol_t, 'tol_x': tol_x, 'overrides': overrides or {},
+									 'dts': study['dts'].tolist(), 'err_t': study['err_t'].max(axis=1).tolist(),
+									 'err_x': study['err_x'].max(axis=1).tolist(), 'date': time.ctime()}
+	tmp = fname + '.tmp'
+	with open(tmp, 'w') as f:
+		json.dump(table, f, indent=1)
+	os.replace(tmp, fname)
+
+def recommended_dt(overrides=None, default=SAFE_DT, fname=STORE):
+	"""
+    Step stored by a convergence study for Config (with the overrides applied).
+
+    Parameters:
+    overrides (dict): Config overrides of the variant. Default is None, Config itself.
+    default (float): Returned when no study was stored. Default is SAFE_DT.
+    fname (str): Store of the studies. Default is timestep.json.
+
+    Returns:
+    float: The step.
+    """
+	entry = _read_store(fname).get(config_hash(overrides))
+	return default if entry is None or entry['dt'] is None else entry['dt']
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Time step convergence study.')
+	parser.add_argument('--dt0', type=float, default=0.2, help='coarsest step')
+	parser.add_argument('--levels', type=int, default=6, help='number of halvings')
+	parser.add_argument('--tol-t', type=float, default=0.5, help='tolerance on the terminal time')
+	parser.add_argument('--tol-x', type=float, default=0.5, help='tolerance on the terminal positions')
+	parser.add_argument('--set', nargs='*', default=[], metavar='KEY=VALUE', help='Config overrides')
+	args = parser.parse_args()
+
+	overrides = {k: float(v) for k, v in (s.split('=') for s in args.set)}
+	if overrides:
+		from sweep import apply_variant
+		apply_variant(overrides)
+
+	study = convergence_study(dt0=args.dt0, levels=args.levels)
+	print_study(study)
+	dt = recommend_dt(study, args.tol_t, args.tol_x)
+	if dt is None:
+		print('no step meets the tolerances, refine with a smaller --dt0 or more --levels')
+	else:
+		print('recommended dt = %g (Config.TIME_STEP = %g)'%(dt, Config.TIME_STEP))
+	store_dt(dt, study, args.tol_t, args.tol_x, overrides)
@@ -185,6 +185,165 @@ def get_phi_max(r1, r2):
     
     return minimize(slope_n, 0).x
 
+
+'''
+batched versions of velocity_vec and get_phi
+input: rho_D, rho_I (and phi_D) as numpy arrays of any (broadcastable) shape
+output: arrays of the same shape
+
+these are used when many states have to be evaluated at once, e.g. when a whole
+family of trajectories is integrated together. get_phi_batch replaces the two
+scipy optimizations of get_phi by a search over a grid of phi followed by a
+golden-section refinement, so it has no python loop over the states.
+'''
+
+# the acos arguments of Eq (21), clipped so that states lying exactly on the
+# Phase II constraints (|rho_D - rho_I| = r, rho_D + rho_I = r) do not give nan
+# d is the defender-intruder distance, which is r everywhere in the reduced game
+def _alpha_beta_batch(r1, r2, d=r):
+    alpha = np.arccos(np.clip((d ** 2 + r1 ** 2 - r2 ** 2) / (2 * r1 * d), -1., 1.))
+    beta = pi - np.arccos(np.clip((d ** 2 + r2 ** 2 - r1 ** 2) / (2 * r2 * d), -1., 1.))
+    return alpha, beta
+
+def velocity_vec_batch(r1, r2, phi, backward=False, d=r):
+    """
+    Vectorized velocity_vec, evaluated elementwise over arrays of states and controls.
+
+    Parameters:
+    r1 (np.array): Radial distances of the defender from the target center.
+    r2 (np.array): Radial distances of the intruder from the target center.
+    phi (np.array): The defender's control input angles.
+    backward (bool): Flag to compute velocity in the backward direction (for reverse time simulation).
+    d (float or np.array): Distance between the defender and the intruder. Default is the capture radius r.
+
+    Returns:
+    tuple: Arrays of velocity components (vr1, vr2, vtht1, vtht2) for the defender and intruder.
+    """
+    r1, r2, phi, d = np.broadcast_arrays(np.asarray(r1, dtype=float), np.asarray(r2, dtype=float),
+                                         np.asarray(phi, dtype=float), np.asarray(d, dtype=float))
+    psi = -np.arccos(vd / vi * np.cos(phi))
+    alpha, beta = _alpha_beta_batch(r1, r2, d)
+
+    sign = 1. if backward else -1.
+    vr1 = sign * vd * np.cos(alpha + phi)
+    vr2 = sign * vi * np.cos(beta + psi)
+    vtht1 = sign * vd * np.sin(alpha + phi) / r1
+    vtht2 = sign * vi * np.sin(beta + psi) / r2
+
+    return vr1, vr2, vtht1, vtht2
+
+# slope_p of get_phi, for arrays of phi and the angles alpha, beta of Eq (21)
+def _slope_batch(phi, alpha, beta):
+    psi = -np.arccos(vd / vi * np.cos(phi))
+    return np.arctan2(-vi * np.cos(beta + psi), -vd * np.cos(alpha + phi))
+
+# slope_p on a grid of phi, one row per state, with cos(a + b) expanded so that
+# only outer products are needed
+def _grid_slope(grid, alpha, beta):
+    psi = -np.arccos(vd / vi * np.cos(grid))
+    ca, sa, cb, sb = np.cos(alpha)[:, None], np.sin(alpha)[:, None], np.cos(beta)[:, None], np.sin(beta)[:, None]
+    return np.arctan2(-vi * (cb * np.cos(psi) - sb * np.sin(psi)),
+                      -vd * (ca * np.cos(grid) - sa * np.sin(grid)))
+
+# tangent of the vectogram with the largest (sign = 1) or smallest (sign = -1)
+# polar angle. The angles on the grid are unwrapped along the closed curve, so
+# that the branch cut of atan2 at +-pi does not create spurious extrema, then the
+# extremum is refined by a golden-section search on [grid[idx] - h, grid[idx] + h],
+# one new evaluation of the slope per iteration
+def _tangent(vals, unwrapped, grid, alpha, beta, sign, n_refine):
+    h = grid[1] - grid[0]
+    idx = np.argmax(sign * unwrapped, axis=1)
+    rows = np.arange(len(idx))
+    ref_wrapped, ref = vals[rows, idx], unwrapped[rows, idx]
+
+    def f(phi):
+        return sign * (ref + (_slope_batch(phi, alpha, beta) - ref_wrapped + pi) % (2 * pi) - pi)
+
+    g = (sqrt(5) - 1) / 2
+    a, b = grid[idx] - h, grid[idx] + h
+    c, e = b - g * (b - a), a + g * (b - a)
+    fc, fe = f(c), f(e)
+    for _ in range(n_refine):
+        keep_left = fc > fe
+        a, b = np.where(keep_left, a, c), np.where(keep_left, e, b)
+        new = np.where(keep_left, b - g * (b - a), a + g * (b - a))
+        fnew = f(new)
+        c, e, fc, fe = (np.where(keep_left, new, e), np.where(keep_left, c, new),
+                        np.where(keep_left, fnew, fe), np.where(keep_left, fc, fnew))
+    phi = (a + b) / 2
+    return phi, sign * f(phi)
+
+def vectogram_batch(r1, r2, d=r, n_grid=360, n_refine=24, chunk=4096):
+    """
+    Vectorized algorithm 3 with its by-products: phi_D*, the angle between the semipermeable
+    directions (semipermeable_r) and the "set 0" branch of get_phi, in one pass over the states.
+
+    The spread of the tangents is measured on the unwrapped polar angle, so the semipermeable
+    angle does not jump at the branch cut of atan2 as semipermeable_r can. Where the vectogram
+    winds around the origin no tangent exists and the angle is set to -pi.
+
+    Parameters:
+    r1 (np.array): Radial distances of the defender from the target center.
+    r2 (np.array): Radial distances of the intruder from the target center.
+    d (float or np.array): Distance between the defender and the intruder. Default is the capture radius r.
+    n_grid (int): Number of grid points on [-pi, pi) used to locate the tangents.
+    n_refine (int): Number of golden-section iterations used to refine each tangent.
+    chunk (int): Number of states processed together, bounds the memory of the grid evaluation.
+
+    Returns:
+    tuple: phi_D* wrapped to [-pi, pi), the semipermeable angle, and True where get_phi sets
+           the control to 0; same shape as the inputs.
+    """
+    r1, r2, d = np.broadcast_arrays(np.asarray(r1, dtype=float), np.asarray(r2, dtype=float),
+                                    np.asarray(d, dtype=float))
+    shape = r1.shape
+    r1, r2, d = r1.ravel(), r2.ravel(), d.ravel()
+    phi, semi = np.zeros(r1.shape), np.zeros(r1.shape)
+    set0 = np.zeros(r1.shape, dtype=bool)
+    grid = np.linspace(-pi, pi, n_grid, endpoint=False)
+    for k in range(0, len(r1), chunk):
+        alpha, beta = _alpha_beta_batch(r1[k:k + chunk], r2[k:k + chunk], d[k:k + chunk])
+        vals = _grid_slope(grid, alpha, beta)
+        unwrapped = np.unwrap(vals, axis=1)
+
+        # the vectogram winds around the origin when the unwrapped angle does not
+        # come back to its start: then no tangent exists
+        turn = vals[:, 0] - vals[:, -1]
+        inside = np.abs(unwrapped[:, -1] + (turn + pi) % (2 * pi) - pi - unwrapped[:, 0]) > pi
+
+        phi_max_slope, u_p = _tangent(vals, unwrapped, grid, alpha, beta, 1., n_refine)
+        phi_min_slope, u_n = _tangent(vals, unwrapped, grid, alpha, beta, -1., n_refine)
+        ang_p = (u_p + pi) % (2 * pi) - pi
+
+        set0[k:k + chunk] = inside | (u_p - u_n > pi)
+        semi[k:k + chunk] = np.where(inside, -pi, pi - (u_p - u_n))
+        phi[k:k + chunk] = np.where(set0[k:k + chunk], 0.,
+                                    np.where(ang_p > 0, phi_max_slope, phi_min_slope))
+    phi = (phi + pi) % (2 * pi) - pi
+    return phi.reshape(shape), semi.reshape(shape), set0.reshape(shape)
+
+def get_phi_batch(r1, r2, d=r, n_grid=360, n_refine=24, chunk=4096):
+    """
+    Vectorized get_phi (algorithm 3) for arrays of states.
+
+    The two tangents are the global extrema of the unwrapped polar angle of the
+    vectogram. Where the scalar optimizer finds the same tangents (everywhere except
+    close to the branch cut of atan2) the result agrees with get_phi modulo 2*pi;
+    the returned angles are wrapped to [-pi, pi).
+
+    Parameters:
+    r1 (np.array): Radial distances of the defender from the target center.
+    r2 (np.array): Radial distances of the intruder from the target center.
+    d (float or np.array): Distance between the defender and the intruder. Default is the capture radius r.
+    n_grid (int): Number of grid points on [-pi, pi) used to locate the tangents.
+    n_refine (int): Number of golden-section iterations used to refine each tangent.
+    chunk (int): Number of states processed together, bounds the memory of the grid evaluation.
+
+    Returns:
+    np.array: The optimal control angles phi_D* for the defender, same shape as the inputs.
+    """
+    return vectogram_batch(r1, r2, d, n_grid, n_refine, chunk)[0]
+
 # this function is called by one_plot.py to generate one subfigure of Figure 12, 18, 20
 '''
 input: rho_D,  rho_I, paper notations, or